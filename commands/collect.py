@@ -12,6 +12,8 @@ import pyjq
 import urllib.parse
 from botocore.exceptions import ClientError, EndpointConnectionError, NoCredentialsError
 from shared.common import get_account, custom_serializer
+from shared.query import remove_manifest, write_manifest
+from shared.snapshots import DEFAULT_STORE, SnapshotStore
 from botocore.config import Config
 
 __description__ = "Run AWS API calls to collect data from the account"
@@ -222,6 +224,9 @@ def collect(arguments):
     make_directory("account-data")
     make_directory("account-data/{}".format(account_dir))
 
+    # Any existing manifest will be stale once new files are collected
+    remove_manifest(arguments.account_name)
+
     # Identify the default region used by global services such as IAM
     default_region = os.environ.get("AWS_REGION", "us-east-1")
     if "gov-" in default_region:
@@ -550,6 +555,16 @@ def collect(arguments):
                     summary,
                 )
 
+    print("* Writing manifest of collected files", flush=True)
+    manifest = write_manifest(arguments.account_name)
+
+    if arguments.snapshot:
+        print("* Adding the collected files to the snapshot store", flush=True)
+        snapshot_name = SnapshotStore(arguments.snapshot_store).store_account(
+            arguments.account_name, manifest=manifest
+        )
+        print("  Stored as snapshot {}".format(snapshot_name), flush=True)
+
     # Print summary
     print("--------------------------------------------------------------------")
     failures = []
@@ -614,6 +629,20 @@ def run(arguments):
         default="",
     )
 
+    parser.add_argument(
+        "--snapshot",
+        help="Also add the collected data as a new snapshot in the snapshot store",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--snapshot-store",
+        help="Directory of the snapshot store",
+        required=False,
+        type=str,
+        dest="snapshot_store",
+        default=DEFAULT_STORE,
+    )
+
     args = parser.parse_args(arguments)
 
     if not args.account_name:
@@ -12,6 +12,7 @@ from logging import CRITICAL
 from logging import getLogger
 from policyuniverse.policy import Policy
 from shared.common import parse_arguments, get_regions
+from shared.cytoscape import CytoscapeWriter
 from shared.query import query_aws, get_parameter_file
 from shared.nodes import Account, Region
 
@@ -343,11 +344,11 @@ def get_iam_graph(auth):
 
 
 def build_cytoscape_graph(iam_graph):
-    cytoscape_json = []
+    """Generates the cytoscape elements of the IAM graph"""
     for k in iam_graph:
         node = iam_graph[k]
         if len(node.children()) > 0 or len(node.parents()) > 0:
-            cytoscape_json.append(iam_graph[k].cytoscape_data())
+            yield iam_graph[k].cytoscape_data()
 
     for k in iam_graph:
         node = iam_graph[k]
@@ -355,9 +356,7 @@ def build_cytoscape_graph(iam_graph):
             edge = {
                 "data": {"source": node.key(), "target": child.key(), "type": "edge"}
             }
-            cytoscape_json.append(edge)
-
-    return cytoscape_json
+            yield edge
 
 
 def iam_report(accounts, config, args):
@@ -428,10 +427,8 @@ def iam_report(accounts, config, args):
     # This needs to be generated even if we don't show the graph,
     # because this data is needed for other functionality in this command
     iam_graph = get_iam_graph(json_account_auth_details)
-    cytoscape_json = build_cytoscape_graph(iam_graph)
-
-    with open(os.path.join("web", "account-data", "data.json"), "w") as outfile:
-        json.dump(cytoscape_json, outfile, indent=4)
+    with CytoscapeWriter(os.path.join("web", "account-data", "data.json")) as writer:
+        writer.write_all(build_cytoscape_graph(iam_graph))
 
     print("* Generating the rest of the report")
 
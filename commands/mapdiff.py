@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+
+from shared.common import parse_arguments
+from shared.map_diff import diff_maps, get_canonical_map
+from shared.query import DataArchive, set_data_source
+from shared.snapshots import Snapshot, SnapshotStore
+
+__description__ = (
+    "Find the nodes, edges and public exposures that changed between two collections"
+)
+
+# The name of the collected data in account-data/
+ACCOUNT_DATA = "account-data"
+
+
+def get_data_source(name, snapshot_store):
+    """
+    Returns the data source of a collection: account-data/, a zip or tar of it, or the
+    newest snapshot in the store whose name starts with name (ex. 2019-05-07, or latest)
+    """
+    if name == ACCOUNT_DATA:
+        return None
+    if os.path.isfile(name):
+        try:
+            return DataArchive(name)
+        except Exception as e:
+            exit('ERROR: Unable to load data archive "{}" ({})'.format(name, e))
+    return Snapshot(snapshot_store, name)
+
+
+def get_canonical_maps(accounts, config, name, snapshot_store, cache_dir):
+    """Returns the CanonicalMap of each account in the collection, by account name"""
+    data_source = get_data_source(name, snapshot_store)
+    if isinstance(data_source, Snapshot):
+        for account in accounts:
+            if snapshot_store.resolve_snapshot(account["name"], name) is None:
+                exit(
+                    'ERROR: No snapshot of {} matches "{}"'.format(
+                        account["name"], name
+                    )
+                )
+    set_data_source(data_source)
+    try:
+        return {
+            account["name"]: get_canonical_map(account, config, cache_dir)
+            for account in accounts
+        }
+    finally:
+        set_data_source(None)
+
+
+def mapdiff(accounts, config, old, new, snapshot_store, cache_dir="prepare-cache"):
+    """Returns the differences between the maps of the old and new collections of
+    each account, by account name"""
+    old_maps = get_canonical_maps(accounts, config, old, snapshot_store, cache_dir)
+    new_maps = get_canonical_maps(accounts, config, new, snapshot_store, cache_dir)
+    return {
+        account["name"]: diff_maps(old_maps[account["name"]], new_maps[account["name"]])
+        for account in accounts
+    }
+
+
+def run(arguments):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--old",
+        help="Collection to compare from: account-data, a zip or tar of account-data/, or the newest snapshot whose name starts with this (ex. 2019-05-07)",
+        required=True,
+        type=str,
+    )
+    parser.add_argument(
+        "--new",
+        help="Collection to compare to, as for --old (default account-data)",
+        default=ACCOUNT_DATA,
+        type=str,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory to keep the maps of the collections in (default prepare-cache)",
+        default="prepare-cache",
+        type=str,
+        dest="cache_dir",
+    )
+    parser.add_argument(
+        "--output", help="File to write the report to", default=None, type=str
+    )
+    args, accounts, config = parse_arguments(arguments, parser)
+
+    report = mapdiff(
+        accounts,
+        config,
+        args.old,
+        args.new,
+        SnapshotStore(args.snapshot_store),
+        args.cache_dir,
+    )
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
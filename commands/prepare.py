@@ -24,15 +24,47 @@ USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 import json
-import operator
 import itertools
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
 import argparse
 import pyjq
 import copy
 import urllib.parse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from netaddr import IPNetwork, IPAddress
-from shared.common import get_account, get_regions, is_external_cidr
-from shared.query import query_aws, get_parameter_file
+from shared.common import (
+    get_account,
+    get_accounts,
+    get_regions,
+    is_external_cidr,
+    add_data_source_arguments,
+    load_data_source,
+)
+from shared.cytoscape import CytoscapeWriter
+from shared.layout import add_positions
+from shared.level_of_detail import LevelOfDetail
+from shared.shards import write_shards, SHARDS_DIRECTORY, MANIFEST_FILE_NAME
+from shared.prepare_cache import (
+    PrepareCache,
+    GRAPH_CACHE_NAME,
+    REGION_INPUT_PREFIXES,
+)
+from shared.graph_index import GraphIndex, get_unfiltered_options, get_filters
+from shared.tag_index import TagIndex
+from shared.network_interfaces import get_interface_owner, get_interface_groups
+from shared.ip_index import load_ip_index
+from shared.query import (
+    query_aws,
+    get_parameter_file,
+    get_account_file,
+    get_file_size,
+    list_account_files,
+)
 from shared.nodes import (
     Account,
     Region,
@@ -48,14 +80,26 @@ from shared.nodes import (
     Lambda,
     Redshift,
     ElasticSearch,
+    NetworkInterface,
     Cidr,
+    SecurityGroup,
     Connection,
+    GroupConnection,
 )
 
 __description__ = "Generate network connection information file"
 
 MUTE = False
 
+# Above these, the diagram is too large to display well
+# Numbers chosen here are arbitrary
+MAX_NODES_FOR_WARNING = 200
+MAX_EDGES_FOR_WARNING = 500
+
+# Estimated memory taken to build an account, for each byte of the files it is built
+# from, for the memory budget of --max-memory
+MEMORY_PER_INPUT_BYTE = 10
+
 
 def log(msg):
     if MUTE:
@@ -136,14 +180,13 @@ def get_ecs_tasks(region):
     for clusterArn in clusters.get("clusterArns", []):
         tasks_json = get_parameter_file(region, "ecs", "list-tasks", clusterArn)
         for taskArn in tasks_json["taskArns"]:
-            task_path = "account-data/{}/{}/{}/{}/{}".format(
-                region.account.name,
+            task_path = "{}/{}/{}/{}".format(
                 region.region.name,
                 "ecs-describe-tasks",
                 urllib.parse.quote_plus(clusterArn),
                 urllib.parse.quote_plus(taskArn),
             )
-            task = json.load(open(task_path))
+            task = get_account_file(region.account.name, task_path)
             for task in task["tasks"]:
                 tasks.append(task)
     return tasks
@@ -179,12 +222,99 @@ def get_sgs(vpc):
     )
 
 
-def get_external_cidrs(account, config):
+class RegionIndex(object):
+    """
+    Lookups over the collected data of a region, built in a single pass so the tree
+    building and connection finding don't re-filter whole files for every VPC and AZ.
+    Subnet and VPC nodes are added as the tree is built.
+    """
+
+    def __init__(self, region):
+        self.azs = get_azs(region)
+
+        self._subnets_by_vpc_and_az = {}
+        subnets = query_aws(region.account, "ec2-describe-subnets", region)
+        for subnet in subnets.get("Subnets", []):
+            self._subnets_by_vpc_and_az.setdefault(
+                (subnet["VpcId"], subnet["AvailabilityZone"]), []
+            ).append(subnet)
+
+        self._sgs_by_vpc = {}
+        self.sgs_by_id = {}
+        sgs = query_aws(region.account, "ec2-describe-security-groups", region)
+        for sg in sgs.get("SecurityGroups", []):
+            self._sgs_by_vpc.setdefault(sg.get("VpcId"), []).append(sg)
+            self.sgs_by_id[sg["GroupId"]] = sg
+
+        self.vpc_nodes_by_id = {}
+        self.subnet_nodes_by_id = {}
+
+    def get_subnets(self, vpc_id, az_name):
+        return self._subnets_by_vpc_and_az.get((vpc_id, az_name), [])
+
+    def get_sgs(self, vpc_id):
+        return self._sgs_by_vpc.get(vpc_id, [])
+
+    def add_vpc_node(self, vpc):
+        self.vpc_nodes_by_id[vpc.local_id] = vpc
+
+    def add_subnet_node(self, subnet):
+        self.subnet_nodes_by_id[subnet.local_id] = subnet
+
+
+class NamedCidrIndex(object):
+    """
+    Longest-prefix match of networks against the named CIDRs of the config.
+    Named CIDRs are kept in a table per IP version and prefix length, keyed by their
+    network address, so a lookup is one dictionary check per prefix length in use
+    instead of building an IPNetwork for every named CIDR.
+    """
+
+    def __init__(self, named_cidrs):
+        # {version: {prefix length: {network address: named CIDR string}}}
+        self._tables = {}
+        for named_cidr in named_cidrs:
+            network = IPNetwork(named_cidr)
+            table = self._tables.setdefault(network.version, {}).setdefault(
+                network.prefixlen, {}
+            )
+            # On duplicates, the first in the config is used
+            table.setdefault(network.first, named_cidr)
+        self._prefix_lengths = {
+            version: sorted(tables, reverse=True)
+            for version, tables in self._tables.items()
+        }
+
+    def longest_match(self, cidr):
+        """Returns the smallest named CIDR that contains the CIDR, or None"""
+        network = IPNetwork(cidr)
+        tables = self._tables.get(network.version, {})
+        for prefix_length in self._prefix_lengths.get(network.version, []):
+            if prefix_length > network.prefixlen:
+                continue
+            host_bits = (32 if network.version == 4 else 128) - prefix_length
+            named_cidr = tables[prefix_length].get(
+                (network.first >> host_bits) << host_bits
+            )
+            if named_cidr is not None:
+                return named_cidr
+        return None
+
+
+def get_external_cidrs(account, config, region_indexes=None, ip_index=None):
+    """
+    Returns the CIDRs outside of the accounts' networks that the security groups
+    allow. CIDRs without a name in the config are named by their owners in the
+    IpIndex, if given, such as the public IP of an instance of another account.
+    """
     external_cidrs = []
     unique_cidrs = {}
     for region in account.children:
         for vpc in region.children:
-            sgs = get_sgs(vpc)
+            if region_indexes is not None:
+                sgs = region_indexes[region.arn].get_sgs(vpc.local_id)
+            else:
+                sgs = get_sgs(vpc)
 
             # Get external IPs
             for sg in sgs:
@@ -196,7 +326,10 @@ def get_external_cidrs(account, config):
     for cidr in unique_cidrs.keys():
         if is_external_cidr(cidr):
             # It's something else, so add it
-            external_cidrs.append(Cidr(cidr, get_cidr_name(cidr, config)))
+            name = get_cidr_name(cidr, config)
+            if name is None and ip_index is not None:
+                name = ip_index.get_name(cidr)
+            external_cidrs.append(Cidr(cidr, name))
     return external_cidrs
 
 
@@ -204,29 +337,149 @@ def get_cidr_name(cidr, config):
     return config["cidrs"].get(cidr, {}).get("name", None)
 
 
+class LeafIpIndex(object):
+    """
+    The IPs of a set of leaves held as NumPy arrays, along with the index of the leaf
+    that owns each IP, so the leaves with IPs in a CIDR can be found with vectorized
+    range comparisons instead of building netaddr objects for every IP.
+    IPv6 addresses are split into their high and low 64 bits.
+    """
+
+    def __init__(self, leaves):
+        self.leaves = list(leaves)
+        ipv4 = []
+        ipv4_owners = []
+        ipv6_high = []
+        ipv6_low = []
+        ipv6_owners = []
+        for owner, leaf in enumerate(self.leaves):
+            for ip in leaf.ips:
+                address = IPAddress(ip)
+                if address.version == 4:
+                    ipv4.append(int(address))
+                    ipv4_owners.append(owner)
+                else:
+                    ipv6_high.append(int(address) >> 64)
+                    ipv6_low.append(int(address) & 0xFFFFFFFFFFFFFFFF)
+                    ipv6_owners.append(owner)
+        self._ipv4 = np.array(ipv4, dtype=np.uint32)
+        self._ipv4_owners = np.array(ipv4_owners, dtype=np.intp)
+        self._ipv6_high = np.array(ipv6_high, dtype=np.uint64)
+        self._ipv6_low = np.array(ipv6_low, dtype=np.uint64)
+        self._ipv6_owners = np.array(ipv6_owners, dtype=np.intp)
+
+    def match(self, cidr):
+        """
+        Returns a list of (leaf, number of its IPs in the CIDR) for the leaves with
+        IPs in the CIDR, in the order the leaves were given.
+        """
+        network = IPNetwork(cidr)
+        if network.version == 4:
+            in_range = (self._ipv4 >= network.first) & (self._ipv4 <= network.last)
+            owners = self._ipv4_owners[in_range]
+        else:
+            first_high = np.uint64(network.first >> 64)
+            first_low = np.uint64(network.first & 0xFFFFFFFFFFFFFFFF)
+            last_high = np.uint64(network.last >> 64)
+            last_low = np.uint64(network.last & 0xFFFFFFFFFFFFFFFF)
+            above_first = (self._ipv6_high > first_high) | (
+                (self._ipv6_high == first_high) & (self._ipv6_low >= first_low)
+            )
+            below_last = (self._ipv6_high < last_high) | (
+                (self._ipv6_high == last_high) & (self._ipv6_low <= last_low)
+            )
+            owners = self._ipv6_owners[above_first & below_last]
+
+        counts = np.bincount(owners, minlength=len(self.leaves))
+        return [(self.leaves[i], int(counts[i])) for i in np.flatnonzero(counts)]
+
+
 def add_connection(connections, source, target, reason):
     reasons = connections.get(Connection(source, target), [])
     reasons.append(reason)
     connections[Connection(source, target)] = reasons
 
 
-def get_connections(cidrs, vpc, outputfilter):
+def add_group_connection(
+    connections,
+    group_connections,
+    source,
+    target,
+    source_members,
+    target_members,
+    reason,
+):
+    # Look up the edge already created, if any, so the members are added to it
+    connection = GroupConnection(source, target)
+    connection = group_connections.setdefault(connection, connection)
+    connection.add_members(source_members, target_members)
+    reasons = connections.get(connection, [])
+    reasons.append(reason)
+    connections[connection] = reasons
+
+
+def get_ingress_sg_node(pair, vpc, region_index=None):
+    """
+    Returns the SecurityGroup node for a group allowed in by a UserIdGroupPair that is
+    not one of the groups of the VPC. A group of another VPC of the region is put in
+    that VPC. A group of another account, or one that was not collected, is put in the
+    region outside of any VPC, with the id of the account that owns it.
+    """
+    group_id = pair["GroupId"]
+    if region_index is not None:
+        sg = region_index.sgs_by_id.get(group_id, None)
+        if sg is not None and sg.get("VpcId") in region_index.vpc_nodes_by_id:
+            return SecurityGroup(region_index.vpc_nodes_by_id[sg["VpcId"]], sg)
+    return SecurityGroup(
+        vpc.region,
+        {
+            "GroupId": group_id,
+            "GroupName": group_id,
+            "UserId": pair.get("UserId", vpc.account.local_id),
+        },
+    )
+
+
+def get_connections(cidrs, vpc, outputfilter, region_index=None):
     """
     For a VPC, for each instance, find all of the other instances that can connect to it,
     including those in peered VPCs.
     Note I do not consider subnet ACLs, routing tables, or some other network concepts.
+
+    With the sg_edges option, connections into a security group are aggregate edges
+    to a node for the group, instead of an edge to each of its members.
     """
+    if region_index is not None:
+        sgs = region_index.get_sgs(vpc.local_id)
+    else:
+        sgs = get_sgs(vpc)
     connections = {}
 
+    sg_edges = outputfilter.get("sg_edges", False)
+    sg_nodes = {}
+    if sg_edges:
+        for sg in sgs:
+            sg_nodes[sg["GroupId"]] = SecurityGroup(vpc, sg)
+    group_connections = {}
+
     # Get mapping of security group names to nodes that have that security group
     sg_to_instance_mapping = {}
     for instance in vpc.leaves:
         for sg in instance.security_groups:
             sg_to_instance_mapping.setdefault(sg, {})[instance] = True
 
+    # Index the IPs of the instances in this VPC and peered VPCs, to find the ones in a CIDR
+    ip_indexes = {}
+    if outputfilter.get("internal_edges", True):
+        for sourceVpc in itertools.chain(vpc.peers, (vpc,)):
+            ip_indexes[sourceVpc.arn] = LeafIpIndex(sourceVpc.leaves)
+
     # For each security group, find all the instances that are allowed to connect to instances
     # within that group.
-    for sg in get_sgs(vpc):
+    for sg in sgs:
+        # Connections refer to the security group allowing them by its id
+        reason = sys.intern(sg["GroupId"])
+
         # Get the CIDRs that are allowed to connect
         for cidr in pyjq.all(".IpPermissions[].IpRanges[].CidrIp", sg):
             if not is_external_cidr(cidr):
@@ -248,41 +501,95 @@ def get_connections(cidrs, vpc, outputfilter):
                         # so skip it
                         continue
 
-                    # For each instance, check if one of its IPs is within the CIDR
-                    for sourceInstance in sourceVpc.leaves:
-                        for ip in sourceInstance.ips:
-                            if IPAddress(ip) in IPNetwork(cidr):
-                                # Instance found that can connect to instances in the SG
-                                # So connect this instance (sourceInstance) to every instance
-                                # in the SG.
-                                for targetInstance in sg_to_instance_mapping.get(
-                                    sg["GroupId"], {}
-                                ):
-                                    add_connection(
-                                        connections, sourceInstance, targetInstance, sg
-                                    )
+                    # Find each instance with IPs within the CIDR
+                    for sourceInstance, ip_count in ip_indexes[sourceVpc.arn].match(
+                        cidr
+                    ):
+                        if sg_edges:
+                            members = sg_to_instance_mapping.get(sg["GroupId"], {})
+                            if len(members) == 0:
+                                continue
+                            # Connect this instance to the SG
+                            for _ in range(ip_count):
+                                add_group_connection(
+                                    connections,
+                                    group_connections,
+                                    sourceInstance,
+                                    sg_nodes[sg["GroupId"]],
+                                    [sourceInstance],
+                                    members,
+                                    reason,
+                                )
+                            continue
+
+                        # Instance found that can connect to instances in the SG
+                        # So connect this instance (sourceInstance) to every instance
+                        # in the SG, once for each of its IPs in the CIDR.
+                        for _ in range(ip_count):
+                            for targetInstance in sg_to_instance_mapping.get(
+                                sg["GroupId"], {}
+                            ):
+                                add_connection(
+                                    connections, sourceInstance, targetInstance, reason
+                                )
 
             else:
                 # This is an external IP (ie. not in a private range).
+                private_instances = []
                 for instance in sg_to_instance_mapping.get(sg["GroupId"], {}):
                     # Ensure it has a public IP, as resources with only private IPs can't be reached
                     if instance.is_public:
                         cidrs[cidr].is_used = True
-                        add_connection(connections, cidrs[cidr], instance, sg)
+                        add_connection(connections, cidrs[cidr], instance, reason)
                     else:
-                        if cidr == "0.0.0.0/0":
+                        if cidr == "0.0.0.0/0" and sg_edges:
+                            private_instances.append(instance)
+                        elif cidr == "0.0.0.0/0":
                             # Resource is not public, but allows anything to access it,
                             # so mark set all the resources in the VPC as allowing access to it.
                             for source_instance in vpc.leaves:
                                 add_connection(
-                                    connections, source_instance, instance, sg
+                                    connections, source_instance, instance, reason
                                 )
+                if len(private_instances) > 0:
+                    # Connect the whole VPC to the SG
+                    add_group_connection(
+                        connections,
+                        group_connections,
+                        vpc,
+                        sg_nodes[sg["GroupId"]],
+                        vpc.leaves,
+                        private_instances,
+                        reason,
+                    )
 
         if outputfilter.get("internal_edges", True):
             # Connect allowed in Security Groups
-            for ingress_sg in pyjq.all(
-                ".IpPermissions[].UserIdGroupPairs[].GroupId", sg
-            ):
+            for pair in pyjq.all(".IpPermissions[].UserIdGroupPairs[]", sg):
+                ingress_sg = pair["GroupId"]
+                if sg_edges:
+                    targets = sg_to_instance_mapping.get(sg["GroupId"], {})
+                    sources = sg_to_instance_mapping.get(ingress_sg, {})
+                    if len(targets) == 0 or len(sources) == 0:
+                        continue
+                    # Only resources that can egress are kept as sources, which
+                    # already excludes the RDS instances of inter_rds_edges.
+                    # Connect the SG to the SG
+                    if ingress_sg not in sg_nodes:
+                        sg_nodes[ingress_sg] = get_ingress_sg_node(
+                            pair, vpc, region_index
+                        )
+                    add_group_connection(
+                        connections,
+                        group_connections,
+                        sg_nodes[ingress_sg],
+                        sg_nodes[sg["GroupId"]],
+                        sources,
+                        targets,
+                        reason,
+                    )
+                    continue
+
                 # We have an SG and a list of SG's it allows in
                 for target in sg_to_instance_mapping.get(sg["GroupId"], {}):
                     # We have an instance and a list of SG's it allows in
@@ -299,7 +606,7 @@ def get_connections(cidrs, vpc, outputfilter):
                             )
                         ):
                             continue
-                        add_connection(connections, source, target, sg)
+                        add_connection(connections, source, target, reason)
 
     # Connect everything to the Gateway endpoints
     for targetResource in vpc.leaves:
@@ -312,11 +619,17 @@ def get_connections(cidrs, vpc, outputfilter):
     for connection in list(connections):
         if not connection.source.can_egress:
             del connections[connection]
+        elif isinstance(connection, GroupConnection):
+            for source in connection.source_members:
+                if not source.can_egress:
+                    connection.remove_source_member(source)
+            if len(connection.source_members) == 0:
+                del connections[connection]
 
     return connections
 
 
-def add_node_to_subnets(region, node, nodes):
+def add_node_to_subnets(node, nodes, region_index):
     """
     Given a node, find all the subnets it thinks it belongs to,
     and duplicate it and add it a child of those subnets
@@ -325,31 +638,30 @@ def add_node_to_subnets(region, node, nodes):
     # Remove node from dictionary
     del nodes[node.arn]
 
-    # Add a new node (potentially the same one) back to the dictionary
-    for vpc in region.children:
-        if (
-            len(node.subnets) == 0
-            and node._parent
-            and vpc.local_id == node._parent.local_id
-        ):
-            # VPC Gateway Endpoints (S3 and DynamoDB) reside in a VPC, not a subnet
-            # So set the relationship between the VPC and the node
+    node_subnets = node.subnets
+    if len(node_subnets) == 0:
+        # VPC Gateway Endpoints (S3 and DynamoDB) reside in a VPC, not a subnet
+        # So set the relationship between the VPC and the node
+        vpc = None
+        if node._parent:
+            vpc = region_index.vpc_nodes_by_id.get(node._parent.local_id)
+        if vpc is not None:
             nodes[node.arn] = node
             vpc.addChild(node)
-            break
+        return
 
-        for az in vpc.children:
-            for subnet in az.children:
-                for node_subnet in node.subnets:
-                    if node_subnet == subnet.local_id:
-                        # Copy the node
-                        subnet_node = copy.copy(node)
-                        # Set the subnet name on the copy, and potentially a new arn
-                        subnet_node.set_subnet(subnet)
+    # Add a new node (potentially the same one) back to the dictionary
+    for node_subnet in node_subnets:
+        subnet = region_index.subnet_nodes_by_id.get(node_subnet)
+        if subnet is not None:
+            # Copy the node
+            subnet_node = copy.copy(node)
+            # Set the subnet name on the copy, and potentially a new arn
+            subnet_node.set_subnet(subnet)
 
-                        # Add to the set
-                        nodes[subnet_node.arn] = subnet_node
-                        subnet.addChild(subnet_node)
+            # Add to the set
+            nodes[subnet_node.arn] = subnet_node
+            subnet.addChild(subnet_node)
 
 
 def get_resource_nodes(region, outputfilter):
@@ -408,9 +720,428 @@ def get_resource_nodes(region, outputfilter):
     return nodes
 
 
-def build_data_structure(account_data, config, outputfilter):
+class ResourceDescriptions(object):
+    """
+    The descriptions of the resources of a region from the files of their services,
+    to look up the resources found from network interfaces. The files of a service
+    are only read the first time one of its resources is looked up.
+    """
+
+    # For the services whose interfaces do not name their resource, the jq filters
+    # of the VPC, subnets and security groups to match the interfaces to
+    MATCH_FILTERS = {
+        "lambda": (
+            ".VpcConfig.VpcId",
+            ".VpcConfig.SubnetIds[]?",
+            ".VpcConfig.SecurityGroupIds[]?",
+        ),
+        "rds": (
+            ".DBSubnetGroup.VpcId",
+            ".DBSubnetGroup.Subnets[]?.SubnetIdentifier",
+            ".VpcSecurityGroups[]?.VpcSecurityGroupId",
+        ),
+        "redshift": (".VpcId", None, ".VpcSecurityGroups[]?.VpcSecurityGroupId"),
+    }
+
+    def __init__(self, region):
+        self.region = region
+        self._descriptions = {}
+        self._matched_rds = set()
+
+    def get(self, node_type):
+        """Returns the descriptions of the service's resources, by their id, or as a
+        list of (VPC, subnets, security groups, description) for those matched"""
+        if node_type not in self._descriptions:
+            region = self.region
+            if node_type == "ec2":
+                descriptions = {i["InstanceId"]: i for i in get_ec2s(region)}
+            elif node_type == "vpc_endpoint":
+                descriptions = {
+                    e["VpcEndpointId"]: e for e in get_vpc_endpoints(region)
+                }
+            elif node_type == "elb":
+                descriptions = {e["LoadBalancerName"]: e for e in get_elbs(region)}
+            elif node_type == "elbv2":
+                descriptions = {e["LoadBalancerName"]: e for e in get_elbv2s(region)}
+            elif node_type == "ecs":
+                # Task interfaces are described by the id of their attachment
+                descriptions = {}
+                for task in get_ecs_tasks(region):
+                    for attachment in task.get("attachments", []):
+                        descriptions[attachment["id"]] = task
+            elif node_type == "elasticsearch":
+                # Domains are read as they are looked up
+                descriptions = {}
+            else:
+                vpc_filter, subnets_filter, groups_filter = self.MATCH_FILTERS[
+                    node_type
+                ]
+                get_resources = {
+                    "lambda": get_lambda_functions,
+                    "rds": get_rds_instances,
+                    "redshift": get_redshift,
+                }[node_type]
+                descriptions = [
+                    (
+                        pyjq.first(vpc_filter, resource),
+                        (
+                            set(pyjq.all(subnets_filter, resource))
+                            if subnets_filter
+                            else None
+                        ),
+                        frozenset(pyjq.all(groups_filter, resource)),
+                        resource,
+                    )
+                    for resource in get_resources(region)
+                ]
+            self._descriptions[node_type] = descriptions
+        return self._descriptions[node_type]
+
+    def find(self, node_type, resource_id, interface):
+        """Returns the descriptions of the resources that the interface belongs to"""
+        descriptions = self.get(node_type)
+        if node_type in self.MATCH_FILTERS:
+            return self._match(node_type, resource_id, interface, descriptions)
+        if node_type == "elasticsearch" and resource_id not in descriptions:
+            domain = get_parameter_file(
+                self.region, "es", "describe-elasticsearch-domain", resource_id
+            )
+            if domain is not None and "VPCOptions" in domain["DomainStatus"]:
+                descriptions[resource_id] = domain["DomainStatus"]
+            else:
+                descriptions[resource_id] = None
+        resource = descriptions.get(resource_id, None)
+        if resource is None:
+            return []
+        return [resource]
+
+    def _match(self, node_type, resource_id, interface, descriptions):
+        """
+        Finds the resources of an interface of a service that is matched. What the
+        interface says about its resource is used first: the function named in the
+        description of Lambda interfaces, or the IPs of the nodes of Redshift clusters.
+        Otherwise, the resources in the VPC, subnet and security groups of the
+        interface are its resources. As an RDS instance has one interface, each
+        instance is only given one of the interfaces that match it, starting with the
+        instances in the AZ of the interface.
+        """
+        if node_type == "lambda" and resource_id is not None:
+            resources = [
+                resource
+                for _, _, _, resource in descriptions
+                if resource["FunctionName"] == resource_id
+            ]
+            if len(resources) > 0:
+                return resources
+        if node_type == "redshift":
+            ips = set(pyjq.all(".PrivateIpAddresses[]?.PrivateIpAddress", interface))
+            resources = [
+                resource
+                for _, _, _, resource in descriptions
+                if ips & set(pyjq.all(".ClusterNodes[]?.PrivateIPAddress", resource))
+            ]
+            if len(resources) > 0:
+                return resources
+
+        groups = get_interface_groups(interface)
+        resources = [
+            resource
+            for vpc_id, subnets, resource_groups, resource in descriptions
+            if vpc_id == interface["VpcId"]
+            and (subnets is None or interface["SubnetId"] in subnets)
+            and resource_groups == groups
+        ]
+        if node_type == "rds" and len(resources) > 0:
+            az = interface.get("AvailabilityZone", None)
+            resources.sort(
+                key=lambda resource: az
+                not in [
+                    resource.get("AvailabilityZone", None),
+                    resource.get("SecondaryAvailabilityZone", None),
+                ]
+            )
+            unmatched = [
+                resource
+                for resource in resources
+                if resource["DBInstanceArn"] not in self._matched_rds
+            ]
+            resources = [(unmatched or resources)[0]]
+            self._matched_rds.add(resources[0]["DBInstanceArn"])
+        return resources
+
+
+def get_eni_resource_nodes(region, outputfilter):
+    """
+    Finds the resources of the region from its network interfaces, in one pass over
+    ec2-describe-network-interfaces, instead of reading the files of every service
+    as get_resource_nodes does. The description of each resource is looked up in
+    the files of its service, which are only read if it has an interface.
+    Interfaces of services that prepare has no node type for, such as NAT gateways,
+    are network_interface nodes.
+    """
+    nodes = {}
+    descriptions = ResourceDescriptions(region)
+    vpc_ids = set(vpc.local_id for vpc in region.children)
+    interfaces = query_aws(region.account, "ec2-describe-network-interfaces", region)
+    for interface in interfaces.get("NetworkInterfaces", None) or []:
+        if interface.get("VpcId", None) not in vpc_ids:
+            continue
+        owner = get_interface_owner(interface)
+        if owner is None:
+            continue
+        node_type, resource_id = owner
+
+        resources = []
+        if node_type != "network_interface":
+            resources = descriptions.find(node_type, resource_id, interface)
+        if len(resources) == 0:
+            if node_type == "ec2":
+                # Instances that are not running are left out, as with the services
+                continue
+            node = NetworkInterface(region, {"NetworkInterfaces": [interface]})
+            nodes[node.arn] = node
+            continue
+
+        for resource in resources:
+            if node_type == "ec2":
+                node = Ec2(
+                    region,
+                    resource,
+                    outputfilter.get("collapse_by_tag", False),
+                    outputfilter.get("collapse_asgs", False),
+                )
+            elif node_type == "rds":
+                node = Rds(region, resource)
+                if (
+                    not outputfilter.get("read_replicas", False)
+                    and node.node_type == "rds_rr"
+                ):
+                    continue
+            else:
+                node = {
+                    "vpc_endpoint": VpcEndpoint,
+                    "elb": Elb,
+                    "elbv2": Elbv2,
+                    "ecs": Ecs,
+                    "lambda": Lambda,
+                    "redshift": Redshift,
+                    "elasticsearch": ElasticSearch,
+                }[node_type](region, resource)
+            # Resources with many interfaces are found for each of them
+            nodes.setdefault(node.arn, node)
+
+    # Gateway endpoints, for S3 and DynamoDB, have no interfaces
+    for vpc_endpoint_json in descriptions.get("vpc_endpoint").values():
+        if vpc_endpoint_json["VpcEndpointType"] == "Gateway":
+            node = VpcEndpoint(region, vpc_endpoint_json)
+            nodes[node.arn] = node
+
+    return nodes
+
+
+def build_region(account, region_json, outputfilter):
+    """
+    Build the tree of a region, with its resources placed in their subnets.
+    Returns the region, its RegionIndex, the number of resources, and the cytoscape
+    data of the nodes in it.
+    The region is not added to the account, so regions can be built independently.
+    """
     cytoscape_json = []
+    region = Region(account, region_json)
+    region_index = RegionIndex(region)
+
+    # Build the tree hierarchy
+    for vpc_json in get_vpcs(region, outputfilter):
+        vpc = Vpc(region, vpc_json)
+        region_index.add_vpc_node(vpc)
+
+        for az_json in region_index.azs:
+            # Availibility zones are not a per VPC construct, but VPC's can span AZ's,
+            # so I make VPC a higher level construct
+            az = Az(vpc, az_json)
+
+            for subnet_json in region_index.get_subnets(vpc.local_id, az.local_id):
+                # If we ignore AZz, then tie the subnets up the VPC as the parent
+                if outputfilter.get("azs", False):
+                    parent = az
+                else:
+                    parent = vpc
+
+                subnet = Subnet(parent, subnet_json)
+                az.addChild(subnet)
+                region_index.add_subnet_node(subnet)
+            vpc.addChild(az)
+        region.addChild(vpc)
+
+    # In each region, iterate through all the resource types
+    if outputfilter.get("discovery", None) == "eni":
+        nodes = get_eni_resource_nodes(region, outputfilter)
+    else:
+        nodes = get_resource_nodes(region, outputfilter)
 
+    # Filter out nodes based on tags
+    # Ex. --tags Env=Prod --tags Team=Dev,Name=Bastion matches nodes with the tag
+    # Env=Prod, or with both the tags Team=Dev and Name=Bastion
+    if len(outputfilter.get("tags", [])) > 0:
+        tag_index = TagIndex()
+        tag_index.add_region(region)
+        matches = tag_index.match(outputfilter["tags"])
+        for node_id in list(nodes):
+            if nodes[node_id].aws_arn not in matches:
+                del nodes[node_id]
+
+    # Add the nodes to their respective subnets
+    for node_arn in list(nodes):
+        node = nodes[node_arn]
+        add_node_to_subnets(node, nodes, region_index)
+
+    # Resources in more than one subnet, such as ELBs, have a copy in each of them.
+    # Their json is written once, in a node_data element for the region, and the
+    # copies refer to it by the ARN of the resource, in node_data_ref.
+    subnet_counts = {}
+    for leaf in region.leaves:
+        subnet_counts[leaf.resource_arn] = subnet_counts.get(leaf.resource_arn, 0) + 1
+    shared_node_data = {}
+
+    # From the root of the tree (the account), add in the children if there are leaves
+    # If not, mark the item for removal
+    if region.has_leaves:
+        cytoscape_json.append(region.cytoscape_data())
+
+        region_children_to_remove = set()
+        for vpc in region.children:
+            if vpc.has_leaves:
+                cytoscape_json.append(vpc.cytoscape_data())
+
+                vpc_children_to_remove = set()
+                for vpc_child in vpc.children:
+                    if vpc_child.has_leaves:
+                        if outputfilter.get("azs", False):
+                            cytoscape_json.append(vpc_child.cytoscape_data())
+                        elif vpc_child.node_type != "az":
+                            # Add VPC children that are not AZs, such as Gateway endpoints
+                            cytoscape_json.append(vpc_child.cytoscape_data())
+
+                        az_children_to_remove = set()
+                        for subnet in vpc_child.children:
+                            if subnet.has_leaves:
+                                cytoscape_json.append(subnet.cytoscape_data())
+
+                                for leaf in subnet.leaves:
+                                    leaf_json = leaf.cytoscape_data(subnet.arn)
+                                    if subnet_counts[leaf.resource_arn] > 1:
+                                        data = leaf_json["data"]
+                                        shared_node_data[leaf.resource_arn] = data.pop(
+                                            "node_data"
+                                        )
+                                        data["node_data_ref"] = leaf.resource_arn
+                                    cytoscape_json.append(leaf_json)
+                            else:
+                                az_children_to_remove.add(subnet)
+                        for subnet in az_children_to_remove:
+                            vpc_child.removeChild(subnet)
+                    else:
+                        vpc_children_to_remove.add(vpc_child)
+                for az in vpc_children_to_remove:
+                    vpc.removeChild(az)
+            else:
+                region_children_to_remove.add(vpc)
+        for vpc in region_children_to_remove:
+            region.removeChild(vpc)
+
+    if shared_node_data:
+        cytoscape_json.append(
+            {
+                "data": {
+                    "id": region.arn + "node_data",
+                    "type": "node_data",
+                    "node_data": shared_node_data,
+                }
+            }
+        )
+
+    return region, region_index, len(nodes), cytoscape_json
+
+
+def build_region_task(account_data, region_json, outputfilter):
+    """Builds a region in a worker process, from the account's config"""
+    account = Account(None, account_data)
+    return build_region(account, region_json, outputfilter)
+
+
+def build_regions(account, outputfilter, cache=None):
+    """
+    Build each region, in parallel worker processes when the jobs option is over 1.
+    With a cache, regions whose collected files have not changed are loaded from it
+    instead of being built, and are logged apart from the regions that are built.
+    Returns the results of build_region, in the order of the regions.
+    """
+    region_jsons = get_regions(account, outputfilter)
+    results = [None] * len(region_jsons)
+    region_keys = [None] * len(region_jsons)
+    if cache is not None:
+        for i, region_json in enumerate(region_jsons):
+            region_keys[i] = cache.region_key(region_json["RegionName"])
+            results[i] = cache.load(region_json["RegionName"], region_keys[i])
+    to_build = [i for i, result in enumerate(results) if result is None]
+
+    jobs = outputfilter.get("jobs", 1)
+    # The workers need the data source set up by this process, which is only
+    # inherited when processes are forked
+    if (
+        jobs <= 1
+        or len(to_build) <= 1
+        or "fork" not in multiprocessing.get_all_start_methods()
+    ):
+        built = [build_region(account, region_jsons[i], outputfilter) for i in to_build]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            built = list(
+                executor.map(
+                    build_region_task,
+                    itertools.repeat(account.json),
+                    [region_jsons[i] for i in to_build],
+                    itertools.repeat(outputfilter),
+                )
+            )
+
+    for i, result in zip(to_build, built):
+        results[i] = result
+        if cache is not None:
+            cache.store(region_jsons[i]["RegionName"], region_keys[i], result)
+
+    built_indexes = set(to_build)
+    for i, (region, _, node_count, _) in enumerate(results):
+        if i in built_indexes:
+            log("- {} nodes built in region {}".format(node_count, region.local_id))
+        else:
+            log(
+                "- {} nodes loaded in region {}, which is unchanged".format(
+                    node_count, region.local_id
+                )
+            )
+
+    # Attach the regions, built by workers or loaded from the cache with their own
+    # copy of the account, to this account
+    for region, _, _, _ in results:
+        region._parent = account
+    return results
+
+
+def build_data_structure(account_data, config, outputfilter):
+    return list(iter_data_structure(account_data, config, outputfilter))
+
+
+def iter_data_structure(account_data, config, outputfilter):
+    """
+    Generates the cytoscape elements of the account, so they can be written out as
+    they are made instead of being collected first.
+    With the cache_dir option, only the parts whose inputs changed since the last
+    run are built again. With the graph option as well, the filters are applied to
+    the cached graph of the whole account.
+    """
     if outputfilter.get("mute", False):
         global MUTE
         MUTE = True
@@ -418,134 +1149,160 @@ def build_data_structure(account_data, config, outputfilter):
     account = Account(None, account_data)
     log("Building data for account {} ({})".format(account.name, account.local_id))
 
-    cytoscape_json.append(account.cytoscape_data())
+    if outputfilter.get("graph", False):
+        graph = get_graph_index(account, config, outputfilter)
+        elements = graph.query(**get_filters(outputfilter))
+    else:
+        elements = iter_account_elements(account, config, outputfilter)
+
+    total_number_of_nodes = 0
+    total_number_of_edges = 0
+    for element in elements:
+        if element["data"]["type"] == "edge":
+            total_number_of_edges += 1
+        elif element["data"]["type"] not in ["node_data", "security_groups"]:
+            total_number_of_nodes += 1
+        yield element
 
-    # Iterate through each region and add all the VPCs, AZs, and Subnets
-    for region_json in get_regions(account, outputfilter):
-        region = Region(account, region_json)
+    # Check if we have a lot of data, and if so, show a warning
+    if (
+        total_number_of_nodes > MAX_NODES_FOR_WARNING
+        or total_number_of_edges > MAX_EDGES_FOR_WARNING
+    ):
+        log(
+            "WARNING: There are {} total nodes and {} total edges.".format(
+                total_number_of_nodes, total_number_of_edges
+            )
+        )
+        log(
+            "  This will be difficult to display and may be too complex to make sense of."
+        )
+        log(
+            "  Consider reducing the number of items in the diagram by viewing a single"
+        )
+        log("   region, ignoring internal edges, or other filtering.")
+        log("  The --lod option collapses subnets and VPCs until the diagram fits.")
 
-        # Build the tree hierarchy
-        for vpc_json in get_vpcs(region, outputfilter):
-            vpc = Vpc(region, vpc_json)
 
-            for az_json in get_azs(vpc):
-                # Availibility zones are not a per VPC construct, but VPC's can span AZ's,
-                # so I make VPC a higher level construct
-                az = Az(vpc, az_json)
+def iter_account_elements(account, config, outputfilter):
+    """Builds the account, and generates its cytoscape elements"""
+    cache = None
+    if outputfilter.get("cache_dir", None):
+        cache = PrepareCache(outputfilter["cache_dir"], account, outputfilter)
 
-                for subnet_json in get_subnets(az):
-                    # If we ignore AZz, then tie the subnets up the VPC as the parent
-                    if outputfilter.get("azs", False):
-                        parent = az
-                    else:
-                        parent = vpc
+    yield account.cytoscape_data()
+
+    region_indexes = {}
 
-                    subnet = Subnet(parent, subnet_json)
-                    az.addChild(subnet)
-                vpc.addChild(az)
-            region.addChild(vpc)
+    # Iterate through each region and add all the VPCs, AZs, and Subnets
+    for region, region_index, _, region_cytoscape_json in build_regions(
+        account, outputfilter, cache
+    ):
         account.addChild(region)
+        region_indexes[region.arn] = region_index
+        for element in region_cytoscape_json:
+            yield element
+
+    # The connections between regions and to CIDRs only need to be found again if
+    # a region, or the config, has changed
+    account_key = None
+    elements = None
+    if cache is not None:
+        account_key = cache.account_key(config)
+        elements = cache.load("account", account_key)
+        if elements is not None:
+            log("- Connections are unchanged")
+    if elements is None:
+        elements = iter_connection_elements(
+            account, region_indexes, config, outputfilter
+        )
+        if cache is not None:
+            elements = list(elements)
+            cache.store("account", account_key, elements)
 
-        # In each region, iterate through all the resource types
-        nodes = get_resource_nodes(region, outputfilter)
+    for element in elements:
+        yield element
 
-        # Filter out nodes based on tags
-        if len(outputfilter.get("tags", [])) > 0:
-            for node_id in list(nodes):
-                has_match = False
-                node = nodes[node_id]
-                # For each node, look to see if its tags match one of the tag sets
-                # Ex. --tags Env=Prod --tags Team=Dev,Name=Bastion
-                for tag_set in outputfilter.get("tags", []):
-                    conditions = [c.split("=") for c in tag_set.split(",")]
-                    condition_matches = 0
-                    # For a tag set, see if all conditions match, ex. [["Team","Dev"],["Name","Bastion"]]
-                    for pair in conditions:
-                        # Given ["Team","Dev"], see if it matches one of the tags in the node
-                        if node.tags:
-                            for tag in node.tags:
-                                if (
-                                    tag.get("Key", "") == pair[0]
-                                    and tag.get("Value", "") == pair[1]
-                                ):
-                                    condition_matches += 1
-                    # We have a match if all of the conditions matched
-                    if condition_matches == len(conditions):
-                        has_match = True
-
-                # If there were no matches, remove the node
-                if not has_match:
-                    del nodes[node_id]
-
-        # Add the nodes to their respective subnets
-        for node_arn in list(nodes):
-            node = nodes[node_arn]
-            add_node_to_subnets(region, node, nodes)
-
-        # From the root of the tree (the account), add in the children if there are leaves
-        # If not, mark the item for removal
-        if region.has_leaves:
-            cytoscape_json.append(region.cytoscape_data())
-
-            region_children_to_remove = set()
-            for vpc in region.children:
-                if vpc.has_leaves:
-                    cytoscape_json.append(vpc.cytoscape_data())
-
-                    vpc_children_to_remove = set()
-                    for vpc_child in vpc.children:
-                        if vpc_child.has_leaves:
-                            if outputfilter.get("azs", False):
-                                cytoscape_json.append(vpc_child.cytoscape_data())
-                            elif vpc_child.node_type != "az":
-                                # Add VPC children that are not AZs, such as Gateway endpoints
-                                cytoscape_json.append(vpc_child.cytoscape_data())
-
-                            az_children_to_remove = set()
-                            for subnet in vpc_child.children:
-                                if subnet.has_leaves:
-                                    cytoscape_json.append(subnet.cytoscape_data())
-
-                                    for leaf in subnet.leaves:
-                                        cytoscape_json.append(
-                                            leaf.cytoscape_data(subnet.arn)
-                                        )
-                                else:
-                                    az_children_to_remove.add(subnet)
-                            for subnet in az_children_to_remove:
-                                vpc_child.removeChild(subnet)
-                        else:
-                            vpc_children_to_remove.add(vpc_child)
-                    for az in vpc_children_to_remove:
-                        vpc.removeChild(az)
-                else:
-                    region_children_to_remove.add(vpc)
-            for vpc in region_children_to_remove:
-                region.removeChild(vpc)
 
-        log("- {} nodes built in region {}".format(len(nodes), region.local_id))
+def build_graph_index(account, config, outputfilter, cache=None):
+    """
+    Builds the graph of the whole account, and indexes it so it can be filtered.
+    The outputfilter must not have filters, as from get_unfiltered_options.
+    """
+    elements = [account.cytoscape_data()]
+    region_indexes = {}
+    for region, region_index, _, region_cytoscape_json in build_regions(
+        account, outputfilter, cache
+    ):
+        account.addChild(region)
+        region_indexes[region.arn] = region_index
+        elements.extend(region_cytoscape_json)
+    elements.extend(
+        iter_connection_elements(account, region_indexes, config, outputfilter)
+    )
+
+    # Without internal edges, the edges that are left can have fewer reasons, so
+    # those are found again. The peerings are added again by this.
+    for region in account.children:
+        for vpc in region.children:
+            del vpc.peers[:]
+    log("- Finding the connections without internal edges")
+    external_edges = [
+        element
+        for element in iter_connection_elements(
+            account,
+            region_indexes,
+            config,
+            dict(outputfilter, internal_edges=False),
+        )
+        if element["data"]["type"] == "edge"
+    ]
+    return GraphIndex(account, elements, external_edges)
+
 
+def get_graph_index(account, config, outputfilter):
+    """
+    Returns the GraphIndex of the account, from the cache if none of the collected
+    files, the config, or the options other than the filters have changed.
+    """
+    options = get_unfiltered_options(outputfilter)
+    cache = PrepareCache(outputfilter["cache_dir"], account, options)
+    for region_json in get_regions(account):
+        cache.region_key(region_json["RegionName"])
+    key = cache.account_key(config)
+    graph = cache.load(GRAPH_CACHE_NAME, key)
+    if graph is not None:
+        log("- Graph is unchanged, filtering it")
+        return graph
+
+    graph = build_graph_index(account, config, options, cache)
+    cache.store(GRAPH_CACHE_NAME, key, graph)
+    return graph
+
+
+def iter_connection_elements(account, region_indexes, config, outputfilter):
+    """
+    Generates the cytoscape elements that need all of the regions of the account:
+    the external CIDRs, the security groups, and the edges between nodes.
+    """
     # Get VPC peerings
     for region in account.children:
+        vpcs_by_id = {vpc.local_id: vpc for vpc in region.children}
         for vpc_peering in get_vpc_peerings(region):
             # For each peering, find the accepter and the requester
-            accepter_id = vpc_peering["AccepterVpcInfo"]["VpcId"]
-            requester_id = vpc_peering["RequesterVpcInfo"]["VpcId"]
-            accepter = None
-            requester = None
-            for vpc in region.children:
-                if accepter_id == vpc.local_id:
-                    accepter = vpc
-                if requester_id == vpc.local_id:
-                    requester = vpc
+            accepter = vpcs_by_id.get(vpc_peering["AccepterVpcInfo"]["VpcId"])
+            requester = vpcs_by_id.get(vpc_peering["RequesterVpcInfo"]["VpcId"])
             # If both have been found, add each as peers to one another
             if accepter and requester:
                 accepter.addPeer(requester)
                 requester.addPeer(accepter)
 
     # Get external cidr nodes
+    ip_index = None
+    if outputfilter.get("ip_index", None):
+        ip_index = load_ip_index(outputfilter["ip_index"])
     cidrs = {}
-    for cidr in get_external_cidrs(account, config):
+    for cidr in get_external_cidrs(account, config, region_indexes, ip_index):
         cidrs[cidr.arn] = cidr
 
     # Find connections between nodes
@@ -553,7 +1310,9 @@ def build_data_structure(account_data, config, outputfilter):
     connections = {}
     for region in account.children:
         for vpc in region.children:
-            for c, reasons in get_connections(cidrs, vpc, outputfilter).items():
+            for c, reasons in get_connections(
+                cidrs, vpc, outputfilter, region_indexes[region.arn]
+            ).items():
                 r = connections.get(c, [])
                 r.extend(reasons)
                 connections[c] = r
@@ -562,6 +1321,14 @@ def build_data_structure(account_data, config, outputfilter):
     # Collapse CIDRs
     #
 
+    named_cidr_index = NamedCidrIndex(config["cidrs"])
+
+    # Index the connections from CIDR nodes, so only those need to be rewritten
+    connections_by_cidr = {}
+    for c in connections:
+        if c.source.node_type == "ip":
+            connections_by_cidr.setdefault(c.source.arn, []).append(c)
+
     # Get a list of the current CIDRs
     current_cidrs = []
     for cidr_string in cidrs:
@@ -569,21 +1336,10 @@ def build_data_structure(account_data, config, outputfilter):
 
     # Iterate through them
     for cidr_string in current_cidrs:
-        # Find CIDRs in the config that our CIDR falls inside
-        # It may fall inside multiple ranges
-        matching_known_cidrs = {}
-        for named_cidr in config["cidrs"]:
-            if IPNetwork(cidr_string) in IPNetwork(named_cidr):
-                # Match found
-                matching_known_cidrs[named_cidr] = IPNetwork(named_cidr).size
-
-        if len(matching_known_cidrs) > 0:
-            # A match was found. Find the smallest matching range.
-            sorted_matches = sorted(
-                matching_known_cidrs.items(), key=operator.itemgetter(1)
-            )
-            # Get first item to get (CIDR,size); and first item of that to get just the CIDR
-            smallest_matched_cidr_string = sorted_matches[0][0]
+        # Find the smallest CIDR in the config that our CIDR falls inside
+        smallest_matched_cidr_string = named_cidr_index.longest_match(cidr_string)
+
+        if smallest_matched_cidr_string is not None:
             smallest_matched_cidr_name = config["cidrs"][smallest_matched_cidr_string][
                 "name"
             ]
@@ -607,26 +1363,60 @@ def build_data_structure(account_data, config, outputfilter):
                 new_source.is_used = True
 
                 # Find all the connections to the old node
-                connections_to_remove = []
-                for c in connections:
-                    if c.source.node_type == "ip" and c.source.arn == cidr_string:
-                        connections_to_remove.append(c)
+                connections_to_remove = connections_by_cidr.pop(cidr_string, [])
 
                 # Create new connections to the new node
                 for c in connections_to_remove:
                     r = connections[c]
                     del connections[c]
-                    connections[Connection(new_source, c._target)] = r
+                    new_connection = Connection(new_source, c._target)
+                    if (
+                        new_connection not in connections
+                        and new_source.node_type == "ip"
+                    ):
+                        connections_by_cidr.setdefault(new_source.arn, []).append(
+                            new_connection
+                        )
+                    connections[new_connection] = r
 
     # Add external cidr nodes
     used_cidrs = 0
     for _, cidr in cidrs.items():
         if cidr.is_used:
             used_cidrs += 1
-            cytoscape_json.append(cidr.cytoscape_data())
+            yield cidr.cytoscape_data()
     log("- {} external CIDRs built".format(used_cidrs))
 
-    total_number_of_nodes = len(cytoscape_json)
+    # Add the security group nodes of aggregate edges
+    sg_nodes = {}
+    for c in connections:
+        for node in (c.source, c.target):
+            if node.node_type == "security_group":
+                sg_nodes[node.arn] = node
+    for sg_node in sg_nodes.values():
+        yield sg_node.cytoscape_data()
+
+    # The connections refer to security groups by id, so include those once
+    sgs_by_id = {}
+    for region_index in region_indexes.values():
+        sgs_by_id.update(region_index.sgs_by_id)
+    security_groups = {}
+    for reasons in connections.values():
+        for reason in reasons:
+            if isinstance(reason, str) and reason in sgs_by_id:
+                security_groups[reason] = sgs_by_id[reason]
+    # This is written before the edges, so it is its own element instead of
+    # being part of the account node, which is written first
+    yield {
+        "data": {
+            "id": account.arn + "security_groups",
+            "type": "security_groups",
+            "node_data": {
+                group_id: security_groups[group_id]
+                for group_id in sorted(security_groups)
+            },
+        }
+    }
 
     # Add the mapping to our graph
     for c, reasons in connections.items():
@@ -634,31 +1424,45 @@ def build_data_structure(account_data, config, outputfilter):
             # Ensure we don't add connections with the same nodes on either side
             continue
         c._json = reasons
-        cytoscape_json.append(c.cytoscape_data())
+        yield c.cytoscape_data()
     log("- {} connections built".format(len(connections)))
 
-    # Check if we have a lot of data, and if so, show a warning
-    # Numbers chosen here are arbitrary
-    MAX_NODES_FOR_WARNING = 200
-    MAX_EDGES_FOR_WARNING = 500
-    if (
-        total_number_of_nodes > MAX_NODES_FOR_WARNING
-        or len(connections) > MAX_EDGES_FOR_WARNING
-    ):
+
+def write_map(elements, outputfilter):
+    """
+    Reduces the elements to the level of detail and lays them out, if those options
+    are set, and writes them to web/data.json, or to shards with the shards option.
+    """
+    if outputfilter.get("lod", False):
+        graph = LevelOfDetail(elements)
+        graph.reduce(outputfilter["max_nodes"], outputfilter["max_edges"])
         log(
-            "WARNING: There are {} total nodes and {} total edges.".format(
-                total_number_of_nodes, len(connections)
+            "- Reduced to {} nodes and {} edges".format(
+                graph.node_count, graph.edge_count
             )
         )
-        log(
-            "  This will be difficult to display and may be too complex to make sense of."
+        elements = graph.elements()
+    if outputfilter.get("layout", False):
+        elements = add_positions(list(elements))
+
+    if outputfilter.get("shards", False):
+        manifest = write_shards(
+            list(elements),
+            directory="web",
+            node_data=outputfilter["node_data"],
+            shard_type=outputfilter.get("shard_by", None) or "vpc",
         )
         log(
-            "  Consider reducing the number of items in the diagram by viewing a single"
+            "- Wrote the summary to web/data.json, and {} shards listed in web/{}/{}".format(
+                len(manifest["shards"]), SHARDS_DIRECTORY, MANIFEST_FILE_NAME
+            )
         )
-        log("   region, ignoring internal edges, or other filtering.")
+        return
 
-    return cytoscape_json
+    with CytoscapeWriter(
+        "web/data.json", node_data=outputfilter["node_data"]
+    ) as writer:
+        writer.write_all(elements)
 
 
 def prepare(account, config, outputfilter):
@@ -666,16 +1470,169 @@ def prepare(account, config, outputfilter):
     Collect the data and write it to a file
     """
     log("WARNING: This functionality is no longer maintained")
-    cytoscape_json = build_data_structure(account, config, outputfilter)
-    if not outputfilter["node_data"]:
-        filtered_cytoscape_json = []
-        for node in cytoscape_json:
-            filtered_node = node.copy()
-            filtered_node["data"]["node_data"] = {}
-            filtered_cytoscape_json.append(filtered_node)
-        cytoscape_json = filtered_cytoscape_json
-    with open("web/data.json", "w") as outfile:
-        json.dump(cytoscape_json, outfile, indent=4)
+    write_map(iter_data_structure(account, config, outputfilter), outputfilter)
+
+
+def get_peering_edge(vpc_peering, region_name):
+    """Returns the edge between the VPCs of a peering, which can be in other accounts"""
+    ends = []
+    for vpc_info in [vpc_peering["RequesterVpcInfo"], vpc_peering["AccepterVpcInfo"]]:
+        ends.append(
+            "arn:aws::{}:{}:vpc/{}".format(
+                vpc_info.get("Region", region_name),
+                vpc_info["OwnerId"],
+                vpc_info["VpcId"],
+            )
+        )
+    return {
+        "data": {
+            "source": ends[0],
+            "target": ends[1],
+            "type": "edge",
+            "node_data": [vpc_peering],
+        },
+        "classes": "vpc",
+    }
+
+
+def get_account_peering_edges(account, outputfilter):
+    """Returns the edges of the peerings of the account's VPCs with VPCs of other
+    accounts, by the id of the peering"""
+    edges = {}
+    for region_json in get_regions(account, outputfilter):
+        region = Region(account, region_json)
+        for vpc_peering in get_vpc_peerings(region):
+            if vpc_peering["RequesterVpcInfo"].get("OwnerId", None) == vpc_peering[
+                "AccepterVpcInfo"
+            ].get("OwnerId", None):
+                continue
+            edges[vpc_peering["VpcPeeringConnectionId"]] = get_peering_edge(
+                vpc_peering, region.name
+            )
+    return edges
+
+
+def get_memory_estimate(account, outputfilter):
+    """Estimates the memory, in bytes, taken to build the account, from the size of
+    the collected files of its regions that prepare reads"""
+    size = 0
+    for region_json in get_regions(account, outputfilter):
+        for file_path in list_account_files(account.name, region_json["RegionName"]):
+            if file_path.split("/")[1].startswith(REGION_INPUT_PREFIXES):
+                size += get_file_size(account.name, file_path) or 0
+    return size * MEMORY_PER_INPUT_BYTE
+
+
+def build_account_task(account_data, config, outputfilter, path):
+    """
+    Builds an account, in a worker process when there is more than one job, and writes
+    its elements to the path, so only one account needs to be held at a time to join
+    them. Returns the edges of its peerings with other accounts.
+    """
+    with CytoscapeWriter(path) as writer:
+        writer.write_all(iter_data_structure(account_data, config, outputfilter))
+    return get_account_peering_edges(Account(None, account_data), outputfilter)
+
+
+def build_accounts(accounts, config, outputfilter, directory):
+    """
+    Builds each account to a file in the directory. With the jobs option over 1, the
+    accounts are built by worker processes, as many at once as their memory estimates
+    fit in the max_memory option, in MB, but always at least one.
+    Returns the paths of the files, in the order of the accounts, and the edges of the
+    peerings between accounts.
+    """
+    paths = [os.path.join(directory, "{}.json".format(i)) for i in range(len(accounts))]
+    results = [None] * len(accounts)
+
+    jobs = outputfilter.get("jobs", 1)
+    if (
+        jobs <= 1
+        or len(accounts) <= 1
+        or "fork" not in multiprocessing.get_all_start_methods()
+    ):
+        for i, account_data in enumerate(accounts):
+            results[i] = build_account_task(
+                account_data, config, outputfilter, paths[i]
+            )
+    else:
+        budget = None
+        if outputfilter.get("max_memory", None):
+            budget = outputfilter["max_memory"] * 1024 * 1024
+        estimates = [
+            get_memory_estimate(Account(None, account_data), outputfilter)
+            for account_data in accounts
+        ]
+        # The workers each build an account, so they build its regions in turn
+        options = dict(outputfilter, jobs=1)
+        pending = list(range(len(accounts)))
+        running = {}
+        with ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                while (
+                    len(pending) > 0
+                    and len(running) < jobs
+                    and (
+                        len(running) == 0
+                        or budget is None
+                        or sum(estimates[i] for i in running.values())
+                        + estimates[pending[0]]
+                        <= budget
+                    )
+                ):
+                    i = pending.pop(0)
+                    future = executor.submit(
+                        build_account_task, accounts[i], config, options, paths[i]
+                    )
+                    running[future] = i
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+
+    peering_edges = {}
+    for edges in results:
+        peering_edges.update(edges)
+    return paths, peering_edges
+
+
+def iter_accounts_elements(paths, peering_edges):
+    """
+    Generates the elements of the accounts written to the paths as one graph. The
+    CIDRs are shared by the accounts, so each is only kept once. The nodes of every
+    account come first, and then the edges, reading one account at a time.
+    The peering edges are added if the VPCs at both ends are in the graph.
+    """
+    node_ids = set()
+    for path in paths:
+        with open(path) as f:
+            for element in json.load(f):
+                data = element["data"]
+                if data["type"] != "edge" and data["id"] not in node_ids:
+                    node_ids.add(data["id"])
+                    yield element
+    for path in paths:
+        with open(path) as f:
+            for element in json.load(f):
+                if element["data"]["type"] == "edge":
+                    yield element
+    for edge in peering_edges.values():
+        if edge["data"]["source"] in node_ids and edge["data"]["target"] in node_ids:
+            yield edge
+
+
+def prepare_accounts(accounts, config, outputfilter):
+    """NO LONGER MAINTAINED
+    Collect the data of the accounts and write them to a file as one map
+    """
+    log("WARNING: This functionality is no longer maintained")
+    directory = tempfile.mkdtemp()
+    try:
+        paths, peering_edges = build_accounts(accounts, config, outputfilter, directory)
+        write_map(iter_accounts_elements(paths, peering_edges), outputfilter)
+    finally:
+        shutil.rmtree(directory)
 
 
 def run(arguments):
@@ -693,6 +1650,19 @@ def run(arguments):
         type=str,
         dest="account_name",
     )
+    parser.add_argument(
+        "--accounts",
+        help="Accounts to put on one map (ex. prod,dev), or all of them with all, joined by the CIDRs they share and the VPC peerings between them. With --jobs over 1, each account is built by a worker process",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--max-memory",
+        help="Memory, in MB, that the accounts built at once with --accounts can take, by estimates from the size of their collected files (default no limit)",
+        dest="max_memory",
+        default=None,
+        type=int,
+    )
     parser.add_argument(
         "--regions",
         help="Regions to restrict to (ex. us-east-1,us-west-2)",
@@ -786,12 +1756,94 @@ def run(arguments):
         dest="collapse_asgs",
         action="store_false",
     )
+    parser.add_argument(
+        "--sg-edges",
+        help="Connect security groups to each other, instead of each of their resources",
+        dest="sg_edges",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--jobs",
+        help="Number of processes to build regions with (default 1)",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--lod",
+        help="Collapse the resources of subnets, and then of VPCs, into summary nodes until the diagram has no more than --max-nodes nodes and --max-edges edges",
+        dest="lod",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-nodes",
+        help="Number of nodes to reduce the diagram to with --lod (default {})".format(
+            MAX_NODES_FOR_WARNING
+        ),
+        dest="max_nodes",
+        default=MAX_NODES_FOR_WARNING,
+        type=int,
+    )
+    parser.add_argument(
+        "--max-edges",
+        help="Number of edges to reduce the diagram to with --lod (default {})".format(
+            MAX_EDGES_FOR_WARNING
+        ),
+        dest="max_edges",
+        default=MAX_EDGES_FOR_WARNING,
+        type=int,
+    )
+    parser.add_argument(
+        "--layout",
+        help="Compute the positions of the nodes, so the browser does not need to lay out the diagram",
+        dest="layout",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--shards",
+        help="Write each VPC to its own file in web/shards/, and only a summary of the VPCs to web/data.json, so the browser loads a VPC when it is double clicked",
+        dest="shards",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--shard-by",
+        help="With --shards, write each VPC (default) or each account to its own file",
+        dest="shard_by",
+        default=None,
+        choices=["vpc", "account"],
+    )
+    parser.add_argument(
+        "--incremental",
+        help="Only rebuild the regions whose collected data changed since the last run, caching the builds in prepare-cache/",
+        dest="incremental",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--graph-cache",
+        help="Keep the graph of the whole account in prepare-cache/, and apply the region, VPC, tag, and internal edge filters to it, so changing them does not rebuild the graph",
+        dest="graph",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--discovery",
+        help="How to find the resources of each region: from the files of each service (default), or from the network interfaces, which also finds resources of services that have no node type, such as NAT gateways",
+        dest="discovery",
+        default="services",
+        choices=["services", "eni"],
+    )
+    parser.add_argument(
+        "--ip-index",
+        help="Name the CIDRs that are not named in the config by the resources of the accounts that own them, from the index built by whois_ip (ex. ip-index.pickle)",
+        dest="ip_index",
+        default=None,
+        type=str,
+    )
     parser.add_argument(
         "--no-node-data",
         help="Do not show node data",
         dest="node_data",
         action="store_false",
     )
+    add_data_source_arguments(parser)
     parser.set_defaults(internal_edges=True)
     parser.set_defaults(inter_rds_edges=False)
     parser.set_defaults(read_replicas=True)
@@ -825,6 +1877,31 @@ def run(arguments):
     outputfilter["collapse_by_tag"] = args.collapse_by_tag
     outputfilter["collapse_asgs"] = args.collapse_asgs
     outputfilter["node_data"] = args.node_data
+    outputfilter["sg_edges"] = args.sg_edges
+    outputfilter["jobs"] = args.jobs
+    outputfilter["lod"] = args.lod
+    outputfilter["layout"] = args.layout
+    outputfilter["shards"] = args.shards
+    outputfilter["max_nodes"] = args.max_nodes
+    outputfilter["max_edges"] = args.max_edges
+    outputfilter["graph"] = args.graph
+    outputfilter["shard_by"] = args.shard_by
+    outputfilter["max_memory"] = args.max_memory
+    if args.discovery != "services":
+        outputfilter["discovery"] = args.discovery
+    if args.ip_index:
+        ip_index = load_ip_index(args.ip_index)
+        if ip_index is None:
+            exit(
+                'ERROR: Unable to load the IP index "{}", build it with whois_ip'.format(
+                    args.ip_index
+                )
+            )
+        outputfilter["ip_index"] = args.ip_index
+        # The cached connections are only used if the index has not changed
+        outputfilter["ip_index_key"] = ip_index.key
+    if args.incremental or args.graph:
+        outputfilter["cache_dir"] = "prepare-cache"
 
     # Read accounts file
     try:
@@ -837,6 +1914,13 @@ def run(arguments):
                 args.config, e
             )
         )
+    if args.accounts:
+        accounts = get_accounts(args.accounts.split(","), config, args.config)
+        load_data_source(args)
+        prepare_accounts(accounts, config, outputfilter)
+        return
+
     account = get_account(args.account_name, config, args.config)
+    load_data_source(args)
 
     prepare(account, config, outputfilter)
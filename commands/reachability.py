@@ -0,0 +1,71 @@
+from __future__ import print_function
+import argparse
+import json
+
+from shared.common import parse_arguments
+from shared.reachability import Reachability, parse_ports, summarize
+
+__description__ = "Find what can reach a resource, or what a source can reach, by port"
+
+
+def reachability(accounts, args):
+    ports = parse_ports(args.ports)
+    results = []
+    for account in accounts:
+        account_reachability = Reachability(account, {})
+        if args.target is not None:
+            account_results = account_reachability.can_reach(
+                args.target, args.protocol, ports
+            )
+        else:
+            account_results = account_reachability.reachable_from(
+                args.source, args.protocol, ports
+            )
+        if not args.by_rule:
+            account_results = summarize(account_results)
+        for result in account_results:
+            result["account"] = account["name"]
+            results.append(result)
+
+    print(json.dumps(results, indent=4, sort_keys=True))
+
+
+def run(arguments):
+    parser = argparse.ArgumentParser()
+    direction = parser.add_mutually_exclusive_group(required=True)
+    direction.add_argument(
+        "--to",
+        help="ARN, id, or name of the resource to find the sources of",
+        dest="target",
+        default=None,
+        type=str,
+    )
+    direction.add_argument(
+        "--from",
+        help="CIDR (ex. 0.0.0.0/0), or ARN, id, or name of the resource to find the targets of",
+        dest="source",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--protocol",
+        help="Protocol, such as tcp, udp, or icmp (default is any)",
+        default="any",
+        type=str,
+    )
+    parser.add_argument(
+        "--port",
+        help="Port or port range, ex. 5432 or 8000-8080 (default is any)",
+        dest="ports",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--by-rule",
+        help="Show each security group rule, instead of combining them by source and target",
+        dest="by_rule",
+        action="store_true",
+    )
+    args, accounts, _ = parse_arguments(arguments, parser)
+
+    reachability(accounts, args)
@@ -1,3 +1,4 @@
+import argparse
 from collections import OrderedDict
 from os import path
 from netaddr import IPNetwork
@@ -10,6 +11,7 @@ from shared.common import (
     is_external_cidr,
     is_unblockable_cidr,
 )
+from shared.ip_index import load_ip_index
 from shared.nodes import Account, Region
 
 # TODO: Considering removing this command. The warnings now live in the audit code.
@@ -77,8 +79,9 @@ def get_cidrs_for_account(account, cidrs):
                     cidrs_seen.add(cidr)
 
 
-def sg_ips(accounts):
-    """Collect trusted ips"""
+def sg_ips(accounts, ip_index=None):
+    """Collect trusted ips. With an IpIndex, the CIDRs owned by the accounts are named
+    by their owners."""
 
     try:
         from mpl_toolkits.basemap import Basemap
@@ -158,6 +161,10 @@ def sg_ips(accounts):
         description = ""
         if len(cidrs[cidr]) > 0:
             description = "|".join(cidrs[cidr])
+        if ip_index is not None:
+            owner_name = ip_index.get_name(cidr)
+            if owner_name is not None:
+                description = "|".join([d for d in [description, owner_name] if d])
         description = description.encode("ascii", "ignore").decode("ascii")
 
         ip = IPNetwork(cidr)
@@ -260,5 +267,22 @@ def sg_ips(accounts):
 
 
 def run(arguments):
-    _, accounts, _ = parse_arguments(arguments)
-    sg_ips(accounts)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--ip-index",
+        help="Name the CIDRs owned by the accounts by their resources, from the index built by whois_ip (ex. ip-index.pickle)",
+        dest="ip_index",
+        default=None,
+        type=str,
+    )
+    args, accounts, _ = parse_arguments(arguments, parser)
+    ip_index = None
+    if args.ip_index:
+        ip_index = load_ip_index(args.ip_index)
+        if ip_index is None:
+            exit(
+                'ERROR: Unable to load the IP index "{}", build it with whois_ip'.format(
+                    args.ip_index
+                )
+            )
+    sg_ips(accounts, ip_index)
@@ -0,0 +1,88 @@
+import argparse
+
+from shared.common import parse_arguments
+from shared.snapshots import DEFAULT_STORE, SnapshotStore
+
+__description__ = "Manage the deduplicated history of collected data"
+
+ACTIONS = ["store", "list", "prune", "compact"]
+
+
+def store_snapshots(store, accounts, args):
+    for account in accounts:
+        snapshot_name = store.store_account(account["name"], args.name)
+        print("Stored {} as snapshot {}".format(account["name"], snapshot_name))
+
+
+def list_snapshots(store, accounts):
+    for account in accounts:
+        for snapshot_name in store.list_snapshots(account["name"]):
+            print("{}\t{}".format(account["name"], snapshot_name))
+
+
+def prune_snapshots(store, accounts, args):
+    if args.keep is None and args.keep_days is None:
+        exit("ERROR: Specify --keep and/or --keep-days")
+    for account in accounts:
+        for snapshot_name in store.prune(account["name"], args.keep, args.keep_days):
+            print("Removed snapshot {} of {}".format(snapshot_name, account["name"]))
+    print("Run the compact action to remove the files no longer used")
+
+
+def compact_snapshots(store):
+    removed, freed = store.compact()
+    print("Removed {} unused files, freeing {} bytes".format(removed, freed))
+
+
+def run(arguments):
+    if len(arguments) == 0 or arguments[0] not in ACTIONS:
+        exit(
+            "ERROR: Missing action for snapshots.\n"
+            "Usage: [{}]".format("|".join(ACTIONS))
+        )
+        return
+    action = arguments[0]
+    arguments = arguments[1:]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--store",
+        help="Directory of the snapshot store",
+        default=DEFAULT_STORE,
+        type=str,
+    )
+    if action == "compact":
+        args = parser.parse_args(arguments)
+        compact_snapshots(SnapshotStore(args.store))
+        return
+
+    if action == "store":
+        parser.add_argument(
+            "--name",
+            help="Name of the snapshot (default is the current time)",
+            default=None,
+            type=str,
+        )
+    elif action == "prune":
+        parser.add_argument(
+            "--keep",
+            help="Number of the newest snapshots to keep for each account",
+            default=None,
+            type=int,
+        )
+        parser.add_argument(
+            "--keep-days",
+            help="Remove snapshots older than this many days",
+            default=None,
+            type=int,
+            dest="keep_days",
+        )
+    args, accounts, _ = parse_arguments(arguments, parser)
+    store = SnapshotStore(args.store)
+
+    if action == "store":
+        store_snapshots(store, accounts, args)
+    elif action == "list":
+        list_snapshots(store, accounts)
+    elif action == "prune":
+        prune_snapshots(store, accounts, args)
@@ -0,0 +1,72 @@
+import argparse
+import json
+
+from shared.common import parse_arguments
+from shared.nodes import Account
+from shared.tag_index import build_tag_index
+
+__description__ = "List the tags of the resources in accounts, or find resources by tag"
+
+
+def get_tag_counts(tag_indexes, key=None):
+    """
+    Returns the number of resources with each tag key, or with each value of the key
+    """
+    counts = {}
+    for tag_index in tag_indexes.values():
+        if key is None:
+            for tag_key, values in tag_index.index.items():
+                counts[tag_key] = counts.get(tag_key, 0) + len(
+                    set().union(*values.values())
+                )
+        else:
+            for value, resources in tag_index.index.get(key, {}).items():
+                counts[value] = counts.get(value, 0) + len(resources)
+    return counts
+
+
+def find_resources(tag_indexes, tag_sets):
+    """Returns the resources of each account matching one of the tag sets"""
+    resources = []
+    for account_name, tag_index in tag_indexes.items():
+        for arn in sorted(tag_index.match(tag_sets)):
+            resources.append(
+                {
+                    "account": account_name,
+                    "region": tag_index.resource_regions[arn],
+                    "arn": arn,
+                    "tags": {
+                        tag["Key"]: tag["Value"] for tag in tag_index.get_tags(arn)
+                    },
+                }
+            )
+    return resources
+
+
+def run(arguments):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--tags",
+        help="Find the resources with tags (ex. Name=batch,Env=prod), where the tag matches are AND'd together. Use this multiple times to OR sets (ex. --tags Env=prod --tags Env=dev)",
+        dest="tags",
+        default=None,
+        type=str,
+        action="append",
+    )
+    parser.add_argument(
+        "--key",
+        help="Count the resources with each value of this tag key, instead of with each key",
+        default=None,
+        type=str,
+    )
+    args, accounts, _ = parse_arguments(arguments, parser)
+
+    tag_indexes = {}
+    for account in accounts:
+        tag_indexes[account["name"]] = build_tag_index(Account(None, account))
+
+    if args.tags:
+        output = find_resources(tag_indexes, args.tags)
+    else:
+        output = get_tag_counts(tag_indexes, args.key)
+    print(json.dumps(output, indent=2, sort_keys=True))
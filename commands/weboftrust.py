@@ -1,5 +1,4 @@
 import argparse
-from os import path, listdir
 import json
 import yaml
 import pyjq
@@ -12,6 +11,9 @@ from shared.common import (
     get_regions,
     get_account_by_id,
 )
+from shared.cytoscape import CytoscapeWriter
+from shared.layout import add_positions
+from shared.query import get_file_size, get_parameter_file, list_parameter_files
 
 __description__ = "Create Web Of Trust diagram for accounts"
 
@@ -356,18 +358,15 @@ def get_iam_trusts(account, nodes, connections, connections_to_get):
 
 
 def get_s3_trusts(account, nodes, connections):
-    policy_dir = "./account-data/{}/us-east-1/s3-get-bucket-policy/".format(
-        account.name
-    )
-    for s3_policy_file in [
-        f
-        for f in listdir(policy_dir)
-        if path.isfile(path.join(policy_dir, f))
-        and path.getsize(path.join(policy_dir, f)) > 4
-    ]:
-        s3_policy = json.load(open(path.join(policy_dir, s3_policy_file)))
-        s3_policy = json.loads(s3_policy["Policy"])
+    region = Region(account, {"RegionName": "us-east-1"})
+    for s3_policy_file in list_parameter_files(
+        account.name, region.name, "s3", "get-bucket-policy"
+    ):
         s3_bucket_name = urllib.parse.unquote_plus(s3_policy_file)
+        s3_policy = get_parameter_file(
+            region, "s3", "get-bucket-policy", s3_bucket_name
+        )
+        s3_policy = json.loads(s3_policy["Policy"])
         for s in s3_policy["Statement"]:
             principals = s.get("Principal", None)
             if principals is None:
@@ -445,22 +444,22 @@ def get_nodes_and_connections(account_data, nodes, connections, args):
 
 
 def weboftrust(args, accounts, config):
-    """Collect the data and write it to a file"""
+    """Collect the data and generate the cytoscape elements for it"""
 
     nodes = {}
     connections = {}
     for account in accounts:
         # Check if the account data exists
-        if not path.exists(
-            "./account-data/{}/us-east-1/iam-get-account-authorization-details.json".format(
-                account["name"]
+        if (
+            get_file_size(
+                account["name"], "us-east-1/iam-get-account-authorization-details.json"
             )
+            is None
         ):
             print("INFO: Skipping account {}".format(account["name"]))
             continue
         get_nodes_and_connections(account, nodes, connections, args)
 
-    cytoscape_json = []
     parents = set()
 
     with open("vendor_accounts.yaml", "r") as f:
@@ -518,13 +517,13 @@ def weboftrust(args, accounts, config):
             if n.type == "aws" and not args.show_aws_owned_accounts:
                 continue
 
-        cytoscape_json.append(n.cytoscape_data())
+        yield n.cytoscape_data()
 
     # Add compound parent nodes
     for p in parents:
         n = Account(account_id=p)
         n.type = "account_grouping"
-        cytoscape_json.append(n.cytoscape_data())
+        yield n.cytoscape_data()
 
     num_connections = 0
     # Add the mapping to our graph
@@ -546,12 +545,10 @@ def weboftrust(args, accounts, config):
             continue
         # print('{} -> {}'.format(c.source.id, c.target.id))
         c._json = reasons
-        cytoscape_json.append(c.cytoscape_data())
+        yield c.cytoscape_data()
         num_connections += 1
     print("- {} connections built".format(num_connections))
 
-    return cytoscape_json
-
 
 def run(arguments):
     parser = argparse.ArgumentParser()
@@ -575,12 +572,20 @@ def run(arguments):
         default=False,
         action="store_true",
     )
+    parser.add_argument(
+        "--layout",
+        help="Compute the positions of the nodes, so the browser does not need to lay out the diagram",
+        default=False,
+        action="store_true",
+    )
     args, accounts, config = parse_arguments(arguments, parser)
 
     if args.network_only and args.admin_only:
         print("ERROR: You cannot use network_only and admin_only at the same time")
         exit(-1)
 
-    cytoscape_json = weboftrust(args, accounts, config)
-    with open("web/data.json", "w") as outfile:
-        json.dump(cytoscape_json, outfile, indent=4)
+    elements = weboftrust(args, accounts, config)
+    if args.layout:
+        elements = add_positions(list(elements))
+    with CytoscapeWriter("web/data.json") as writer:
+        writer.write_all(elements)
@@ -21,7 +21,9 @@ SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSE
 WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
 USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
+
 import argparse
+import json
 import os
 import posixpath
 import socket
@@ -29,6 +31,9 @@ from six.moves import urllib
 from six.moves.BaseHTTPServer import HTTPServer
 from six.moves.SimpleHTTPServer import SimpleHTTPRequestHandler
 
+from shared.graph_index import get_filters
+from shared.prepare_cache import load_stored, get_stored_path, GRAPH_CACHE_NAME
+
 __description__ = "Run a webserver to display network or web of trust map"
 
 
@@ -46,6 +51,11 @@ class RootedHTTPServerV6(RootedHTTPServer, object):
 
 
 class MyHTTPRequestHandler(SimpleHTTPRequestHandler):
+    graph_account = None
+    # The graph is kept between requests, until prepare stores a new one
+    graph = None
+    graph_mtime = None
+
     def translate_path(self, path):
         path = posixpath.normpath(urllib.parse.unquote(path))
         words = path.split("/")
@@ -61,6 +71,55 @@ class MyHTTPRequestHandler(SimpleHTTPRequestHandler):
             path = os.path.join(path, word)
         return path
 
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path == "/graph.json" and self.graph_account is not None:
+            self.send_graph(urllib.parse.parse_qs(url.query))
+            return
+        SimpleHTTPRequestHandler.do_GET(self)
+
+    def send_graph(self, parameters):
+        """
+        Sends the graph kept by prepare --graph-cache, with the filters of the query
+        string, ex. /graph.json?regions=us-east-1&tags=Env=prod&internal_edges=false
+        """
+        path = get_stored_path("prepare-cache", self.graph_account, GRAPH_CACHE_NAME)
+        if os.path.exists(path) and os.path.getmtime(path) != self.graph_mtime:
+            MyHTTPRequestHandler.graph_mtime = os.path.getmtime(path)
+            MyHTTPRequestHandler.graph = load_stored(
+                "prepare-cache", self.graph_account, GRAPH_CACHE_NAME
+            )
+        graph = self.graph
+        if graph is None:
+            self.send_error(
+                404,
+                "No graph for {}, run prepare with --graph-cache".format(
+                    self.graph_account
+                ),
+            )
+            return
+
+        outputfilter = {
+            "internal_edges": parameters.get("internal_edges", ["true"])[0] != "false"
+        }
+        # Given as in the arguments of prepare, ex. regions=us-east-1,us-west-2
+        for option in ["regions", "vpc-ids", "vpc-names"]:
+            if option in parameters:
+                outputfilter[option] = ",".join(
+                    ['"' + r + '"' for r in parameters[option][0].split(",")]
+                )
+        if "tags" in parameters:
+            outputfilter["tags"] = parameters["tags"]
+        body = json.dumps(
+            graph.query(**get_filters(outputfilter)), separators=(",", ":")
+        ).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def end_headers(self):
         self.send_my_headers()
         SimpleHTTPRequestHandler.end_headers(self)
@@ -85,6 +144,13 @@ def run(arguments):
     parser.add_argument(
         "--ipv6", dest="is_ipv6", help="Listen on IPv6", action="store_true"
     )
+    parser.add_argument(
+        "--graph",
+        dest="graph_account",
+        help="Serve /graph.json, filtering the graph that prepare --graph-cache kept for this account",
+        default=None,
+        type=str,
+    )
     parser.set_defaults(is_public=False, is_ipv6=False)
     args = parser.parse_args(arguments)
 
@@ -95,6 +161,7 @@ def run(arguments):
 
     Handler = MyHTTPRequestHandler
     Handler.extensions_map[".svg"] = "image/svg+xml"
+    Handler.graph_account = args.graph_account
 
     if args.is_ipv6:
         httpd = RootedHTTPServerV6("web", (listening_host, args.port), Handler)
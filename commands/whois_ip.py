@@ -0,0 +1,231 @@
+import argparse
+import hashlib
+import json
+
+import pyjq
+from netaddr import IPNetwork
+
+from commands.prepare import ResourceDescriptions
+from shared.common import parse_arguments, get_regions, log_debug
+from shared.ip_index import IpIndex, IP_INDEX_PATH, load_ip_index, store_ip_index
+from shared.network_interfaces import get_interface_owner
+from shared.nodes import Account, Region, get_name
+from shared.prepare_cache import get_region_inputs_hash
+from shared.query import query_aws
+
+__description__ = "Find the resources, subnets and VPCs of the accounts that own IPs"
+
+# The fields of the id and name of the resources looked up for their interfaces
+RESOURCE_FIELDS = {
+    "vpc_endpoint": ("VpcEndpointId", "ServiceName"),
+    "elb": ("LoadBalancerName", "LoadBalancerName"),
+    "elbv2": ("LoadBalancerArn", "LoadBalancerName"),
+    "ecs": ("taskArn", "taskDefinitionArn"),
+    "lambda": ("FunctionArn", "FunctionName"),
+    "rds": ("DBInstanceArn", "DBInstanceIdentifier"),
+    "redshift": ("ClusterIdentifier", "ClusterIdentifier"),
+    "elasticsearch": ("ARN", "DomainName"),
+}
+
+
+def get_index_key(accounts):
+    """Returns the key of the collected files of the accounts, to know if the index
+    needs to be built again"""
+    digest = hashlib.sha256()
+    for account_data in accounts:
+        account = Account(None, account_data)
+        for region_json in get_regions(account):
+            digest.update(
+                "{} {} {}\n".format(
+                    account.name,
+                    region_json["RegionName"],
+                    get_region_inputs_hash(account.name, region_json["RegionName"]),
+                ).encode()
+            )
+    return digest.hexdigest()
+
+
+def get_interface_ips(interface):
+    """Returns the private and public IPs of a network interface"""
+    ips = []
+    for address in interface.get("PrivateIpAddresses", None) or []:
+        ips.append(address.get("PrivateIpAddress", None))
+        ips.append(address.get("Association", {}).get("PublicIp", None))
+    ips.append(interface.get("PrivateIpAddress", None))
+    ips.append(interface.get("Association", {}).get("PublicIp", None))
+    for address in interface.get("Ipv6Addresses", None) or []:
+        ips.append(address.get("Ipv6Address", None))
+    return [ip for ip in dict.fromkeys(ips) if ip is not None]
+
+
+def add_region(ip_index, region):
+    """Adds the resources with an IP, and the subnets and VPCs, of the region"""
+    account = region.account
+    owner = {
+        "account": account.name,
+        "account_id": account.local_id,
+        "region": region.name,
+    }
+
+    for vpc in pyjq.all(".Vpcs[]?", query_aws(account, "ec2-describe-vpcs", region)):
+        vpc_owner = dict(
+            owner, type="vpc", id=vpc["VpcId"], name=get_name(vpc, "VpcId")
+        )
+        for cidr in pyjq.all(
+            "[.CidrBlockAssociationSet[]?.CidrBlock, .Ipv6CidrBlockAssociationSet[]?.Ipv6CidrBlock][]",
+            vpc,
+        ):
+            ip_index.add(cidr, vpc_owner)
+    for subnet in pyjq.all(
+        ".Subnets[]?", query_aws(account, "ec2-describe-subnets", region)
+    ):
+        subnet_owner = dict(
+            owner,
+            type="subnet",
+            id=subnet["SubnetId"],
+            name=get_name(subnet, "SubnetId"),
+            vpc=subnet["VpcId"],
+        )
+        ip_index.add(subnet["CidrBlock"], subnet_owner)
+        for cidr in pyjq.all(".Ipv6CidrBlockAssociationSet[]?.Ipv6CidrBlock", subnet):
+            ip_index.add(cidr, subnet_owner)
+
+    # Instances, including those that are not running, by their id
+    instances = {
+        instance["InstanceId"]: instance
+        for instance in pyjq.all(
+            ".Reservations[]?.Instances[]?",
+            query_aws(account, "ec2-describe-instances", region),
+        )
+    }
+    indexed_instances = set()
+
+    descriptions = ResourceDescriptions(region)
+    interfaces = query_aws(account, "ec2-describe-network-interfaces", region)
+    for interface in interfaces.get("NetworkInterfaces", None) or []:
+        interface_owner = get_interface_owner(interface)
+        if interface_owner is None:
+            continue
+        node_type, resource_id = interface_owner
+        resources = []
+        if node_type == "ec2":
+            if resource_id in instances:
+                resources = [
+                    (resource_id, get_name(instances[resource_id], "InstanceId"))
+                ]
+                indexed_instances.add(resource_id)
+        elif node_type != "network_interface":
+            id_field, name_field = RESOURCE_FIELDS[node_type]
+            resources = [
+                (resource[id_field], resource[name_field])
+                for resource in descriptions.find(node_type, resource_id, interface)
+            ]
+        if len(resources) == 0:
+            resources = [
+                (
+                    resource_id or interface["NetworkInterfaceId"],
+                    interface.get("Description", None) or None,
+                )
+            ]
+
+        for ip in get_interface_ips(interface):
+            for resource, name in resources:
+                ip_index.add(
+                    ip,
+                    dict(
+                        owner,
+                        type=node_type,
+                        id=resource,
+                        name=name,
+                        interface=interface["NetworkInterfaceId"],
+                        vpc=interface.get("VpcId", None),
+                        subnet=interface.get("SubnetId", None),
+                        security_groups=[
+                            group["GroupId"] for group in interface.get("Groups", [])
+                        ],
+                    ),
+                )
+
+    # Instances whose interfaces were not collected
+    for instance_id, instance in instances.items():
+        if instance_id in indexed_instances:
+            continue
+        for ip in [
+            instance.get("PrivateIpAddress", None),
+            instance.get("PublicIpAddress", None),
+        ]:
+            if ip is None:
+                continue
+            ip_index.add(
+                ip,
+                dict(
+                    owner,
+                    type="ec2",
+                    id=instance_id,
+                    name=get_name(instance, "InstanceId"),
+                    interface=None,
+                    vpc=instance.get("VpcId", None),
+                    subnet=instance.get("SubnetId", None),
+                    security_groups=pyjq.all(".SecurityGroups[]?.GroupId", instance),
+                ),
+            )
+
+
+def build_ip_index(accounts, key=None):
+    """Builds the IpIndex of the accounts, from the collected data of all their regions"""
+    ip_index = IpIndex(key)
+    for account_data in accounts:
+        account = Account(None, account_data)
+        log_debug("Indexing the IPs of account {}".format(account.name))
+        for region_json in get_regions(account):
+            add_region(ip_index, Region(account, region_json))
+    return ip_index
+
+
+def get_ip_index(accounts, path=IP_INDEX_PATH, rebuild=False):
+    """
+    Returns the IpIndex of the accounts stored at the path, or builds and stores it
+    if it is missing or the collected files changed since it was built
+    """
+    key = get_index_key(accounts)
+    if not rebuild:
+        ip_index = load_ip_index(path)
+        if ip_index is not None and ip_index.key == key:
+            return ip_index
+    ip_index = build_ip_index(accounts, key)
+    store_ip_index(ip_index, path)
+    return ip_index
+
+
+def whois_ip(ip_index, ips):
+    """Returns the owners of each IP or CIDR, from the most specific"""
+    output = {}
+    for ip in ips:
+        owners = [dict(owner, cidr=cidr) for cidr, owner in ip_index.lookup(ip)]
+        if IPNetwork(ip).size > 1:
+            # For CIDRs, the resources in them
+            owners.extend(
+                dict(owner, cidr=address) for address, owner in ip_index.within(ip)
+            )
+        output[ip] = owners
+    return output
+
+
+def run(arguments):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("ips", help="IPs or CIDRs to find the owners of", nargs="+")
+    parser.add_argument(
+        "--index",
+        help="File to keep the index of the IPs in (default {})".format(IP_INDEX_PATH),
+        default=IP_INDEX_PATH,
+        type=str,
+    )
+    parser.add_argument(
+        "--rebuild",
+        help="Build the index again, even if the collected data has not changed",
+        action="store_true",
+    )
+    args, accounts, _ = parse_arguments(arguments, parser)
+
+    ip_index = get_ip_index(accounts, args.index, args.rebuild)
+    print(json.dumps(whois_ip(ip_index, args.ips), indent=2, sort_keys=True))
@@ -22,7 +22,13 @@ from shared.common import (
     get_collection_date,
     days_between,
 )
-from shared.query import query_aws, get_parameter_file
+from shared.query import (
+    query_aws,
+    get_parameter_file,
+    get_parameter_files,
+    get_loaded_file,
+    get_account_file,
+)
 from shared.nodes import Account, Region, get_name
 from shared.iam_audit import find_admins_in_account
 
@@ -96,12 +102,13 @@ def load_audit_config():
 def audit_s3_buckets(findings, region):
     buckets_json = query_aws(region.account, "s3-list-buckets", region)
     buckets = pyjq.all(".Buckets[].Name", buckets_json)
+    policy_files = get_parameter_files(region, "s3", "get-bucket-policy", buckets)
+    acl_files = get_parameter_files(region, "s3", "get-bucket-acl", buckets)
     for bucket in buckets:
         # Check policy
+        policy_string = None
         try:
-            policy_file_json = get_parameter_file(
-                region, "s3", "get-bucket-policy", bucket
-            )
+            policy_file_json = get_loaded_file(policy_files, bucket)
             if policy_file_json is not None:
                 # Find the entity we need
                 policy_string = policy_file_json["Policy"]
@@ -140,8 +147,9 @@ def audit_s3_buckets(findings, region):
                 )
             )
         # Check ACL
+        grant = None
         try:
-            file_json = get_parameter_file(region, "s3", "get-bucket-acl", bucket)
+            file_json = get_loaded_file(acl_files, bucket)
             for grant in file_json["Grants"]:
                 uri = grant["Grantee"].get("URI", "")
                 if (
@@ -563,8 +571,10 @@ def audit_route53(findings, region):
             vpc_json,
         )
         for vpc in vpcs:
-            hosted_zone_file = f"account-data/{region.account.name}/{region.name}/route53-list-hosted-zones-by-vpc/{region_name}/{vpc}"
-            hosted_zones_json = json.load(open(hosted_zone_file))
+            hosted_zone_file = (
+                f"{region.name}/route53-list-hosted-zones-by-vpc/{region_name}/{vpc}"
+            )
+            hosted_zones_json = get_account_file(region.account.name, hosted_zone_file)
             hosted_zones = pyjq.all(".HostedZoneSummaries[]?", hosted_zones_json)
             for hosted_zone in hosted_zones:
                 if hosted_zone.get("Owner", {}).get("OwningAccount", "") != "":
@@ -584,11 +594,16 @@ def audit_route53(findings, region):
 
 def audit_ebs_snapshots(findings, region):
     json_blob = query_aws(region.account, "ec2-describe-snapshots", region)
-    for snapshot in json_blob.get("Snapshots", []):
+    snapshots = json_blob.get("Snapshots", [])
+    attribute_files = get_parameter_files(
+        region,
+        "ec2",
+        "describe-snapshot-attribute",
+        [snapshot["SnapshotId"] for snapshot in snapshots],
+    )
+    for snapshot in snapshots:
         try:
-            file_json = get_parameter_file(
-                region, "ec2", "describe-snapshot-attribute", snapshot["SnapshotId"]
-            )
+            file_json = get_loaded_file(attribute_files, snapshot["SnapshotId"])
             if file_json is None:
                 # Not technically an exception, but an unexpected situation
                 findings.add(
@@ -979,11 +994,18 @@ def audit_sg(findings, region):
 def audit_lambda(findings, region):
     # Check for publicly accessible functions.  They should be called from apigateway or something else.
     json_blob = query_aws(region.account, "lambda-list-functions", region)
-    for function in json_blob.get("Functions", []):
+    functions = json_blob.get("Functions", [])
+    policy_files = get_parameter_files(
+        region,
+        "lambda",
+        "get-policy",
+        [function["FunctionName"] for function in functions],
+    )
+    for function in functions:
         name = function["FunctionName"]
 
         # Check policy
-        policy_file_json = get_parameter_file(region, "lambda", "get-policy", name)
+        policy_file_json = get_loaded_file(policy_files, name)
         if policy_file_json is None:
             # No policy
             continue
@@ -1035,11 +1057,15 @@ def audit_kms(findings, region):
         # Service not supported in the region
         return
 
-    for key in json_blob.get("Keys", []):
+    keys = json_blob.get("Keys", [])
+    policy_files = get_parameter_files(
+        region, "kms", "get-key-policy", [key["KeyId"] for key in keys]
+    )
+    for key in keys:
         name = key["KeyId"]
 
         # Check policy
-        policy_file_json = get_parameter_file(region, "kms", "get-key-policy", name)
+        policy_file_json = get_loaded_file(policy_files, name)
         if policy_file_json is None:
             # No policy
             continue
@@ -1062,12 +1088,12 @@ def audit_sqs(findings, region):
         # Service not supported in the region
         return
 
-    for queue in json_blob.get("QueueUrls", []):
+    queues = json_blob.get("QueueUrls", [])
+    attribute_files = get_parameter_files(region, "sqs", "get-queue-attributes", queues)
+    for queue in queues:
         queue_name = queue.split("/")[-1]
         # Check policy
-        queue_attributes = get_parameter_file(
-            region, "sqs", "get-queue-attributes", queue
-        )
+        queue_attributes = get_loaded_file(attribute_files, queue)
         if queue_attributes is None:
             # No policy
             continue
@@ -1098,11 +1124,13 @@ def audit_sns(findings, region):
         # Service not supported in the region
         return
 
-    for topic in json_blob.get("Topics", []):
+    topics = json_blob.get("Topics", [])
+    attribute_files = get_parameter_files(
+        region, "sns", "get-topic-attributes", [topic["TopicArn"] for topic in topics]
+    )
+    for topic in topics:
         # Check policy
-        attributes = get_parameter_file(
-            region, "sns", "get-topic-attributes", topic["TopicArn"]
-        )
+        attributes = get_loaded_file(attribute_files, topic["TopicArn"])
         if attributes is None:
             # No policy
             continue
@@ -8,7 +8,16 @@ import sys
 from netaddr import IPNetwork
 
 from shared.nodes import Account, Region
-from shared.query import query_aws, get_parameter_file
+from shared.query import (
+    query_aws,
+    get_parameter_file,
+    get_parameter_files,
+    get_loaded_file,
+    set_data_archive,
+    set_data_source,
+    set_intern_strings,
+)
+from shared.snapshots import DEFAULT_STORE, Snapshot, SnapshotStore
 
 
 class Severity:
@@ -229,11 +238,14 @@ def parse_arguments(arguments, parser=None):
         required=False,
         type=str,
     )
+    add_data_source_arguments(parser)
     args = parser.parse_args(arguments)
 
     global LOG_LEVEL
     LOG_LEVEL = Severity.str_to_int(args.log_level)
 
+    load_data_source(args)
+
     # Read accounts file
     try:
         config = json.load(open(args.config))
@@ -247,7 +259,13 @@ def parse_arguments(arguments, parser=None):
         )
 
     # Get accounts
-    account_names = args.accounts.split(",")
+    accounts = get_accounts(args.accounts.split(","), config, args.config)
+
+    return (args, accounts, config)
+
+
+def get_accounts(account_names, config, config_filename="config.json"):
+    """Returns the accounts with the names, or all of them if one of the names is all"""
     accounts = []
     # TODO Need to be able to tag accounts into sets (ex. Prod, or by business unit) so the tag can be referenced
     # as opposed to the individual account names.
@@ -256,9 +274,59 @@ def parse_arguments(arguments, parser=None):
             for account in config["accounts"]:
                 accounts.append(account)
             break
-        accounts.append(get_account(account_name, config, args.config))
+        accounts.append(get_account(account_name, config, config_filename))
+    return accounts
 
-    return (args, accounts, config)
+
+def add_data_source_arguments(parser):
+    """Arguments for reading the collected data from somewhere other than account-data/"""
+    parser.add_argument(
+        "--data-archive",
+        help="Read the collected data from a zip or tar of account-data/ instead of the directory",
+        default=None,
+        required=False,
+        type=str,
+        dest="data_archive",
+    )
+    parser.add_argument(
+        "--snapshot",
+        help="Read the collected data from the newest snapshot whose name starts with this (ex. 2019-05-07, or latest)",
+        default=None,
+        required=False,
+        type=str,
+    )
+    parser.add_argument(
+        "--snapshot-store",
+        help="Directory of the snapshot store",
+        default=DEFAULT_STORE,
+        required=False,
+        type=str,
+        dest="snapshot_store",
+    )
+    parser.add_argument(
+        "--intern-strings",
+        help="Deduplicate the keys and short values of the loaded data to reduce memory use",
+        action="store_true",
+        dest="intern_strings",
+    )
+
+
+def load_data_source(args):
+    """Use the data archive or snapshot given in the arguments for all collected data"""
+    set_intern_strings(args.intern_strings)
+    if args.data_archive is not None and args.snapshot is not None:
+        exit("ERROR: Only one of --data-archive and --snapshot can be used")
+    if args.data_archive is not None:
+        try:
+            set_data_archive(args.data_archive)
+        except Exception as e:
+            exit(
+                'ERROR: Unable to load data archive "{}" ({})'.format(
+                    args.data_archive, e
+                )
+            )
+    elif args.snapshot is not None:
+        set_data_source(Snapshot(SnapshotStore(args.snapshot_store), args.snapshot))
 
 
 def get_account_stats(account, all_resources=False):
@@ -378,10 +446,30 @@ def get_access_advisor_active_counts(account, max_age=90):
         "users": {"active": 0, "inactive": 0},
         "roles": {"active": 0, "inactive": 0},
     }
-    for principal_auth in [
+    principal_auths = [
         *json_account_auth_details["UserDetailList"],
         *json_account_auth_details["RoleDetailList"],
-    ]:
+    ]
+
+    # Load the job files for all principals, and then the results of those jobs
+    job_details_files = get_parameter_files(
+        region,
+        "iam",
+        "generate-service-last-accessed-details",
+        [principal_auth["Arn"] for principal_auth in principal_auths],
+    )
+    last_access_details_files = get_parameter_files(
+        region,
+        "iam",
+        "get-service-last-accessed-details",
+        [
+            job_details["JobId"]
+            for job_details in job_details_files.values()
+            if job_details is not None and not isinstance(job_details, Exception)
+        ],
+    )
+
+    for principal_auth in principal_auths:
         stats = {}
         stats["auth"] = principal_auth
 
@@ -389,12 +477,7 @@ def get_access_advisor_active_counts(account, max_age=90):
         if "UserName" in principal_auth:
             principal_type = "users"
 
-        job_details = get_parameter_file(
-            region,
-            "iam",
-            "generate-service-last-accessed-details",
-            principal_auth["Arn"],
-        )
+        job_details = get_loaded_file(job_details_files, principal_auth["Arn"])
         if job_details is None:
             print(
                 "Missing data for arn {} in {}".format(
@@ -404,9 +487,7 @@ def get_access_advisor_active_counts(account, max_age=90):
             continue
 
         job_id = job_details["JobId"]
-        json_last_access_details = get_parameter_file(
-            region, "iam", "get-service-last-accessed-details", job_id
-        )
+        json_last_access_details = get_loaded_file(last_access_details_files, job_id)
         if json_last_access_details is None:
             print("Missing data for job id {} in {}".format(job_id, account.name))
             continue
@@ -0,0 +1,66 @@
+import json
+import os
+
+
+class CytoscapeWriter(object):
+    """
+    Writes cytoscape elements to a JSON file as they are given, so the whole graph
+    never needs to be held in memory or serialized at once.
+    The file is a JSON array with one element per line, written with compact separators
+    unless an indent is given.
+    Without node_data, the node_data of each element is emptied as it is written.
+    The elements are written to a temporary file, which only replaces the file at path
+    once all of them are written, so a build that fails partway keeps the last map.
+    """
+
+    path = None
+    node_data = True
+    indent = None
+    count = 0
+
+    _file = None
+    _encoder = None
+
+    def __init__(self, path, node_data=True, indent=None):
+        self.path = path
+        self.node_data = node_data
+        self.indent = indent
+        self.count = 0
+        if indent is None:
+            self._encoder = json.JSONEncoder(separators=(",", ":"))
+        else:
+            self._encoder = json.JSONEncoder(indent=indent)
+
+    def __enter__(self):
+        self._file = open(self.path + ".tmp", "w")
+        self._file.write("[")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self.path + ".tmp")
+            return False
+        self._file.write("\n]\n")
+        self._file.close()
+        self._file = None
+        os.replace(self.path + ".tmp", self.path)
+
+    def write(self, element):
+        if not self.node_data and "data" in element:
+            # Copy the element rather than changing the one given
+            element = dict(element)
+            element["data"] = dict(element["data"])
+            element["data"]["node_data"] = {}
+
+        if self.count > 0:
+            self._file.write(",")
+        self._file.write("\n")
+        for chunk in self._encoder.iterencode(element):
+            self._file.write(chunk)
+        self.count += 1
+
+    def write_all(self, elements):
+        for element in elements:
+            self.write(element)
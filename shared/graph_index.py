@@ -0,0 +1,236 @@
+import json
+
+from shared.tag_index import TagIndex, match_tag_sets
+
+# Options of prepare that only select part of the graph, so they can be applied to
+# the unfiltered graph instead of building it again
+FILTER_OPTIONS = ("regions", "vpc-ids", "vpc-names", "tags", "internal_edges")
+
+
+def get_unfiltered_options(outputfilter):
+    """Returns the options of prepare without the filters, to build the full graph"""
+    options = {
+        option: value
+        for option, value in outputfilter.items()
+        if option not in FILTER_OPTIONS
+    }
+    options["internal_edges"] = True
+    return options
+
+
+def get_filters(outputfilter):
+    """Returns the arguments of GraphIndex.query for the filters of prepare"""
+    filters = {"internal_edges": outputfilter.get("internal_edges", True)}
+    # These are kept as lists of quoted strings, ex. '"us-east-1","us-west-2"', for jq
+    for option, argument in [
+        ("regions", "regions"),
+        ("vpc-ids", "vpc_ids"),
+        ("vpc-names", "vpc_names"),
+    ]:
+        if option in outputfilter:
+            filters[argument] = json.loads("[" + outputfilter[option] + "]")
+    if len(outputfilter.get("tags", None) or []) > 0:
+        filters["tags"] = outputfilter["tags"]
+    return filters
+
+
+class GraphIndex(object):
+    """
+    The full graph of an account, as built by prepare without filters, with the
+    resources indexed by region, VPC, tag and type.
+    The filters of prepare are then queries of this graph, which give the same
+    elements as building the graph with those filters, except for CIDRs without edges.
+    """
+
+    elements = None
+    external_edges = None
+    # The containers (region, VPC, AZ, subnet) of each resource
+    ancestors = None
+    # The resources, and the nodes containing them
+    region_nodes = None
+    regions = None
+    vpcs = None
+    vpc_names = None
+    # Tag key -> tag value -> resources
+    tags = None
+    types = None
+
+    def __init__(self, account, elements, external_edges):
+        """
+        Indexes the elements of the account's graph. external_edges are the edges of
+        the graph built without internal edges, whose reasons differ.
+        """
+        self.elements = elements
+        self.external_edges = external_edges
+        self.ancestors = {}
+        self.region_nodes = set()
+        self.regions = {}
+        self.vpcs = {}
+        self.vpc_names = {}
+        self.tags = {}
+        self.types = {}
+
+        for region in account.children:
+            tag_index = TagIndex()
+            tag_index.add_region(region)
+            for vpc in region.children:
+                name = None
+                for tag in vpc.json.get("Tags", None) or []:
+                    if tag.get("Key", "") == "Name":
+                        name = tag.get("Value", "")
+                self.vpc_names[vpc.local_id] = name
+
+                # The tree below the VPC, as (node, ancestors)
+                stack = [(vpc, (region.arn, vpc.arn))]
+                while len(stack) > 0:
+                    node, ancestors = stack.pop()
+                    for child in node.children:
+                        if not child.isLeaf:
+                            stack.append((child, ancestors + (child.arn,)))
+                            continue
+                        self.ancestors[child.arn] = ancestors
+                        self.region_nodes.add(child.arn)
+                        self.region_nodes.update(ancestors)
+                        self.regions.setdefault(region.local_id, set()).add(child.arn)
+                        self.vpcs.setdefault(vpc.local_id, set()).add(child.arn)
+                        self.types.setdefault(child.node_type, set()).add(child.arn)
+                        for tag in tag_index.get_tags(child.aws_arn):
+                            self.tags.setdefault(tag["Key"], {}).setdefault(
+                                tag["Value"], set()
+                            ).add(child.arn)
+
+    def select(
+        self,
+        regions=None,
+        vpc_ids=None,
+        vpc_names=None,
+        tags=None,
+        node_types=None,
+    ):
+        """
+        Returns the resources matching the filters. As with prepare, regions, VPC ids
+        and VPC names match if they contain one of the strings given. Each tag set is
+        a string such as "Env=prod,Team=web", matching resources with all of its tags,
+        and resources match if they match one of the tag sets.
+        """
+        resources = set(self.ancestors)
+        if regions:
+            resources &= _union(self.regions, _matching(self.regions, regions))
+        if vpc_ids:
+            resources &= _union(self.vpcs, _matching(self.vpcs, vpc_ids))
+        if vpc_names:
+            resources &= _union(
+                self.vpcs,
+                [
+                    vpc_id
+                    for vpc_id, name in self.vpc_names.items()
+                    if name is not None and len(_matching([name], vpc_names)) > 0
+                ],
+            )
+        if tags:
+            resources &= match_tag_sets(self.tags, tags)
+        if node_types:
+            resources &= _union(self.types, node_types)
+        return resources
+
+    def query(self, internal_edges=True, **filters):
+        """
+        Returns the elements of the graph with the resources selected by the filters,
+        given as for select, and their containers and edges.
+        CIDRs and security groups are kept if they have an edge left.
+        """
+        resources = self.select(**filters)
+        filtered = len(resources) < len(self.ancestors)
+        kept = set(resources)
+        for resource in resources:
+            kept.update(self.ancestors[resource])
+
+        # Edges between kept nodes, and the nodes outside of the regions
+        edges = []
+        connected = set()
+        for element in self.elements if internal_edges else self.external_edges:
+            data = element["data"]
+            if data["type"] != "edge":
+                continue
+            if not all(
+                end in kept or end not in self.region_nodes
+                for end in (data["source"], data["target"])
+            ):
+                continue
+            if filtered and "source_members" in data:
+                # Aggregate edges only stand for the members that are kept
+                source_members = [m for m in data["source_members"] if m in kept]
+                target_members = [m for m in data["target_members"] if m in kept]
+                if len(source_members) == 0 or len(target_members) == 0:
+                    continue
+                element = {
+                    "data": dict(
+                        data,
+                        source_members=source_members,
+                        target_members=target_members,
+                    )
+                }
+            edges.append(element)
+            connected.add(data["source"])
+            connected.add(data["target"])
+
+        # The security groups that the edges refer to, and the json of resources
+        # that their copies refer to
+        group_ids = set()
+        for element in edges:
+            for reason in element["data"]["node_data"]:
+                if isinstance(reason, str):
+                    group_ids.add(reason)
+        node_data_refs = set()
+
+        elements = []
+        for element in self.elements:
+            data = element["data"]
+            if data["type"] == "edge":
+                continue
+            elif data["type"] == "node_data":
+                table = {
+                    resource_arn: node_data
+                    for resource_arn, node_data in data["node_data"].items()
+                    if resource_arn in node_data_refs
+                }
+                if len(table) > 0:
+                    elements.append({"data": dict(data, node_data=table)})
+            elif data["type"] == "security_groups":
+                elements.append(
+                    {
+                        "data": dict(
+                            data,
+                            node_data={
+                                group_id: group
+                                for group_id, group in data["node_data"].items()
+                                if group_id in group_ids
+                            },
+                        )
+                    }
+                )
+            elif data["id"] in self.region_nodes:
+                if data["id"] in kept:
+                    elements.append(element)
+                    if "node_data_ref" in data:
+                        node_data_refs.add(data["node_data_ref"])
+            elif data["type"] == "account":
+                elements.append(element)
+            elif data["id"] in connected:
+                # CIDRs, and the security groups of aggregate edges
+                elements.append(element)
+            elif not filtered and (data["type"] != "security_group" or internal_edges):
+                # Nodes without edges are only left out when something was filtered
+                elements.append(element)
+        elements.extend(edges)
+        return elements
+
+
+def _matching(names, patterns):
+    """The names that contain one of the patterns"""
+    return [name for name in names if any(pattern in name for pattern in patterns)]
+
+
+def _union(index, names):
+    """The resources of the entries of the index with the names"""
+    return set().union(*[index.get(name, set()) for name in names])
@@ -12,7 +12,7 @@ from parliament import analyze_policy_string
 
 from netaddr import IPNetwork
 from shared.common import Finding, make_list, get_us_east_1, get_current_policy_doc
-from shared.query import query_aws, get_parameter_file
+from shared.query import query_aws, get_parameter_file, get_account_file
 from shared.nodes import Account, Region
 
 getLogger("policyuniverse").setLevel(CRITICAL)
@@ -181,11 +181,13 @@ def find_admins_in_account(
     admins = []
 
     try:
-        file_name = "account-data/{}/{}/{}".format(
-            account.name, "us-east-1", "iam-get-account-authorization-details.json"
+        file_name = "{}/{}".format(
+            "us-east-1", "iam-get-account-authorization-details.json"
         )
-        iam = json.load(open(file_name))
+        iam = get_account_file(account.name, file_name)
     except:
+        iam = None
+    if iam is None:
         raise Exception("No IAM data for account {}".format(account.name))
 
     admin_policies = []
@@ -0,0 +1,123 @@
+import bisect
+import os
+import pickle
+
+from netaddr import IPNetwork
+
+# Where the index is kept, unless another path is given
+IP_INDEX_PATH = "ip-index.pickle"
+
+
+class IpIndex(object):
+    """
+    The owners of the IPs of many accounts: the resources with each IP, and the
+    subnets and VPCs with a CIDR containing it. Each owner is a dict of its account,
+    region, type, id, and name, with the interface, VPC, subnet and security groups
+    of resources.
+    As with NamedCidrIndex, the CIDRs are kept in a table per IP version and prefix
+    length, keyed by their network address, so finding the owners of an IP is one
+    dictionary check per prefix length in use, from the most specific. The addresses
+    of the resources are also kept sorted, to find the resources in a CIDR.
+    """
+
+    # The key of the collected files the index was built from
+    key = None
+    # {version: {prefix length: {network address: [(CIDR string, owner)]}}}
+    _tables = None
+    _prefix_lengths = None
+    # {version: ([addresses], [(IP string, owner)])}, sorted by address
+    _hosts = None
+
+    def __init__(self, key=None):
+        self.key = key
+        self._tables = {}
+        self._prefix_lengths = {}
+        self._hosts = None
+
+    def add(self, cidr, owner):
+        network = IPNetwork(cidr)
+        tables = self._tables.setdefault(network.version, {})
+        if network.prefixlen not in tables:
+            tables[network.prefixlen] = {}
+            self._prefix_lengths[network.version] = sorted(tables, reverse=True)
+        entries = tables[network.prefixlen].setdefault(network.first, [])
+        if owner not in [entry_owner for _, entry_owner in entries]:
+            entries.append((str(network.cidr), owner))
+            self._hosts = None
+
+    def lookup(self, cidr):
+        """
+        Returns the owners of the IP, or of every IP of the CIDR, as a list of
+        (CIDR, owner) from the most specific CIDR to the least
+        """
+        network = IPNetwork(cidr)
+        tables = self._tables.get(network.version, {})
+        matches = []
+        for prefix_length in self._prefix_lengths.get(network.version, []):
+            if prefix_length > network.prefixlen:
+                continue
+            host_bits = (32 if network.version == 4 else 128) - prefix_length
+            matches.extend(
+                tables[prefix_length].get((network.first >> host_bits) << host_bits, [])
+            )
+        return matches
+
+    def within(self, cidr):
+        """Returns the resources with an IP in the CIDR, as a list of (IP, owner)"""
+        network = IPNetwork(cidr)
+        if self._hosts is None:
+            self._hosts = {}
+            for version, tables in self._tables.items():
+                host_length = 32 if version == 4 else 128
+                hosts = sorted(
+                    tables.get(host_length, {}).items(), key=lambda item: item[0]
+                )
+                self._hosts[version] = (
+                    [address for address, entries in hosts for _ in entries],
+                    [entry for _, entries in hosts for entry in entries],
+                )
+        addresses, entries = self._hosts.get(network.version, ([], []))
+        return entries[
+            bisect.bisect_left(addresses, network.first) : bisect.bisect_right(
+                addresses, network.last
+            )
+        ]
+
+    def get_name(self, cidr):
+        """
+        Returns a name for the CIDR from its owners, such as the account and name of
+        the resource with the IP, or None if none of the accounts have its IPs
+        """
+        matches = self.lookup(cidr)
+        if len(matches) > 0:
+            owner = matches[0][1]
+            return "{} {}".format(owner["account"], owner["name"] or owner["id"])
+        accounts = sorted(set(owner["account"] for _, owner in self.within(cidr)))
+        if len(accounts) > 0:
+            return ", ".join(accounts)
+        return None
+
+    def __getstate__(self):
+        # The sorted addresses are built again when needed
+        state = dict(self.__dict__)
+        state["_hosts"] = None
+        return state
+
+
+def store_ip_index(ip_index, path=IP_INDEX_PATH):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first, so an interrupted run can't leave a partial file
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(ip_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+
+def load_ip_index(path=IP_INDEX_PATH):
+    """Returns the IpIndex stored at the path, or None if there is none"""
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return None
@@ -0,0 +1,232 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Space for a node and its label, and around the nodes inside a compound node
+NODE_SIZE = 150
+PADDING = 60
+
+# Nodes that are hidden, and only hold data for other elements
+HIDDEN_TYPES = ("security_groups", "node_data")
+
+
+class Block(object):
+    """A node, and the nodes inside of it, placed relative to the block's top left"""
+
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.children = []
+        # (x, y) of the top left of each child, relative to this block
+        self.offsets = []
+        self.width = NODE_SIZE
+        self.height = NODE_SIZE
+
+    def pack(self):
+        """Lays out the children in rows, filling a square of about their total area"""
+        if len(self.children) == 0:
+            return
+        for child in self.children:
+            child.pack()
+
+        # Tallest first, so each row wastes less space
+        self.children.sort(key=lambda child: (-child.height, -child.width))
+        sizes = np.array([(child.width, child.height) for child in self.children])
+        row_width = max(np.sqrt((sizes[:, 0] * sizes[:, 1]).sum()), sizes[:, 0].max())
+
+        self.offsets = []
+        x = 0
+        y = 0
+        row_height = 0
+        width = 0
+        for child_width, child_height in sizes:
+            if x > 0 and x + child_width > row_width:
+                x = 0
+                y += row_height
+                row_height = 0
+            self.offsets.append((PADDING + x, PADDING + y))
+            x += child_width
+            row_height = max(row_height, child_height)
+            width = max(width, x)
+        self.width = width + 2 * PADDING
+        self.height = y + row_height + 2 * PADDING
+
+    def node_ids(self):
+        yield self.node_id
+        for child in self.children:
+            for node_id in child.node_ids():
+                yield node_id
+
+    def positions(self, left, top):
+        """Generates the id and center of each node without children in the block"""
+        if len(self.children) == 0:
+            yield self.node_id, (left + self.width / 2, top + self.height / 2)
+            return
+        for child, (x, y) in zip(self.children, self.offsets):
+            for position in child.positions(left + x, top + y):
+                yield position
+
+
+def add_at(values, indexes, amounts):
+    """values[indexes] += amounts, for 2d amounts and repeated indexes"""
+    for axis in range(values.shape[1]):
+        values[:, axis] += np.bincount(
+            indexes, weights=amounts[:, axis], minlength=len(values)
+        )
+
+
+def get_close_pairs(positions, radii):
+    """Returns the pairs of blocks, as (i, j) with i < j, that may overlap"""
+    # Most blocks are single nodes, so pairs are found among those first, and then
+    # around each of the few larger blocks
+    large = radii > 2 * np.median(radii)
+    small = np.flatnonzero(~large)
+    pairs = [np.zeros((0, 2), dtype=np.intp)]
+    if len(small) > 1:
+        tree = cKDTree(positions[small])
+        pairs.append(
+            small[tree.query_pairs(2 * radii[small].max(), output_type="ndarray")]
+        )
+    if large.any():
+        tree = cKDTree(positions)
+        large_pairs = set()
+        for i in np.flatnonzero(large):
+            for j in tree.query_ball_point(positions[i], radii[i] + radii.max()):
+                if j != i:
+                    large_pairs.add((min(i, j), max(i, j)))
+        if len(large_pairs) > 0:
+            pairs.append(np.array(sorted(large_pairs), dtype=np.intp))
+    return np.concatenate(pairs)
+
+
+def force_directed(sizes, edges, iterations=100, seed=0):
+    """
+    Places blocks of the sizes, given as (width, height), with a Fruchterman-Reingold
+    layout of the edges between them, given as (source index, target index).
+    Blocks only repel those close to them, found with a k-d tree, so each step takes
+    about linear time. Overlapping blocks are then pushed apart.
+    Returns the centers of the blocks.
+    """
+    count = len(sizes)
+    radii = np.sqrt((sizes**2).sum(axis=1)) / 2
+    if count == 1:
+        return np.zeros((1, 2))
+
+    random = np.random.RandomState(seed)
+    # The ideal distance between blocks
+    k = 2 * np.sqrt((radii**2).mean())
+    positions = random.uniform(-1, 1, (count, 2)) * k * np.sqrt(count)
+    sources = np.array([source for source, _ in edges], dtype=np.intp)
+    targets = np.array([target for _, target in edges], dtype=np.intp)
+
+    temperature = k * np.sqrt(count) / 2
+    for _ in range(iterations):
+        displacement = np.zeros((count, 2))
+        # Blocks repel those within twice the ideal distance
+        pairs = cKDTree(positions).query_pairs(2 * k, output_type="ndarray")
+        if len(pairs) > 0:
+            delta = positions[pairs[:, 0]] - positions[pairs[:, 1]]
+            distance_squared = np.maximum((delta**2).sum(axis=1), 0.01)
+            push = delta * (k * k / distance_squared)[:, np.newaxis]
+            add_at(displacement, pairs[:, 0], push)
+            add_at(displacement, pairs[:, 1], -push)
+        # The ends of each edge attract each other
+        if len(edges) > 0:
+            delta = positions[sources] - positions[targets]
+            distance = np.sqrt((delta**2).sum(axis=1))[:, np.newaxis]
+            pull = delta * distance / k
+            add_at(displacement, sources, -pull)
+            add_at(displacement, targets, pull)
+        length = np.maximum(np.sqrt((displacement**2).sum(axis=1)), 0.01)
+        positions += (
+            displacement
+            / length[:, np.newaxis]
+            * np.minimum(length, temperature)[:, np.newaxis]
+        )
+        temperature *= 0.95
+
+    # Push overlapping blocks apart, the smaller one moving the most
+    for _ in range(10 * iterations):
+        pairs = get_close_pairs(positions, radii)
+        first = pairs[:, 0]
+        second = pairs[:, 1]
+        delta = positions[first] - positions[second]
+        distance = np.sqrt((delta**2).sum(axis=1))
+        overlapping = distance < radii[first] + radii[second]
+        if not overlapping.any():
+            break
+        first = first[overlapping]
+        second = second[overlapping]
+        delta = delta[overlapping]
+        distance = distance[overlapping]
+        # Blocks at the same place are pushed apart in a random direction
+        same = distance < 0.01
+        delta[same] = random.uniform(-1, 1, (same.sum(), 2))
+        distance[same] = np.sqrt((delta[same] ** 2).sum(axis=1))
+        total = radii[first] + radii[second]
+        # Push past touching, as the pushes from other pairs undo some of it
+        push = (
+            delta
+            / distance[:, np.newaxis]
+            * (1.5 * (total - distance) + 1)[:, np.newaxis]
+        )
+        add_at(positions, first, push * (radii[second] / total)[:, np.newaxis])
+        add_at(positions, second, -push * (radii[first] / total)[:, np.newaxis])
+    return positions
+
+
+def add_positions(elements, seed=0):
+    """
+    Sets the position of every node without children, so the graph can be shown with
+    the preset layout instead of being laid out by the browser.
+    The nodes inside each compound node are packed in rows, and the nodes and compound
+    nodes at the top are placed with a force-directed layout of the edges between them.
+    """
+    blocks = {}
+    parents = {}
+    edges = []
+    for element in elements:
+        data = element["data"]
+        if data["type"] == "edge":
+            edges.append((data["source"], data["target"]))
+        elif data["type"] not in HIDDEN_TYPES:
+            blocks[data["id"]] = Block(data["id"])
+            if "parent" in data:
+                parents[data["id"]] = data["parent"]
+
+    roots = []
+    for node_id, block in blocks.items():
+        parent = blocks.get(parents.get(node_id, None), None)
+        if parent is None:
+            roots.append(block)
+        else:
+            parent.children.append(block)
+    if len(roots) == 0:
+        return elements
+    for root in roots:
+        root.pack()
+
+    # Edges between the nodes inside of blocks pull the blocks together
+    root_index = {}
+    for i, root in enumerate(roots):
+        for node_id in root.node_ids():
+            root_index[node_id] = i
+    root_edges = set()
+    for source, target in edges:
+        source = root_index.get(source, None)
+        target = root_index.get(target, None)
+        if source is not None and target is not None and source != target:
+            root_edges.add((source, target))
+
+    sizes = np.array([(root.width, root.height) for root in roots], dtype=float)
+    centers = force_directed(sizes, sorted(root_edges), seed=seed)
+
+    positions = {}
+    for root, (x, y) in zip(roots, centers):
+        for node_id, (node_x, node_y) in root.positions(
+            x - root.width / 2, y - root.height / 2
+        ):
+            positions[node_id] = {"x": round(float(node_x)), "y": round(float(node_y))}
+
+    for element in elements:
+        if element["data"].get("id", None) in positions:
+            element["position"] = positions[element["data"]["id"]]
+    return elements
@@ -0,0 +1,184 @@
+# Node elements that hold other nodes, or describe the graph, and are never collapsed
+CONTAINER_TYPES = ("account", "region", "vpc", "az", "subnet")
+TABLE_TYPES = ("security_groups", "node_data")
+
+
+class LevelOfDetail(object):
+    """
+    Reduces a graph of cytoscape elements from prepare to a budget of nodes and edges,
+    by replacing the resources of a subnet, and then of a VPC, with a summary node.
+    Subnets are collapsed first, largest first, and then VPCs, until the graph fits.
+    Edges to the collapsed resources are moved to their summary and combined, with the
+    number of edges each stands for in edge_count.
+    A summary lists the resources it holds in its node_data, with their ids, names, and
+    types, so they can be found in a more detailed map.
+    """
+
+    def __init__(self, elements):
+        # Nodes and tables, in the order they were given, by id
+        self._nodes = {}
+        # The nodes added in place of other nodes, by the id of the node they follow
+        self._inserted = {}
+        self._children = {}
+        # Edges by (source, target), and the edges of each node
+        self._edges = {}
+        self._incident = {}
+        self.node_count = 0
+
+        for element in elements:
+            data = element["data"]
+            if data["type"] == "edge":
+                # Combining edges adds to their reasons, so they are copied first
+                data = dict(data)
+                data["node_data"] = list(data.get("node_data", []))
+                self._add_edge(data)
+            else:
+                self._nodes[data["id"]] = element
+                if data["type"] not in TABLE_TYPES:
+                    self.node_count += 1
+                if "parent" in data:
+                    self._children.setdefault(data["parent"], []).append(data["id"])
+
+    @property
+    def edge_count(self):
+        return len(self._edges)
+
+    def fits(self, max_nodes, max_edges):
+        return self.node_count <= max_nodes and self.edge_count <= max_edges
+
+    def _add_edge(self, data):
+        key = (data["source"], data["target"])
+        existing = self._edges.get(key, None)
+        if existing is None:
+            self._edges[key] = data
+            self._incident.setdefault(key[0], set()).add(key)
+            self._incident.setdefault(key[1], set()).add(key)
+            return
+        existing["edge_count"] = existing.get("edge_count", 1) + data.get(
+            "edge_count", 1
+        )
+        for reason in data.get("node_data", []):
+            if reason not in existing["node_data"]:
+                existing["node_data"].append(reason)
+
+    def _move_edges(self, member_ids, summary_id):
+        """Moves the edges of the members to the summary, dropping those between them"""
+        for member_id in member_ids:
+            for key in self._incident.pop(member_id, set()):
+                data = self._edges.pop(key, None)
+                if data is None:
+                    # Already moved, from the other end
+                    continue
+                for node_id in key:
+                    if node_id not in member_ids:
+                        self._incident[node_id].discard(key)
+                source = summary_id if key[0] in member_ids else key[0]
+                target = summary_id if key[1] in member_ids else key[1]
+                if source == target:
+                    continue
+                data["source"] = source
+                data["target"] = target
+                data.setdefault("edge_count", 1)
+                self._add_edge(data)
+
+    def _get_resources(self, node_id):
+        """Returns the ids of the resources under a node, and of the nodes holding them"""
+        resources = []
+        holders = []
+        for child_id in self._children.get(node_id, []):
+            if child_id not in self._nodes:
+                continue
+            child_type = self._nodes[child_id]["data"]["type"]
+            if child_type in CONTAINER_TYPES:
+                holders.append(child_id)
+                child_resources, child_holders = self._get_resources(child_id)
+                resources.extend(child_resources)
+                holders.extend(child_holders)
+            else:
+                resources.append(child_id)
+        return resources, holders
+
+    def _get_members(self, resource_ids):
+        members = []
+        for resource_id in resource_ids:
+            data = self._nodes[resource_id]["data"]
+            if data["type"] == "summary":
+                members.extend(data["node_data"]["members"])
+            else:
+                members.append(
+                    {"id": data["id"], "name": data["name"], "type": data["type"]}
+                )
+        return members
+
+    def collapse(self, node_id):
+        """
+        Replaces the resources under the node with a summary node.
+        Returns False if that would not remove any node.
+        """
+        resource_ids, holder_ids = self._get_resources(node_id)
+        if len(resource_ids) + len(holder_ids) < 2:
+            return False
+
+        members = self._get_members(resource_ids)
+        counts = {}
+        for member in members:
+            counts[member["type"]] = counts.get(member["type"], 0) + 1
+        summary_id = node_id + "/summary"
+        summary = {
+            "data": {
+                "id": summary_id,
+                "name": ", ".join(
+                    "{} {}".format(count, node_type)
+                    for node_type, count in counts.items()
+                ),
+                "type": "summary",
+                "local_id": summary_id,
+                "parent": node_id,
+                "node_data": {"counts": counts, "members": members},
+            }
+        }
+
+        removed_ids = set(resource_ids) | set(holder_ids)
+        self._move_edges(removed_ids, summary_id)
+        for removed_id in removed_ids:
+            del self._nodes[removed_id]
+            self._inserted.pop(removed_id, None)
+        self._inserted[node_id] = summary
+        self._children[node_id] = [summary_id]
+        self.node_count += 1 - len(removed_ids)
+
+        # The summary is added after its parent, so it is in the lookups like the others
+        self._nodes[summary_id] = summary
+        return True
+
+    def reduce(self, max_nodes, max_edges):
+        """Collapses subnets, and then VPCs, until the graph fits the budget"""
+        for level in ["subnet", "vpc"]:
+            if self.fits(max_nodes, max_edges):
+                return
+            candidates = [
+                node_id
+                for node_id, element in self._nodes.items()
+                if element["data"]["type"] == level
+            ]
+            # The largest first, as they remove the most nodes
+            candidates.sort(key=lambda node_id: -len(self._get_resources(node_id)[0]))
+            for node_id in candidates:
+                if self.fits(max_nodes, max_edges):
+                    return
+                self.collapse(node_id)
+
+    def elements(self):
+        """Generates the elements of the graph, with the nodes in their original order"""
+        written = set()
+        for node_id, element in list(self._nodes.items()):
+            if node_id in written:
+                continue
+            written.add(node_id)
+            yield element
+            summary = self._inserted.get(node_id, None)
+            if summary is not None:
+                written.add(summary["data"]["id"])
+                yield summary
+        for data in self._edges.values():
+            yield {"data": data}
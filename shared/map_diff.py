@@ -0,0 +1,201 @@
+import hashlib
+import json
+
+from cloudmapper import __version__
+from commands.prepare import iter_data_structure
+from shared.common import get_regions
+from shared.nodes import Account
+from shared.prepare_cache import (
+    CACHE_VERSION,
+    PrepareCache,
+    get_region_inputs_hash,
+    load_stored,
+)
+from shared.public import get_public_port_ranges, regroup_ranges, port_ranges_string
+
+# The prepare options the maps are built with, as for the public command, but with
+# the internal edges, so changes inside the VPCs are found too
+MAP_OPTIONS = {
+    "internal_edges": True,
+    "read_replicas": True,
+    "inter_rds_edges": False,
+    "azs": False,
+    "collapse_by_tag": None,
+    "collapse_asgs": True,
+    "mute": True,
+}
+
+# The name the maps of an account are stored as in the prepare cache
+CANONICAL_CACHE_NAME = "canonical_map"
+# How many maps of an account are kept, so the snapshots being compared are all cached
+MAX_CACHED_MAPS = 4
+
+
+class CanonicalMap(object):
+    """
+    The nodes and edges of the map of an account, keyed by their ids, which are made
+    from the ARNs and ids of the resources and so are the same in every collection.
+    Each edge keeps a hash of its reasons, such as the security groups allowing it,
+    so a change to the rules of an edge is found without keeping the rules.
+    """
+
+    # {node id: node type}
+    nodes = None
+    # {(source id, target id): hash of the reasons}
+    edges = None
+    # {node id: ports open to 0.0.0.0/0}
+    public = None
+
+    def __init__(self):
+        self.nodes = {}
+        self.edges = {}
+        self.public = {}
+
+
+def get_reasons_hash(reasons, security_groups):
+    """Returns a hash of the reasons of an edge, with the rules of its security groups"""
+    reasons = [
+        (
+            json.dumps(security_groups.get(reason, reason), sort_keys=True)
+            if isinstance(reason, str)
+            else json.dumps(reason, sort_keys=True)
+        )
+        for reason in reasons
+    ]
+    return hashlib.sha256("\n".join(sorted(reasons)).encode()).hexdigest()
+
+
+def get_public_ports(reasons, security_groups):
+    port_ranges = []
+    for reason in reasons:
+        if isinstance(reason, str) and reason in security_groups:
+            port_ranges.extend(get_public_port_ranges(security_groups[reason]))
+    return port_ranges_string(regroup_ranges([tuple(r) for r in port_ranges]))
+
+
+def make_reasons(node_data):
+    if node_data is None:
+        return []
+    if isinstance(node_data, list):
+        return node_data
+    return [node_data]
+
+
+def build_canonical_map(account_data, config):
+    """Builds the CanonicalMap of an account, as the elements of its map are made"""
+    canonical_map = CanonicalMap()
+    edges = []
+    security_groups = {}
+    for element in iter_data_structure(account_data, config, MAP_OPTIONS):
+        data = element["data"]
+        if data["type"] == "edge":
+            edges.append(
+                (data["source"], data["target"], make_reasons(data.get("node_data")))
+            )
+        elif data["type"] == "security_groups":
+            security_groups.update(data["node_data"])
+        elif data["type"] != "node_data":
+            canonical_map.nodes[data["id"]] = data["type"]
+
+    # The security groups are only known once all the elements are made
+    for source, target, reasons in edges:
+        canonical_map.edges[(source, target)] = get_reasons_hash(
+            reasons, security_groups
+        )
+        if source == "0.0.0.0/0":
+            canonical_map.public[target] = get_public_ports(reasons, security_groups)
+    return canonical_map
+
+
+def get_map_key(account, config):
+    """Returns the key of the map of an account, from its collected files and the config"""
+    digest = hashlib.sha256(
+        json.dumps(
+            [CACHE_VERSION, __version__, account.json, MAP_OPTIONS, config],
+            sort_keys=True,
+            default=str,
+        ).encode()
+    )
+    for region_json in get_regions(account):
+        digest.update(
+            "{} {}\n".format(
+                region_json["RegionName"],
+                get_region_inputs_hash(account.name, region_json["RegionName"]),
+            ).encode()
+        )
+    return digest.hexdigest()
+
+
+def get_canonical_map(account_data, config, cache_dir="prepare-cache"):
+    """
+    Returns the CanonicalMap of the account from the collected data in use, from the
+    cache in cache_dir if its collected files and the config have been mapped before
+    """
+    account = Account(None, account_data)
+    key = get_map_key(account, config)
+    maps = load_stored(cache_dir, account.name, CANONICAL_CACHE_NAME) or {}
+    if key in maps:
+        # Keep the most recently used maps last
+        maps[key] = maps.pop(key)
+    else:
+        maps[key] = build_canonical_map(account_data, config)
+        while len(maps) > MAX_CACHED_MAPS:
+            del maps[next(iter(maps))]
+    PrepareCache(cache_dir, account, MAP_OPTIONS).store(
+        CANONICAL_CACHE_NAME, None, maps
+    )
+    return maps[key]
+
+
+def diff_maps(old, new):
+    """Returns the nodes, edges and public exposures that were added, removed or changed
+    from the old CanonicalMap to the new one"""
+    old_nodes = set(old.nodes)
+    new_nodes = set(new.nodes)
+    old_edges = set(old.edges)
+    new_edges = set(new.edges)
+    old_public = set(old.public)
+    new_public = set(new.public)
+
+    def edge(key):
+        return {"source": key[0], "target": key[1]}
+
+    def public(exposures, node_id):
+        return {"id": node_id, "ports": exposures[node_id]}
+
+    diff = {
+        "nodes": {
+            "added": [
+                {"id": node_id, "type": new.nodes[node_id]}
+                for node_id in sorted(new_nodes - old_nodes)
+            ],
+            "removed": [
+                {"id": node_id, "type": old.nodes[node_id]}
+                for node_id in sorted(old_nodes - new_nodes)
+            ],
+        },
+        "edges": {
+            "added": [edge(key) for key in sorted(new_edges - old_edges)],
+            "removed": [edge(key) for key in sorted(old_edges - new_edges)],
+            "changed": [
+                edge(key)
+                for key in sorted(old_edges & new_edges)
+                if old.edges[key] != new.edges[key]
+            ],
+        },
+        "public": {
+            "added": [public(new.public, n) for n in sorted(new_public - old_public)],
+            "removed": [public(old.public, n) for n in sorted(old_public - new_public)],
+            "changed": [
+                {"id": n, "old_ports": old.public[n], "ports": new.public[n]}
+                for n in sorted(old_public & new_public)
+                if old.public[n] != new.public[n]
+            ],
+        },
+    }
+    diff["summary"] = {
+        "{} {}".format(kind, change): len(entries)
+        for kind in ["nodes", "edges", "public"]
+        for change, entries in diff[kind].items()
+    }
+    return diff
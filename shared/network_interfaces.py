@@ -0,0 +1,58 @@
+import re
+
+# Lambda interfaces are described as "AWS Lambda VPC ENI-<function name>-<uuid>"
+LAMBDA_DESCRIPTION = re.compile(
+    r"^AWS Lambda VPC ENI-(.+)-[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"
+)
+
+
+def get_interface_owner(interface):
+    """
+    Returns the node type of the resource that a network interface belongs to, and
+    the id to look the resource up by in the files of its service, from how AWS
+    describes the interface. Lambda interfaces have the name of their function, from
+    their description. The id is None for the services whose interfaces do not name
+    their resource, which are matched by their IPs, or their VPC, subnet and security
+    groups.
+    Interfaces of services that prepare has no node type for are network_interface,
+    with the interface id. Returns None for interfaces that are not in use.
+    """
+    if interface.get("Status", "in-use") != "in-use":
+        return None
+    attachment = interface.get("Attachment", None) or {}
+    description = interface.get("Description", None) or ""
+    interface_type = interface.get("InterfaceType", None) or "interface"
+
+    if "InstanceId" in attachment and not interface.get("RequesterManaged", False):
+        return "ec2", attachment["InstanceId"]
+    if interface_type == "vpc_endpoint" or description.startswith(
+        "VPC Endpoint Interface "
+    ):
+        return "vpc_endpoint", description.split(" ")[-1]
+    if description.startswith(("ELB app/", "ELB net/", "ELB gwy/")):
+        # ELB app/<name>/<id>
+        return "elbv2", description.split("/")[1]
+    if description.startswith("ELB "):
+        return "elb", description[len("ELB ") :]
+    if description.startswith("arn:aws:ecs:") and ":attachment/" in description:
+        return "ecs", description.split(":attachment/")[1]
+    match = LAMBDA_DESCRIPTION.match(description)
+    if match:
+        return "lambda", match.group(1)
+    if interface_type == "lambda":
+        return "lambda", None
+    if (
+        description == "RDSNetworkInterface"
+        or interface.get("RequesterId", None) == "amazon-rds"
+        or attachment.get("InstanceOwnerId", None) == "amazon-rds"
+    ):
+        return "rds", None
+    if description == "RedshiftNetworkInterface":
+        return "redshift", None
+    if description.startswith("ES "):
+        return "elasticsearch", description[len("ES ") :]
+    return "network_interface", interface["NetworkInterfaceId"]
+
+
+def get_interface_groups(interface):
+    return frozenset(group["GroupId"] for group in interface.get("Groups", []))
@@ -22,6 +22,7 @@ WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWIS
 USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 ---------------------------------------------------------------------------
 """
+
 import pyjq
 from abc import ABCMeta
 from netaddr import IPNetwork, IPAddress
@@ -57,18 +58,28 @@ def is_public_ip(ip):
 
 @add_metaclass(ABCMeta)
 class Node(object):
-    _arn = ""
-    _local_id = ""  # Ex. InstanceId
-    _name = ""
-    _type = ""
-
-    _parent = None
-    _json_blob = ""
+    # Nodes use slots, as there can be a lot of them. Subclasses set the _arn,
+    # _local_id (ex. InstanceId), _name, and _type before calling this __init__.
+    __slots__ = (
+        "_arn",
+        "_local_id",
+        "_name",
+        "_type",
+        "_parent",
+        "_json_blob",
+        "_children",
+        "_subnet",
+        # The node this was added to as a child, which is not always the parent
+        "_container",
+        # The number of leaves under this node, and the list of them once asked for
+        "_leaf_count",
+        "_leaves",
+        # The ARN before set_subnet, shared by the copies of a node in each subnet
+        "_resource_arn",
+    )
 
     _isLeaf = False
 
-    _children = None
-
     def __key(self):
         return self._arn
 
@@ -76,6 +87,11 @@ class Node(object):
         self._parent = parent
         self._json_blob = json_blob
         self._children = {}
+        self._subnet = None
+        self._container = None
+        self._leaf_count = 0
+        self._leaves = None
+        self._resource_arn = self._arn
 
     def set_subnet(self, subnet):
         self._subnet = subnet
@@ -84,6 +100,15 @@ class Node(object):
     def arn(self):
         return self._arn
 
+    @property
+    def resource_arn(self):
+        return self._resource_arn
+
+    @property
+    def aws_arn(self):
+        """The ARN of the resource in AWS, which its arn is not always, ex. for ELBs"""
+        return self._resource_arn
+
     @property
     def local_id(self):
         return self._local_id
@@ -163,36 +188,55 @@ class Node(object):
     def json(self):
         return self._json_blob
 
+    def _update_leaf_count(self, change):
+        # Update the counts of this node and the nodes containing it,
+        # and drop their lists of leaves, which are rebuilt when next asked for
+        node = self
+        while node is not None:
+            node._leaf_count += change
+            node._leaves = None
+            node = node._container
+
     def addChild(self, child):
+        change = child.leaf_count
+        previous = self._children.get(child.local_id)
+        if previous is not None:
+            previous._container = None
+            change -= previous.leaf_count
         self._children[child.local_id] = child
+        child._container = self
+        self._update_leaf_count(change)
 
     @property
     def children(self):
         return self._children.values()
 
     def removeChild(self, child):
-        del self._children[child.local_id]
+        child = self._children.pop(child.local_id)
+        child._container = None
+        self._update_leaf_count(-child.leaf_count)
 
     @property
-    def has_leaves(self):
-        # TODO: This can be optimized
+    def leaf_count(self):
         if self.isLeaf:
-            return True
-        else:
-            for child in self.children:
-                if child.has_leaves:
-                    return True
-            return False
+            return 1
+        return self._leaf_count
+
+    @property
+    def has_leaves(self):
+        return self.leaf_count > 0
 
     @property
     def leaves(self):
+        """The leaves under this node. The list is shared, so it must not be modified."""
         if self.isLeaf:
             return [self]
-        else:
+        if self._leaves is None:
             leaves = []
             for child in self.children:
                 leaves.extend(child.leaves)
-            return leaves
+            self._leaves = leaves
+        return self._leaves
 
     def cytoscape_data(self, parent_arn=""):
         response = {
@@ -214,6 +258,8 @@ class Node(object):
 
 
 class Account(Node):
+    __slots__ = ()
+
     def __init__(self, parent, json_blob):
         self._local_id = json_blob["id"]
         self._arn = "arn:aws:::{}:".format(self._local_id)
@@ -223,6 +269,8 @@ class Account(Node):
 
 
 class Region(Node):
+    __slots__ = ()
+
     def __init__(self, parent, json_blob):
         self._local_id = json_blob["RegionName"]
         self._arn = "arn:aws::{}:{}:".format(self.local_id, parent.account.local_id)
@@ -232,7 +280,7 @@ class Region(Node):
 
 
 class Vpc(Node):
-    _peering_connections = None
+    __slots__ = ("_peering_connections",)
 
     def addPeer(self, vpc):
         self._peering_connections.append(vpc)
@@ -260,6 +308,8 @@ class Vpc(Node):
 
 
 class Az(Node):
+    __slots__ = ()
+
     def __init__(self, parent, json_blob):
         self._local_id = json_blob["ZoneName"]
         self._arn = "arn:aws::{}:{}:vpc/{}/az/{}".format(
@@ -274,6 +324,8 @@ class Az(Node):
 
 
 class Subnet(Node):
+    __slots__ = ()
+
     def __init__(self, parent, json_blob):
         # arn:aws:ec2:region:account-id:subnet/subnet-id
         self._local_id = json_blob["SubnetId"]
@@ -289,13 +341,13 @@ class Subnet(Node):
 
 @add_metaclass(ABCMeta)
 class Leaf(Node):
-    def __init__(self, parent, json_blob):
-        self._isLeaf = True
-        super(Leaf, self).__init__(parent, json_blob)
+    __slots__ = ()
+
+    _isLeaf = True
 
 
 class Ec2(Leaf):
-    _ips = None
+    __slots__ = ("_ips",)
 
     @property
     def is_public(self):
@@ -325,7 +377,7 @@ class Ec2(Leaf):
 
     @property
     def tags(self):
-        return pyjq.all(".Tags[]", self._json_blob)
+        return pyjq.all(".Tags[]?", self._json_blob)
 
     @property
     def subnets(self):
@@ -335,7 +387,15 @@ class Ec2(Leaf):
     def security_groups(self):
         return pyjq.all(".SecurityGroups[].GroupId", self._json_blob)
 
+    @property
+    def aws_arn(self):
+        # Nodes for an autoscaling group have the json of one of its instances
+        return "arn:aws:ec2:{}:{}:instance/{}".format(
+            self.region.name, self.account.local_id, self._json_blob["InstanceId"]
+        )
+
     def __init__(self, parent, json_blob, collapse_by_tag=None, collapse_asgs=True):
+        self._ips = None
         autoscaling_name = []
         if collapse_asgs:
             autoscaling_name = pyjq.all(
@@ -368,7 +428,7 @@ class Ec2(Leaf):
 
 
 class Elb(Leaf):
-    _subnet = None
+    __slots__ = ()
 
     @property
     def ips(self):
@@ -409,6 +469,12 @@ class Elb(Leaf):
     def security_groups(self):
         return pyjq.all(".SecurityGroups[]?", self._json_blob)
 
+    @property
+    def aws_arn(self):
+        return "arn:aws:elasticloadbalancing:{}:{}:loadbalancer/{}".format(
+            self.region.name, self.account.local_id, self._local_id
+        )
+
     def __init__(self, parent, json_blob):
         self._type = "elb"
         self._local_id = json_blob["LoadBalancerName"]
@@ -421,7 +487,7 @@ class Elb(Leaf):
 
 
 class Elbv2(Leaf):
-    _subnet = None
+    __slots__ = ()
 
     @property
     def ips(self):
@@ -431,7 +497,7 @@ class Elbv2(Leaf):
     @property
     def tags(self):
         tags = get_parameter_file(
-            self.region, "elbv2", "describe-tags", self._json_blob["LoadBalancerName"]
+            self.region, "elbv2", "describe-tags", self._json_blob["LoadBalancerArn"]
         )
         if tags is None:
             return []
@@ -462,6 +528,10 @@ class Elbv2(Leaf):
     def security_groups(self):
         return pyjq.all(".SecurityGroups[]?", self._json_blob)
 
+    @property
+    def aws_arn(self):
+        return self._json_blob["LoadBalancerArn"]
+
     def __init__(self, parent, json_blob):
         self._type = "elbv2"
         self._local_id = json_blob["LoadBalancerName"]
@@ -474,7 +544,7 @@ class Elbv2(Leaf):
 
 
 class Rds(Leaf):
-    _subnet = None
+    __slots__ = ()
 
     @property
     def ips(self):
@@ -532,9 +602,7 @@ class Rds(Leaf):
 
 
 class VpcEndpoint(Leaf):
-    _subnet = None
-
-    _unrestricted_ingress = False
+    __slots__ = ("_unrestricted_ingress",)
 
     @property
     def can_egress(self):
@@ -582,6 +650,7 @@ class VpcEndpoint(Leaf):
 
         # Need to set the parent, but what was passed in was the region
         assert parent._type == "region"
+        self._parent = None
         for vpc in parent.children:
             if vpc.local_id == json_blob["VpcId"]:
                 self._parent = vpc
@@ -590,6 +659,7 @@ class VpcEndpoint(Leaf):
         # So I want the last section, "sqs"
         self._name = json_blob["ServiceName"][json_blob["ServiceName"].rfind(".") + 1 :]
 
+        self._unrestricted_ingress = False
         if json_blob["VpcEndpointType"] == "Gateway":
             # The Gateway Endpoints don't live in subnets and don't have Security Groups.
             # Access is controlled through their policy, or the S3 bucket policies, or somewhere else.
@@ -618,6 +688,8 @@ class VpcEndpoint(Leaf):
 
 
 class Ecs(Leaf):
+    __slots__ = ()
+
     @property
     def ips(self):
         ips = []
@@ -648,7 +720,7 @@ class Ecs(Leaf):
 
     @property
     def tags(self):
-        return pyjq.all(".tags[]", self._json_blob)
+        return pyjq.all(".tags[]?", self._json_blob)
 
     @property
     def is_public(self):
@@ -685,7 +757,7 @@ class Ecs(Leaf):
 
 
 class Lambda(Leaf):
-    _subnet = None
+    __slots__ = ()
 
     def set_subnet(self, subnet):
         self._subnet = subnet
@@ -724,7 +796,7 @@ class Lambda(Leaf):
 
 
 class Redshift(Leaf):
-    _subnet = None
+    __slots__ = ()
 
     def set_subnet(self, subnet):
         self._subnet = subnet
@@ -788,7 +860,7 @@ class Redshift(Leaf):
 
     @property
     def tags(self):
-        return pyjq.all(".Tags[]", self._json_blob)
+        return pyjq.all(".Tags[]?", self._json_blob)
 
     @property
     def is_public(self):
@@ -801,6 +873,12 @@ class Redshift(Leaf):
     def security_groups(self):
         return pyjq.all(".VpcSecurityGroups[].VpcSecurityGroupId", self._json_blob)
 
+    @property
+    def aws_arn(self):
+        return "arn:aws:redshift:{}:{}:cluster:{}".format(
+            self.region.name, self.account.local_id, self._local_id
+        )
+
     def __init__(self, parent, json_blob):
         self._type = "redshift"
 
@@ -825,6 +903,8 @@ class Redshift(Leaf):
 
 
 class ElasticSearch(Leaf):
+    __slots__ = ()
+
     @property
     def ips(self):
         return []
@@ -861,7 +941,85 @@ class ElasticSearch(Leaf):
         super(ElasticSearch, self).__init__(parent, json_blob)
 
 
+class NetworkInterface(Leaf):
+    """
+    A resource that prepare has no node type for, such as a NAT gateway or an EFS
+    mount target, from its network interfaces
+    """
+
+    __slots__ = ()
+
+    def set_subnet(self, subnet):
+        self._subnet = subnet
+        self._arn = self._arn + "." + subnet.local_id
+
+    @property
+    def ips(self):
+        ips = pyjq.all(
+            ".NetworkInterfaces[].PrivateIpAddresses[]?.PrivateIpAddress",
+            self._json_blob,
+        )
+        ips.extend(
+            pyjq.all(
+                ".NetworkInterfaces[].PrivateIpAddresses[]?.Association.PublicIp",
+                self._json_blob,
+            )
+        )
+        return [ip for ip in ips if ip is not None]
+
+    @property
+    def subnets(self):
+        if self._subnet:
+            return self._subnet
+        else:
+            return sorted(
+                set(pyjq.all(".NetworkInterfaces[].SubnetId", self._json_blob))
+            )
+
+    @property
+    def tags(self):
+        return pyjq.all(".NetworkInterfaces[].TagSet[]?", self._json_blob)
+
+    @property
+    def is_public(self):
+        for ip in self.ips:
+            if is_public_ip(ip):
+                return True
+        return False
+
+    @property
+    def security_groups(self):
+        return sorted(
+            set(pyjq.all(".NetworkInterfaces[].Groups[].GroupId", self._json_blob))
+        )
+
+    @property
+    def aws_arn(self):
+        return "arn:aws:ec2:{}:{}:network-interface/{}".format(
+            self.region.name,
+            self.account.local_id,
+            self._json_blob["NetworkInterfaces"][0]["NetworkInterfaceId"],
+        )
+
+    def __init__(self, parent, json_blob):
+        """The json_blob has the interfaces of the resource, in NetworkInterfaces"""
+        self._type = "network_interface"
+        interface = json_blob["NetworkInterfaces"][0]
+        self._local_id = interface["NetworkInterfaceId"]
+        self._arn = "arn:aws:ec2:{}:{}:network-interface/{}".format(
+            parent.region.name, parent.account.local_id, self._local_id
+        )
+        self._name = truncate(
+            interface.get("Description", None)
+            or interface.get("InterfaceType", None)
+            or self._local_id
+        )
+        super(NetworkInterface, self).__init__(parent, json_blob)
+
+
 class Cidr(Leaf):
+    __slots__ = ("is_used",)
+
     def ips(self):
         return [self._local_id]
 
@@ -884,10 +1042,30 @@ class Cidr(Leaf):
         super(Cidr, self).__init__(None, cidr)
 
 
+class SecurityGroup(Node):
+    """
+    A security group, used as the end of aggregate edges instead of each of its members.
+    Groups of other accounts, from a UserIdGroupPair, have the id of their account as
+    the UserId.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, parent, json_blob):
+        # arn:aws:ec2:region:account-id:security-group/security-group-id
+        self._local_id = json_blob["GroupId"]
+        self._arn = "arn:aws::{}:{}:security-group/{}".format(
+            parent.region.name,
+            json_blob.get("UserId", parent.account.local_id),
+            self._local_id,
+        )
+        self._name = get_name(json_blob, "GroupName")
+        self._type = "security_group"
+        super(SecurityGroup, self).__init__(parent, json_blob)
+
+
 class Connection(object):
-    _source = None
-    _target = None
-    _json = None
+    __slots__ = ("_source", "_target", "_json")
 
     @property
     def source(self):
@@ -920,3 +1098,42 @@ class Connection(object):
                 "node_data": self._json,
             }
         }
+
+
+class GroupConnection(Connection):
+    """
+    Aggregate edge standing for a connection from every one of the source members to
+    every one of the target members, so a rule between two groups is a single edge
+    instead of one edge per pair of resources.
+    """
+
+    __slots__ = ("_source_members", "_target_members")
+
+    @property
+    def source_members(self):
+        return list(self._source_members)
+
+    @property
+    def target_members(self):
+        return list(self._target_members)
+
+    def add_members(self, source_members, target_members):
+        # Dicts are used as ordered sets
+        for member in source_members:
+            self._source_members[member] = True
+        for member in target_members:
+            self._target_members[member] = True
+
+    def remove_source_member(self, member):
+        del self._source_members[member]
+
+    def __init__(self, source, target):
+        self._source_members = {}
+        self._target_members = {}
+        super(GroupConnection, self).__init__(source, target)
+
+    def cytoscape_data(self):
+        response = super(GroupConnection, self).cytoscape_data()
+        response["data"]["source_members"] = [m.arn for m in self._source_members]
+        response["data"]["target_members"] = [m.arn for m in self._target_members]
+        return response
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import pickle
+
+from cloudmapper import __version__
+from shared.query import list_account_files, get_file_hash
+
+# Bump this when the cached objects change, so caches of older builds are not used
+CACHE_VERSION = 2
+
+# The collected files of a region that prepare reads, by the prefix of their names
+REGION_INPUT_PREFIXES = (
+    "ec2-",
+    "elb-",
+    "elbv2-",
+    "rds-",
+    "ecs-",
+    "lambda-",
+    "redshift-",
+    "es-",
+)
+
+# Options that change how prepare runs or writes its output, but not what is built.
+# The level of detail, layout and shards are applied to the output, after the cached stages.
+IGNORED_OPTIONS = (
+    "jobs",
+    "mute",
+    "node_data",
+    "cache_dir",
+    "lod",
+    "max_nodes",
+    "max_edges",
+    "layout",
+    "shards",
+    "graph",
+    "shard_by",
+    "max_memory",
+)
+
+# The name the graph of the whole account is stored as
+GRAPH_CACHE_NAME = "graph"
+
+
+class PrepareCache(object):
+    """
+    Results of the stages of prepare for an account, kept between runs in
+    <cache_dir>/<account name>/.
+    Each result is stored with a key hashed from its inputs: the collected files,
+    the config, and the prepare options. A result is only used if its key still matches.
+    """
+
+    cache_dir = None
+    path = None
+    account_name = None
+    region_keys = None
+    _options = None
+
+    def __init__(self, cache_dir, account, outputfilter):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, account.name)
+        self.account_name = account.name
+        self.region_keys = {}
+        options = {
+            option: value
+            for option, value in outputfilter.items()
+            if option not in IGNORED_OPTIONS
+        }
+        self._options = json.dumps(
+            [CACHE_VERSION, __version__, account.json, options],
+            sort_keys=True,
+            default=str,
+        )
+
+    def region_key(self, region_name):
+        """Returns the key of a region, from the hashes of its collected files"""
+        digest = hashlib.sha256(self._options.encode())
+        digest.update(region_name.encode())
+        digest.update(get_region_inputs_hash(self.account_name, region_name).encode())
+        self.region_keys[region_name] = digest.hexdigest()
+        return self.region_keys[region_name]
+
+    def account_key(self, config):
+        """Returns the key of the stages that use all regions, such as the connections,
+        from the config and the keys of the regions"""
+        digest = hashlib.sha256(self._options.encode())
+        digest.update(json.dumps(config, sort_keys=True, default=str).encode())
+        for region_name in sorted(self.region_keys):
+            digest.update(
+                "{} {}\n".format(region_name, self.region_keys[region_name]).encode()
+            )
+        return digest.hexdigest()
+
+    def _get_path(self, name):
+        return get_stored_path(self.cache_dir, self.account_name, name)
+
+    def load(self, name, key):
+        """Returns the result stored as name, or None if it is missing or out of date"""
+        try:
+            with open(self._get_path(name), "rb") as f:
+                cached_key, value = pickle.load(f)
+        except Exception:
+            # Missing, or written by a version that can't be read anymore
+            return None
+        if cached_key != key:
+            return None
+        return value
+
+    def store(self, name, key, value):
+        os.makedirs(self.path, exist_ok=True)
+        path = self._get_path(name)
+        # Write to a temporary file first, so an interrupted run can't leave a partial file
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+
+def get_region_inputs_hash(account_name, region_name):
+    """Returns a hash of the collected files of a region that prepare reads"""
+    digest = hashlib.sha256()
+    for file_path in list_account_files(account_name, region_name):
+        # The file, or the directory of files of a function that takes a parameter
+        file_name = file_path.split("/")[1]
+        if file_name.startswith(REGION_INPUT_PREFIXES):
+            digest.update(
+                "{} {}\n".format(
+                    file_path, get_file_hash(account_name, file_path)
+                ).encode()
+            )
+    return digest.hexdigest()
+
+
+def get_stored_path(cache_dir, account_name, name):
+    return os.path.join(cache_dir, account_name, "{}.pickle".format(name))
+
+
+def load_stored(cache_dir, account_name, name):
+    """
+    Returns the result last stored as name for the account, without checking that it
+    is up to date, or None if there is none
+    """
+    try:
+        with open(get_stored_path(cache_dir, account_name, name), "rb") as f:
+            _, value = pickle.load(f)
+    except Exception:
+        return None
+    return value
@@ -64,6 +64,27 @@ def port_ranges_string(port_ranges):
     return ",".join(map(port_range_string, port_ranges))
 
 
+def get_public_port_ranges(sg):
+    """
+    Returns the tcp and udp port ranges that a security group opens to 0.0.0.0/0,
+    with all protocols allowed as [0, 65535]
+    """
+    # from_port and to_port mean the beginning and end of a port range
+    # We only care about TCP (6) and UDP (17)
+    # For more info see https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/security-group-rules-reference.html
+    port_ranges = []
+    for ip_permission in sg.get("IpPermissions", []):
+        selection = 'select((.IpProtocol=="tcp") or (.IpProtocol=="udp")) | select(.IpRanges[].CidrIp=="0.0.0.0/0")'
+        port_ranges.extend(
+            pyjq.all("{}| [.FromPort,.ToPort]".format(selection), ip_permission)
+        )
+        selection = (
+            'select(.IpProtocol=="-1") | select(.IpRanges[].CidrIp=="0.0.0.0/0")'
+        )
+        port_ranges.extend(pyjq.all("{}| [0,65535]".format(selection), ip_permission))
+    return port_ranges
+
+
 def get_public_nodes(account, config, use_cache=False):
     # TODO Look for IPv6 also
     # TODO Look at more services from https://github.com/arkadiyt/aws_public_ips
@@ -86,6 +107,15 @@ def get_public_nodes(account, config, use_cache=False):
         "mute": True,
     }
     network = build_data_structure(account, config, outputfilter)
+    security_groups = pyjq.first(
+        '.[].data|select(.type=="security_groups")|.node_data', network, {}
+    )
+    # Resources in more than one subnet refer to their node_data by ARN
+    shared_node_data = {}
+    for node_data in pyjq.all(
+        '.[].data|select(.type=="node_data")|.node_data', network
+    ):
+        shared_node_data.update(node_data)
 
     public_nodes = []
     warnings = []
@@ -100,6 +130,10 @@ def get_public_nodes(account, config, use_cache=False):
         target_node = pyjq.first(
             '.[].data|select(.id=="{}")'.format(target["arn"]), network, {}
         )
+        if "node_data_ref" in target_node:
+            target_node = dict(
+                target_node, node_data=shared_node_data[target_node["node_data_ref"]]
+            )
 
         # Depending on the type of node, identify what the IP or hostname is
         if target_node["type"] == "elb":
@@ -139,7 +173,12 @@ def get_public_nodes(account, config, use_cache=False):
             raise Exception("Unknown type: {}".format(target_node["type"]))
 
         # Check if any protocol is allowed (indicated by IpProtocol == -1)
-        ingress = pyjq.all(".[]", edge.get("node_data", {}))
+        # The edge refers to the security groups allowing it by id
+        ingress = [
+            security_groups[group_id]
+            for group_id in edge.get("node_data", [])
+            if group_id in security_groups
+        ]
 
         sg_group_allowing_all_protocols = pyjq.first(
             '.[]|select(.IpPermissions[]?|.IpProtocol=="-1")|.GroupId', ingress, None
@@ -154,21 +193,9 @@ def get_public_nodes(account, config, use_cache=False):
             # I would need to redo this code in order to get the name of the security group
             public_sgs[sg_group_allowing_all_protocols] = {"public_ports": "0-65535"}
 
-        # from_port and to_port mean the beginning and end of a port range
-        # We only care about TCP (6) and UDP (17)
-        # For more info see https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/security-group-rules-reference.html
         port_ranges = []
         for sg in ingress:
-            sg_port_ranges = []
-            for ip_permission in sg.get("IpPermissions", []):
-                selection = 'select((.IpProtocol=="tcp") or (.IpProtocol=="udp")) | select(.IpRanges[].CidrIp=="0.0.0.0/0")'
-                sg_port_ranges.extend(
-                    pyjq.all("{}| [.FromPort,.ToPort]".format(selection), ip_permission)
-                )
-                selection = 'select(.IpProtocol=="-1") | select(.IpRanges[].CidrIp=="0.0.0.0/0")'
-                sg_port_ranges.extend(
-                    pyjq.all("{}| [0,65535]".format(selection), ip_permission)
-                )
+            sg_port_ranges = get_public_port_ranges(sg)
             public_sgs[sg["GroupId"]] = {
                 "GroupId": sg["GroupId"],
                 "GroupName": sg["GroupName"],
@@ -185,9 +212,7 @@ def get_public_nodes(account, config, use_cache=False):
                 issue_msg.format(
                     json.dumps(
                         pyjq.all(
-                            '.[]|select((.IpProtocol!="tcp") and (.IpProtocol!="udp"))'.format(
-                                selection
-                            ),
+                            '.[]|select((.IpProtocol!="tcp") and (.IpProtocol!="udp"))',
                             ingress,
                         )
                     ),
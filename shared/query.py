@@ -1,32 +1,394 @@
 import urllib
 import os
 import json
+import hashlib
+import posixpath
+import sys
+import tarfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST_FILE_NAME = "manifest.json"
+
+# Number of threads used when loading many parameter files at once
+MAX_LOAD_WORKERS = 16
+
+# Strings up to this length are interned when intern_strings is enabled.
+# Longer strings, such as policy documents, are rarely repeated.
+MAX_INTERNED_STRING_LENGTH = 128
+
+# When enabled, the keys and short string values of all loaded json are interned,
+# so the same "GroupId" or region name is stored once no matter how many files use it
+_intern_strings = False
+
+# Manifests are only read once per command, keyed by account name.
+# A value of None means the account has no manifest and the filesystem is used.
+_manifests = {}
+
+# When set, collected files are read from this data source (a DataArchive or a
+# shared.snapshots.Snapshot) instead of account-data/
+_data_source = None
+
+
+class Manifest(object):
+    """Index of the files collected for an account, keyed by their path relative
+    to the account directory, with values of {"size", "mtime", "sha256"}"""
+
+    files = None
+    _directories = None
+
+    def __init__(self, files):
+        self.files = files
+        self._directories = None
+
+    def get_size(self, relative_path):
+        entry = self.files.get(posixpath.normpath(relative_path), None)
+        if entry is None:
+            return None
+        return entry["size"]
+
+    def listdir(self, relative_path):
+        if self._directories is None:
+            self._directories = {}
+            for file_path in self.files:
+                directory, _, file_name = file_path.rpartition("/")
+                self._directories.setdefault(directory, []).append(file_name)
+        return self._directories.get(relative_path.rstrip("/"), [])
+
+
+class DataArchive(object):
+    """Read-only view of the account-data/ directory stored in a single zip or tar file.
+
+    The archive's index (the zip central directory, or the tar headers) is read once,
+    and files are then read directly from their offsets without extracting anything.
+    Zip files are preferred, as the members of a compressed tar can only be reached by
+    decompressing the stream up to them.
+
+    Each thread reading a zip file opens its own handle on it, so the parameter files
+    loaded by get_parameter_files are read in parallel. A tar file has a single handle,
+    and reading its members out of order restarts the decompression, so its members
+    are read one at a time, and get_parameter_files reads them from a single thread.
+    """
+
+    path = None
+    # True if the members can only be read one at a time
+    sequential = None
+    _archive = None
+    _members = None
+    _manifests = None
+    _lock = None
+    _local = None
+
+    def __init__(self, path):
+        self.path = path
+        self._members = {}
+        self._manifests = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        if zipfile.is_zipfile(path):
+            self.sequential = False
+            self._archive = zipfile.ZipFile(path)
+            self._local.archive = self._archive
+            for info in self._archive.infolist():
+                if not info.is_dir():
+                    self._add_member(info.filename, info, info.file_size)
+        elif tarfile.is_tarfile(path):
+            self.sequential = True
+            self._archive = tarfile.open(path, "r:*")
+            for info in self._archive.getmembers():
+                if info.isfile():
+                    self._add_member(info.name, info, info.size)
+        else:
+            raise Exception("Unknown archive format for {}".format(path))
+
+    def _add_member(self, name, info, size):
+        # Members may be stored as account-data/<account>/... or just <account>/...
+        name = posixpath.normpath(name)
+        if name.startswith("account-data/"):
+            name = name[len("account-data/") :]
+        account_name, _, relative_path = name.partition("/")
+        if relative_path == "" or relative_path == MANIFEST_FILE_NAME:
+            return
+        self._members[(account_name, relative_path)] = info
+        self._manifests.setdefault(account_name, {})[relative_path] = {"size": size}
+
+    def get_manifest(self, account_name):
+        files = self._manifests.get(account_name, None)
+        if files is None:
+            return None
+        return Manifest(files)
+
+    def read(self, account_name, relative_path):
+        info = self._members[(account_name, posixpath.normpath(relative_path))]
+        if not self.sequential:
+            archive = getattr(self._local, "archive", None)
+            if archive is None:
+                archive = zipfile.ZipFile(self.path)
+                self._local.archive = archive
+            return archive.read(info)
+        # The tar file has a single file handle, so reads can't be interleaved
+        with self._lock:
+            return self._archive.extractfile(info).read()
+
+
+def set_data_source(data_source):
+    """Read all collected data from data_source, or from account-data/ if None.
+    A data source provides get_manifest(account_name) and read(account_name, relative_path)
+    """
+    global _data_source
+    _data_source = data_source
+    _manifests.clear()
+
+
+def set_data_archive(path):
+    """Read all collected data from the archive at path, or from account-data/ if None"""
+    set_data_source(None if path is None else DataArchive(path))
+
+
+def get_manifest_path(account_name):
+    return "account-data/{}/{}".format(account_name, MANIFEST_FILE_NAME)
+
+
+def build_manifest(account_name):
+    """Walk the collected files for an account and return a Manifest for them"""
+    account_dir = "account-data/{}".format(account_name)
+    files = {}
+    for root, _, file_names in os.walk(account_dir):
+        for file_name in file_names:
+            file_path = os.path.join(root, file_name)
+            relative_path = os.path.relpath(file_path, account_dir).replace(os.sep, "/")
+            if relative_path == MANIFEST_FILE_NAME:
+                continue
+            with open(file_path, "rb") as f:
+                sha256 = hashlib.sha256(f.read()).hexdigest()
+            stat = os.stat(file_path)
+            files[relative_path] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "sha256": sha256,
+            }
+    return Manifest(files)
+
+
+def write_manifest(account_name):
+    manifest = build_manifest(account_name)
+    with open(get_manifest_path(account_name), "w") as f:
+        json.dump(manifest.files, f, sort_keys=True)
+    _manifests[account_name] = manifest
+    return manifest
+
+
+def remove_manifest(account_name):
+    """Remove a manifest that no longer describes the files on disk"""
+    manifest_path = get_manifest_path(account_name)
+    if os.path.isfile(manifest_path):
+        os.remove(manifest_path)
+    _manifests.pop(account_name, None)
+
+
+def get_manifest(account_name):
+    if account_name not in _manifests:
+        manifest = None
+        manifest_path = get_manifest_path(account_name)
+        if _data_source is not None:
+            # Accounts missing from the data source get an empty manifest
+            manifest = _data_source.get_manifest(account_name) or Manifest({})
+        elif os.path.isfile(manifest_path):
+            with open(manifest_path) as f:
+                manifest = Manifest(json.load(f))
+        _manifests[account_name] = manifest
+    return _manifests[account_name]
+
+
+def get_file_size(account_name, relative_path):
+    """Returns the size of a collected file, or None if it does not exist"""
+    manifest = get_manifest(account_name)
+    if manifest is not None:
+        return manifest.get_size(relative_path)
+
+    file_name = "account-data/{}/{}".format(account_name, relative_path)
+    if not os.path.isfile(file_name):
+        return None
+    return os.path.getsize(file_name)
+
+
+def list_parameter_files(account_name, region_name, service, function):
+    """Returns the names of the non-empty files collected for a function that
+    takes a parameter, such as the buckets that have an s3-get-bucket-policy file"""
+    relative_dir = "{}/{}-{}".format(region_name, service, function)
+    manifest = get_manifest(account_name)
+    if manifest is not None:
+        file_names = manifest.listdir(relative_dir)
+    else:
+        directory = "account-data/{}/{}".format(account_name, relative_dir)
+        if not os.path.isdir(directory):
+            return []
+        file_names = os.listdir(directory)
+
+    return [
+        file_name
+        for file_name in file_names
+        if (get_file_size(account_name, "{}/{}".format(relative_dir, file_name)) or 0)
+        > 4
+    ]
+
+
+def list_account_files(account_name, relative_dir):
+    """Returns the paths, relative to the account directory, of all the files
+    collected under relative_dir, such as a region"""
+    relative_dir = relative_dir.rstrip("/") + "/"
+    manifest = get_manifest(account_name)
+    if manifest is not None:
+        return sorted(
+            file_path
+            for file_path in manifest.files
+            if file_path.startswith(relative_dir)
+        )
+
+    account_dir = "account-data/{}".format(account_name)
+    file_paths = []
+    for root, _, file_names in os.walk(os.path.join(account_dir, relative_dir)):
+        for file_name in file_names:
+            file_path = os.path.join(root, file_name)
+            file_paths.append(
+                os.path.relpath(file_path, account_dir).replace(os.sep, "/")
+            )
+    return sorted(file_paths)
+
+
+def get_file_hash(account_name, relative_path):
+    """Returns the sha256 of a collected file, from the manifest when it has one"""
+    manifest = get_manifest(account_name)
+    if manifest is not None:
+        entry = manifest.files.get(posixpath.normpath(relative_path), {})
+        if "sha256" in entry:
+            return entry["sha256"]
+    return hashlib.sha256(read_account_file(account_name, relative_path)).hexdigest()
+
+
+def set_intern_strings(enabled):
+    global _intern_strings
+    _intern_strings = enabled
+
+
+def intern_value(value):
+    if type(value) is str and len(value) <= MAX_INTERNED_STRING_LENGTH:
+        return sys.intern(value)
+    if type(value) is list:
+        # Lists of strings, such as security group IDs, are not seen by the object hook
+        return [intern_value(v) for v in value]
+    return value
+
+
+def intern_object_pairs(pairs):
+    """object_pairs_hook for json that interns keys and short string values"""
+    return {sys.intern(key): intern_value(value) for key, value in pairs}
+
+
+def load_json(data):
+    """Decode collected json, interning strings if that is enabled"""
+    if _intern_strings:
+        return json.loads(data, object_pairs_hook=intern_object_pairs)
+    return json.loads(data)
+
+
+def read_account_file(account_name, relative_path):
+    """Returns the bytes of a collected file, from the data source if one is set"""
+    if _data_source is not None:
+        return _data_source.read(account_name, relative_path)
+    with open("account-data/{}/{}".format(account_name, relative_path), "rb") as f:
+        return f.read()
+
+
+def get_account_file(account_name, relative_path):
+    """Returns the json of a collected file, or None if it does not exist"""
+    if get_file_size(account_name, relative_path) is None:
+        return None
+    return load_json(read_account_file(account_name, relative_path))
 
 
 def query_aws(account, query, region=None):
     if not region:
-        file_name = "account-data/{}/{}.json".format(account.name, query)
+        relative_path = "{}.json".format(query)
     else:
         if not isinstance(region, str):
             region = region.name
-        file_name = "account-data/{}/{}/{}.json".format(account.name, region, query)
-    if os.path.isfile(file_name):
-        return json.load(open(file_name))
-    else:
+        relative_path = "{}/{}.json".format(region, query)
+    json_blob = get_account_file(account.name, relative_path)
+    if json_blob is None:
         return {}
+    return json_blob
 
 
 def get_parameter_file(region, service, function, parameter_value):
-    file_name = "account-data/{}/{}/{}/{}".format(
-        region.account.name,
+    relative_path = "{}/{}/{}".format(
         region.name,
         "{}-{}".format(service, function),
         urllib.parse.quote_plus(parameter_value),
     )
-    if not os.path.isfile(file_name):
+    file_size = get_file_size(region.account.name, relative_path)
+    if file_size is None:
         return None
-    if os.path.getsize(file_name) <= 4:
+    if file_size <= 4:
         return None
 
     # Load the json data from the file
-    return json.load(open(file_name))
+    return load_json(read_account_file(region.account.name, relative_path))
+
+
+def get_parameter_files(
+    region, service, function, parameter_values=None, max_workers=MAX_LOAD_WORKERS
+):
+    """Load the files for many parameters of a function concurrently, which hides
+    the latency of network filesystems. If parameter_values is not given, every
+    non-empty file in the `<service>-<function>/` directory is loaded.
+    Returns a dict of parameter value to json, or None if the file is missing or empty.
+    A file that can't be loaded is returned as the exception loading it raised, so the
+    error can be handled with the resource it belongs to; get_loaded_file raises it.
+    """
+    if parameter_values is None:
+        parameter_values = [
+            urllib.parse.unquote_plus(file_name)
+            for file_name in list_parameter_files(
+                region.account.name, region.name, service, function
+            )
+        ]
+    # Remove duplicates, but keep the order
+    parameter_values = list(dict.fromkeys(parameter_values))
+    if len(parameter_values) == 0:
+        return {}
+
+    # Ensure the manifest is loaded once, before the threads need it
+    get_manifest(region.account.name)
+    if getattr(_data_source, "sequential", False):
+        # The files are read one at a time anyway, in the order they are listed
+        max_workers = 1
+
+    with ThreadPoolExecutor(
+        max_workers=min(max_workers, len(parameter_values))
+    ) as executor:
+        files = executor.map(
+            lambda parameter_value: load_parameter_file(
+                region, service, function, parameter_value
+            ),
+            parameter_values,
+        )
+        return dict(zip(parameter_values, files))
+
+
+def load_parameter_file(region, service, function, parameter_value):
+    try:
+        return get_parameter_file(region, service, function, parameter_value)
+    except Exception as e:
+        return e
+
+
+def get_loaded_file(files, parameter_value):
+    """Returns the json of a parameter loaded by get_parameter_files, or raises the
+    exception raised loading its file"""
+    file_json = files[parameter_value]
+    if isinstance(file_json, Exception):
+        raise file_json
+    return file_json
@@ -0,0 +1,358 @@
+import bisect
+
+from netaddr import IPNetwork
+
+from commands.prepare import (
+    RegionIndex,
+    LeafIpIndex,
+    get_vpcs,
+    get_resource_nodes,
+)
+from shared.common import get_regions, is_external_cidr
+from shared.nodes import Account, Region, Vpc
+from shared.public import regroup_ranges, port_ranges_string
+
+ALL_PROTOCOLS = "-1"
+ALL_PORTS = (0, 65535)
+
+# Security groups may use protocol numbers instead of names
+PROTOCOL_NAMES = {"1": "icmp", "6": "tcp", "17": "udp", "58": "icmpv6"}
+
+
+def normalize_protocol(protocol):
+    """Returns the protocol as named in security groups, ex. tcp, 6 -> tcp, any -> -1"""
+    protocol = str(protocol).lower()
+    if protocol in ["any", "all"]:
+        return ALL_PROTOCOLS
+    return PROTOCOL_NAMES.get(protocol, protocol)
+
+
+def is_cidr(value):
+    """True for a CIDR or IP, ex. 10.0.0.0/8 or 10.0.0.1, rather than a resource id"""
+    try:
+        IPNetwork(value)
+    except Exception:
+        return False
+    return True
+
+
+def parse_ports(ports):
+    """Parses a port or port range, ex. 443 -> (443, 443), 8000-8080 -> (8000, 8080)"""
+    if ports is None:
+        return None
+    ports = str(ports).split("-")
+    if len(ports) == 1:
+        return (int(ports[0]), int(ports[0]))
+    return (int(ports[0]), int(ports[1]))
+
+
+class Rule(object):
+    """An ingress rule of a security group, for one source"""
+
+    group_id = None
+    protocol = None
+    from_port = None
+    to_port = None
+    # One of cidr, security_group, or prefix_list
+    source_type = None
+    source = None
+    network = None
+
+    def __init__(self, group_id, protocol, from_port, to_port, source_type, source):
+        self.group_id = group_id
+        self.protocol = protocol
+        self.from_port = from_port
+        self.to_port = to_port
+        self.source_type = source_type
+        self.source = source
+        if source_type == "cidr":
+            self.network = IPNetwork(source)
+
+    def allows_network(self, network):
+        """True if the rule allows the whole network in"""
+        return (
+            self.network is not None
+            and self.network.version == network.version
+            and network in self.network
+        )
+
+
+def compile_rules(sg):
+    """Returns the ingress rules of a security group, one per source"""
+    rules = []
+    for permission in sg.get("IpPermissions", []):
+        protocol = normalize_protocol(permission["IpProtocol"])
+        from_port = permission.get("FromPort", -1)
+        to_port = permission.get("ToPort", -1)
+        # Only tcp and udp have ports. For ICMP, FromPort and ToPort are the type and
+        # code, so like other protocols, the rule applies to any port.
+        if protocol not in ["tcp", "udp"] or from_port == -1:
+            from_port, to_port = ALL_PORTS
+
+        sources = []
+        for ip_range in permission.get("IpRanges", []):
+            sources.append(("cidr", ip_range["CidrIp"]))
+        for ip_range in permission.get("Ipv6Ranges", []):
+            sources.append(("cidr", ip_range["CidrIpv6"]))
+        for group_pair in permission.get("UserIdGroupPairs", []):
+            sources.append(("security_group", group_pair["GroupId"]))
+        for prefix_list in permission.get("PrefixListIds", []):
+            sources.append(("prefix_list", prefix_list["PrefixListId"]))
+
+        for source_type, source in sources:
+            rules.append(
+                Rule(sg["GroupId"], protocol, from_port, to_port, source_type, source)
+            )
+    return rules
+
+
+class RuleIndex(object):
+    """
+    Ingress rules of the security groups of a region, by group and protocol.
+    The rules of each are sorted by start port, so a port lookup only checks the rules
+    starting at or before the port.
+    """
+
+    def __init__(self, sgs):
+        # {(group id, protocol): ([start ports], [rules])}
+        self._rules = {}
+        self._protocols_by_group = {}
+        for sg in sgs:
+            rules = compile_rules(sg)
+            rules.sort(key=lambda rule: rule.from_port)
+            for rule in rules:
+                from_ports, group_rules = self._rules.setdefault(
+                    (rule.group_id, rule.protocol), ([], [])
+                )
+                from_ports.append(rule.from_port)
+                group_rules.append(rule)
+                protocols = self._protocols_by_group.setdefault(rule.group_id, [])
+                if rule.protocol not in protocols:
+                    protocols.append(rule.protocol)
+
+    def _find(self, group_id, protocol, ports):
+        from_ports, rules = self._rules.get((group_id, protocol), ([], []))
+        if ports is None:
+            return list(rules)
+        candidates = rules[: bisect.bisect_right(from_ports, ports[1])]
+        return [rule for rule in candidates if rule.to_port >= ports[0]]
+
+    def get_rules(self, group_id, protocol=ALL_PROTOCOLS, ports=None):
+        """
+        Returns the rules of the group allowing the protocol on any of the ports.
+        The protocol -1 matches rules of every protocol, and ports of None match all ports.
+        """
+        if protocol == ALL_PROTOCOLS:
+            rules = []
+            for rule_protocol in self._protocols_by_group.get(group_id, []):
+                rules.extend(self._find(group_id, rule_protocol, ports))
+            return rules
+        # Rules allowing all protocols also apply
+        return self._find(group_id, protocol, ports) + self._find(
+            group_id, ALL_PROTOCOLS, ports
+        )
+
+
+class RegionReachability(object):
+    """The resources of a region, their security groups, and the index of their rules"""
+
+    def __init__(self, region):
+        self.region = region
+        self.name = region.name
+        region_index = RegionIndex(region)
+        for vpc_json in get_vpcs(region, {}):
+            region.addChild(Vpc(region, vpc_json))
+
+        self.rule_index = RuleIndex(region_index.sgs_by_id.values())
+        self.resources = list(
+            get_resource_nodes(
+                region, {"read_replicas": True, "collapse_asgs": False}
+            ).values()
+        )
+        self.resources_by_sg = {}
+        for resource in self.resources:
+            for group_id in resource.security_groups:
+                self.resources_by_sg.setdefault(group_id, []).append(resource)
+        self.ip_index = LeafIpIndex(self.resources)
+
+
+def rule_result(region, rule, source, source_type, target):
+    return {
+        "region": region.name,
+        "source": source,
+        "source_type": source_type,
+        "target": target.arn,
+        "target_type": target.node_type,
+        "target_name": target.name,
+        "protocol": rule.protocol,
+        "ports": port_ranges_string([(rule.from_port, rule.to_port)]),
+        "GroupId": rule.group_id,
+    }
+
+
+class Reachability(object):
+    """
+    Answers which resources can reach which, on which protocols and ports, from the
+    security groups of an account.
+    Like prepare, network ACLs and routing tables are not considered.
+    """
+
+    account = None
+    regions = None
+
+    def __init__(self, account, outputfilter={}):
+        if not isinstance(account, Account):
+            account = Account(None, account)
+        self.account = account
+        self.regions = []
+        for region_json in get_regions(account, outputfilter):
+            region = Region(account, region_json)
+            self.regions.append(RegionReachability(region))
+
+    def find_resources(self, resource_id):
+        """Returns the resources with the ARN, id, or name"""
+        matches = []
+        for region in self.regions:
+            for resource in region.resources:
+                if resource_id in [resource.arn, resource.local_id, resource.name]:
+                    matches.append((region, resource))
+        return matches
+
+    def can_reach(self, resource_id, protocol=ALL_PROTOCOLS, ports=None):
+        """Returns what can reach the resource, one result per source of each rule"""
+        protocol = normalize_protocol(protocol)
+        results = []
+        for region, target in self.find_resources(resource_id):
+            for group_id in target.security_groups:
+                for rule in region.rule_index.get_rules(group_id, protocol, ports):
+                    if rule.source_type == "cidr":
+                        if is_external_cidr(rule.source):
+                            # Resources with only private IPs can't be reached
+                            if target.is_public:
+                                results.append(
+                                    rule_result(
+                                        region, rule, rule.source, "cidr", target
+                                    )
+                                )
+                            continue
+                        results.append(
+                            rule_result(region, rule, rule.source, "cidr", target)
+                        )
+                        for source, _ in region.ip_index.match(rule.source):
+                            if source.can_egress and source != target:
+                                results.append(
+                                    rule_result(
+                                        region,
+                                        rule,
+                                        source.arn,
+                                        source.node_type,
+                                        target,
+                                    )
+                                )
+                    elif rule.source_type == "security_group":
+                        for source in region.resources_by_sg.get(rule.source, []):
+                            if source.can_egress and source != target:
+                                results.append(
+                                    rule_result(
+                                        region,
+                                        rule,
+                                        source.arn,
+                                        source.node_type,
+                                        target,
+                                    )
+                                )
+                    else:
+                        results.append(
+                            rule_result(
+                                region, rule, rule.source, rule.source_type, target
+                            )
+                        )
+        return results
+
+    def reachable_from(self, source, protocol=ALL_PROTOCOLS, ports=None):
+        """
+        Returns what the source can reach, one result per rule allowing it in.
+        The source is a CIDR, such as 0.0.0.0/0, or the ARN, id, or name of a resource.
+        """
+        protocol = normalize_protocol(protocol)
+
+        # Find the networks and security groups of the traffic from the source, by region
+        sources = {}
+        if is_cidr(source):
+            for region in self.regions:
+                sources[region] = (
+                    source,
+                    "cidr",
+                    [IPNetwork(source)],
+                    set(),
+                    is_external_cidr(source),
+                )
+        else:
+            for region, resource in self.find_resources(source):
+                if not resource.can_egress:
+                    continue
+                sources[region] = (
+                    resource.arn,
+                    resource.node_type,
+                    [IPNetwork(ip) for ip in resource.ips],
+                    set(resource.security_groups),
+                    False,
+                )
+
+        results = []
+        for region in self.regions:
+            if region not in sources:
+                continue
+            source_id, source_type, networks, groups, external = sources[region]
+            for target in region.resources:
+                # Resources with only private IPs can't be reached from the Internet
+                if external and not target.is_public:
+                    continue
+                if target.arn == source_id:
+                    continue
+                for group_id in target.security_groups:
+                    for rule in region.rule_index.get_rules(group_id, protocol, ports):
+                        if rule.source_type == "security_group":
+                            allowed = rule.source in groups
+                        else:
+                            allowed = any(
+                                rule.allows_network(network) for network in networks
+                            )
+                        if allowed:
+                            results.append(
+                                rule_result(
+                                    region, rule, source_id, source_type, target
+                                )
+                            )
+        return results
+
+
+def summarize(results):
+    """Combines the results for each source and target, merging their port ranges"""
+    summary = {}
+    for result in results:
+        key = (result["source"], result["target"], result["protocol"])
+        entry = summary.setdefault(
+            key,
+            {
+                "region": result["region"],
+                "source": result["source"],
+                "source_type": result["source_type"],
+                "target": result["target"],
+                "target_type": result["target_type"],
+                "target_name": result["target_name"],
+                "protocol": result["protocol"],
+                "port_ranges": [],
+                "GroupIds": [],
+            },
+        )
+        for port_range in result["ports"].split(","):
+            entry["port_ranges"].append(parse_ports(port_range))
+        if result["GroupId"] not in entry["GroupIds"]:
+            entry["GroupIds"].append(result["GroupId"])
+
+    summarized = []
+    for entry in summary.values():
+        entry["ports"] = port_ranges_string(regroup_ranges(entry.pop("port_ranges")))
+        summarized.append(entry)
+    return summarized
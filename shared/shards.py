@@ -0,0 +1,193 @@
+import json
+import os
+
+from shared.cytoscape import CytoscapeWriter
+
+SHARDS_DIRECTORY = "shards"
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+def get_owners(elements, shard_type="vpc"):
+    """
+    Returns the id of the node of the shard_type, a VPC or an account, holding each
+    node, for the nodes inside one.
+    """
+    nodes = {}
+    for element in elements:
+        data = element["data"]
+        if data["type"] != "edge":
+            nodes[data["id"]] = data
+
+    def get_parent(node_id):
+        parent_id = nodes[node_id].get("parent", None)
+        if parent_id is not None and parent_id not in nodes:
+            # Without AZs, subnets refer to an AZ that is not in the graph, whose ARN
+            # starts with the ARN of its VPC
+            parent_id = parent_id.split("/az/")[0]
+            if parent_id not in nodes:
+                return None
+        return parent_id
+
+    owners = {}
+    for node_id in nodes:
+        parent_id = get_parent(node_id)
+        while parent_id is not None:
+            if nodes[parent_id]["type"] == shard_type:
+                owners[node_id] = parent_id
+                break
+            parent_id = get_parent(parent_id)
+    return owners
+
+
+def get_shard_file(node):
+    if node["type"] == "account":
+        return "{}/{}.json".format(SHARDS_DIRECTORY, node["local_id"])
+    return "{}/{}-{}.json".format(
+        SHARDS_DIRECTORY, node["id"].split(":")[3], node["local_id"]
+    )
+
+
+def split_shards(elements, shard_type="vpc"):
+    """
+    Splits a graph into a summary graph and a shard for each VPC, or for each
+    account with a shard_type of "account".
+    The summary has every node outside of a VPC, and the VPCs without their contents.
+    Each VPC refers to the file of its shard in data.shard, and its edges stand for
+    those of its contents, with the number of them in edge_count.
+    A shard has the nodes of a VPC, and every edge with an end in the VPC. The
+    source_owner and target_owner of these edges are the VPC or other node to
+    connect them to while the VPC at that end is not loaded.
+    Returns the summary elements, and the elements of each shard by VPC id.
+    Accounts are split in the same way.
+    """
+    owners = get_owners(elements, shard_type)
+    shards = {}
+    node_data_owners = {}
+    positions = {}
+    for element in elements:
+        data = element["data"]
+        if data["type"] == shard_type:
+            shards[data["id"]] = []
+        if "node_data_ref" in data:
+            node_data_owners[data["node_data_ref"]] = owners.get(data["id"], None)
+        if "position" in element and data["id"] in owners:
+            positions.setdefault(owners[data["id"]], []).append(element["position"])
+
+    summary = []
+    summary_edges = {}
+    for element in elements:
+        data = element["data"]
+        if data["type"] == "edge":
+            source_owner = owners.get(data["source"], data["source"])
+            target_owner = owners.get(data["target"], data["target"])
+            for owner in set([source_owner, target_owner]):
+                if owner in shards:
+                    shards[owner].append(
+                        dict(
+                            element,
+                            data=dict(
+                                data,
+                                source_owner=source_owner,
+                                target_owner=target_owner,
+                            ),
+                        )
+                    )
+            if source_owner == target_owner:
+                continue
+            key = (source_owner, target_owner)
+            if key in summary_edges:
+                summary_data = summary_edges[key]["data"]
+                summary_data["edge_count"] += 1
+                for reason in data.get("node_data", []):
+                    if reason not in summary_data["node_data"]:
+                        summary_data["node_data"].append(reason)
+            else:
+                # Keeping the classes of the first edge, such as those of peerings
+                summary_edges[key] = dict(
+                    element,
+                    data=dict(
+                        data,
+                        source=source_owner,
+                        target=target_owner,
+                        node_data=list(data.get("node_data", [])),
+                        edge_count=1,
+                    ),
+                )
+        elif data["type"] == "node_data":
+            # The json of resources in many subnets goes with the VPC of those subnets
+            tables = {}
+            for resource_arn, node_data in data["node_data"].items():
+                owner = node_data_owners.get(resource_arn, None)
+                tables.setdefault(owner, {})[resource_arn] = node_data
+            for owner, table in tables.items():
+                table_element = {"data": dict(data, node_data=table)}
+                if owner in shards:
+                    table_element["data"]["id"] = owner + "node_data"
+                    shards[owner].append(table_element)
+                else:
+                    summary.append(table_element)
+        elif data["id"] in owners:
+            shards[owners[data["id"]]].append(element)
+        elif data["type"] == shard_type:
+            placeholder = {"data": dict(data, shard=get_shard_file(data))}
+            if data["id"] in positions:
+                # Loaded VPCs are placed around their contents, so start there
+                placeholder["position"] = {
+                    axis: round(
+                        sum(position[axis] for position in positions[data["id"]])
+                        / len(positions[data["id"]])
+                    )
+                    for axis in ["x", "y"]
+                }
+            summary.append(placeholder)
+        else:
+            summary.append(element)
+
+    summary.extend(summary_edges.values())
+    return summary, shards
+
+
+def write_shards(elements, directory="web", node_data=True, shard_type="vpc"):
+    """
+    Writes the summary graph of the elements to data.json, and each of the shards to
+    the shards directory, which only has the shards of this graph afterwards.
+    The shards are listed in shards/manifest.json.
+    """
+    summary, shards = split_shards(elements, shard_type)
+
+    shards_directory = os.path.join(directory, SHARDS_DIRECTORY)
+    if os.path.isdir(shards_directory):
+        for file_name in os.listdir(shards_directory):
+            if file_name.endswith(".json"):
+                os.remove(os.path.join(shards_directory, file_name))
+    else:
+        os.makedirs(shards_directory)
+
+    with CytoscapeWriter(
+        os.path.join(directory, "data.json"), node_data=node_data
+    ) as writer:
+        writer.write_all(summary)
+
+    placeholders = {
+        element["data"]["id"]: element["data"]
+        for element in summary
+        if element["data"]["type"] == shard_type
+    }
+    manifest = {"summary": "data.json", "shards": []}
+    for owner, shard in shards.items():
+        with CytoscapeWriter(
+            os.path.join(directory, placeholders[owner]["shard"]), node_data=node_data
+        ) as writer:
+            writer.write_all(shard)
+        manifest["shards"].append(
+            {
+                "id": owner,
+                "parent": placeholders[owner].get("parent", None),
+                "file": placeholders[owner]["shard"],
+                "nodes": len([e for e in shard if e["data"]["type"] != "edge"]),
+                "edges": len([e for e in shard if e["data"]["type"] == "edge"]),
+            }
+        )
+    with open(os.path.join(shards_directory, MANIFEST_FILE_NAME), "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    return manifest
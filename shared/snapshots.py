@@ -0,0 +1,271 @@
+import datetime
+import hashlib
+import json
+import os
+import posixpath
+import tempfile
+import zlib
+
+from shared.query import Manifest, build_manifest
+
+DEFAULT_STORE = "snapshots"
+
+# The AWS managed policies are the same in every account, so they are stored
+# once rather than inside every copy of the authorization details.
+AWS_MANAGED_POLICY_PREFIX = "arn:aws:iam::aws:policy/"
+SPLIT_FILES = ["iam-get-account-authorization-details.json"]
+
+SNAPSHOT_TIME_FORMAT = "%Y-%m-%dT%H%M%SZ"
+
+
+def new_snapshot_name():
+    return datetime.datetime.utcnow().strftime(SNAPSHOT_TIME_FORMAT)
+
+
+def serialize(json_blob):
+    # Same format as collect uses to write files
+    return json.dumps(json_blob, indent=4, sort_keys=True).encode()
+
+
+class SnapshotStore(object):
+    """Content-addressed store of collected data.
+
+    Each file is stored once, zlib compressed, as blobs/<sha256[:2]>/<sha256>.
+    Each collection of an account is a snapshot manifest at
+    snapshots/<account>/<snapshot name>.json that maps the relative paths of the
+    files to their blobs, so storing a new collection only costs the files that changed.
+    """
+
+    path = None
+
+    def __init__(self, path=DEFAULT_STORE):
+        self.path = path
+
+    def _blob_path(self, sha256):
+        return os.path.join(self.path, "blobs", sha256[:2], sha256)
+
+    def _snapshot_path(self, account_name, snapshot_name):
+        return os.path.join(
+            self.path, "snapshots", account_name, "{}.json".format(snapshot_name)
+        )
+
+    def _write_file(self, path, data):
+        # Write to a temporary file first so a partial write is never seen
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def has_blob(self, sha256):
+        return os.path.isfile(self._blob_path(sha256))
+
+    def put_blob(self, data):
+        sha256 = hashlib.sha256(data).hexdigest()
+        if not self.has_blob(sha256):
+            self._write_file(self._blob_path(sha256), zlib.compress(data))
+        return sha256
+
+    def get_blob(self, sha256):
+        with open(self._blob_path(sha256), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def _put_split_file(self, data):
+        """Store the AWS managed policies of the file as their own blobs, and the rest
+        of the file as a document referencing them.
+        Returns (document blob, policy blobs), or None if the file can't be split."""
+        try:
+            json_blob = json.loads(data)
+        except ValueError:
+            return None
+        if not isinstance(json_blob, dict) or not json_blob.get("Policies"):
+            return None
+
+        parts = {}
+        policies = []
+        for policy in json_blob["Policies"]:
+            if policy.get("Arn", "").startswith(AWS_MANAGED_POLICY_PREFIX):
+                part = serialize(policy)
+                sha256 = hashlib.sha256(part).hexdigest()
+                parts[sha256] = part
+                policies.append({"$blob": sha256})
+            else:
+                policies.append(policy)
+        json_blob["Policies"] = policies
+        document = json.dumps(json_blob, sort_keys=True).encode()
+
+        # Only keep the split form if it rebuilds the exact same file
+        if self._join_split_file(document, parts.get) != data:
+            return None
+        for part in parts.values():
+            self.put_blob(part)
+        return self.put_blob(document), sorted(parts)
+
+    def _join_split_file(self, document, get_blob=None):
+        if get_blob is None:
+            get_blob = self.get_blob
+        json_blob = json.loads(document)
+        json_blob["Policies"] = [
+            json.loads(get_blob(policy["$blob"])) if "$blob" in policy else policy
+            for policy in json_blob["Policies"]
+        ]
+        return serialize(json_blob)
+
+    def store_account(self, account_name, snapshot_name=None, manifest=None):
+        """Add the files in account-data/<account_name> to the store as a new snapshot.
+        Returns the name of the snapshot."""
+        if snapshot_name is None:
+            snapshot_name = new_snapshot_name()
+        if manifest is None:
+            manifest = build_manifest(account_name)
+
+        files = {}
+        for relative_path, entry in manifest.files.items():
+            entry = dict(entry)
+            sha256 = entry["sha256"]
+            if not self.has_blob(sha256):
+                with open(
+                    "account-data/{}/{}".format(account_name, relative_path), "rb"
+                ) as f:
+                    data = f.read()
+                split = None
+                if posixpath.basename(relative_path) in SPLIT_FILES:
+                    split = self._put_split_file(data)
+                if split is None:
+                    self.put_blob(data)
+                else:
+                    entry["blob"], entry["parts"] = split
+            files[relative_path] = entry
+
+        self._write_file(
+            self._snapshot_path(account_name, snapshot_name),
+            json.dumps(
+                {
+                    "created": datetime.datetime.utcnow().isoformat(),
+                    "files": files,
+                },
+                sort_keys=True,
+            ).encode(),
+        )
+        return snapshot_name
+
+    def list_accounts(self):
+        snapshots_dir = os.path.join(self.path, "snapshots")
+        if not os.path.isdir(snapshots_dir):
+            return []
+        return sorted(os.listdir(snapshots_dir))
+
+    def list_snapshots(self, account_name):
+        """Returns the snapshot names of an account, oldest first"""
+        account_dir = os.path.join(self.path, "snapshots", account_name)
+        if not os.path.isdir(account_dir):
+            return []
+        return sorted(
+            f[: -len(".json")] for f in os.listdir(account_dir) if f.endswith(".json")
+        )
+
+    def resolve_snapshot(self, account_name, snapshot_name):
+        """Returns the newest snapshot of the account whose name starts with
+        snapshot_name (ex. a date such as 2019-05-07), or None.
+        The name "latest" matches all snapshots."""
+        if snapshot_name == "latest":
+            snapshot_name = ""
+        matches = [
+            name
+            for name in self.list_snapshots(account_name)
+            if name.startswith(snapshot_name)
+        ]
+        if len(matches) == 0:
+            return None
+        return matches[-1]
+
+    def get_snapshot(self, account_name, snapshot_name):
+        with open(self._snapshot_path(account_name, snapshot_name)) as f:
+            return json.load(f)
+
+    def read(self, entry):
+        """Returns the bytes of the file described by a snapshot manifest entry"""
+        if "blob" in entry:
+            return self._join_split_file(self.get_blob(entry["blob"]))
+        return self.get_blob(entry["sha256"])
+
+    def prune(self, account_name, keep=None, keep_days=None):
+        """Remove the snapshots of an account that are not among the newest `keep`,
+        or are older than `keep_days`. The newest snapshot is always kept.
+        Blobs are only removed by compact. Returns the removed snapshot names."""
+        snapshot_names = self.list_snapshots(account_name)
+        to_remove = set()
+        if keep is not None:
+            to_remove.update(snapshot_names[: -max(keep, 1)])
+        if keep_days is not None:
+            oldest = datetime.datetime.utcnow() - datetime.timedelta(days=keep_days)
+            for snapshot_name in snapshot_names[:-1]:
+                created = self.get_snapshot(account_name, snapshot_name)["created"]
+                if datetime.datetime.fromisoformat(created) < oldest:
+                    to_remove.add(snapshot_name)
+
+        for snapshot_name in to_remove:
+            os.remove(self._snapshot_path(account_name, snapshot_name))
+        return sorted(to_remove)
+
+    def compact(self):
+        """Remove the blobs no snapshot references.
+        Returns (number of blobs removed, bytes freed)."""
+        referenced = set()
+        for account_name in self.list_accounts():
+            for snapshot_name in self.list_snapshots(account_name):
+                for entry in self.get_snapshot(account_name, snapshot_name)[
+                    "files"
+                ].values():
+                    referenced.add(entry["sha256"])
+                    if "blob" in entry:
+                        referenced.add(entry["blob"])
+                        referenced.update(entry["parts"])
+
+        removed = 0
+        freed = 0
+        blobs_dir = os.path.join(self.path, "blobs")
+        if not os.path.isdir(blobs_dir):
+            return removed, freed
+        for prefix in os.listdir(blobs_dir):
+            for sha256 in os.listdir(os.path.join(blobs_dir, prefix)):
+                if sha256 not in referenced:
+                    blob_path = os.path.join(blobs_dir, prefix, sha256)
+                    freed += os.path.getsize(blob_path)
+                    os.remove(blob_path)
+                    removed += 1
+        return removed, freed
+
+
+class Snapshot(object):
+    """Data source for shared.query that reads a snapshot of each account from a store"""
+
+    store = None
+    snapshot_name = None
+    _snapshots = None
+
+    def __init__(self, store, snapshot_name="latest"):
+        self.store = store
+        self.snapshot_name = snapshot_name
+        self._snapshots = {}
+
+    def _get_files(self, account_name):
+        if account_name not in self._snapshots:
+            files = None
+            snapshot_name = self.store.resolve_snapshot(
+                account_name, self.snapshot_name
+            )
+            if snapshot_name is not None:
+                files = self.store.get_snapshot(account_name, snapshot_name)["files"]
+            self._snapshots[account_name] = files
+        return self._snapshots[account_name]
+
+    def get_manifest(self, account_name):
+        files = self._get_files(account_name)
+        if files is None:
+            return None
+        return Manifest(files)
+
+    def read(self, account_name, relative_path):
+        files = self._get_files(account_name)
+        return self.store.read(files[posixpath.normpath(relative_path)])
@@ -0,0 +1,163 @@
+import pyjq
+
+from shared.common import get_regions
+from shared.nodes import Region
+from shared.query import (
+    query_aws,
+    get_parameter_files,
+    get_loaded_file,
+    list_account_files,
+    get_account_file,
+)
+
+
+def match_tag_sets(index, tag_sets):
+    """
+    Returns the resources matching one of the tag sets, each a string such as
+    "Env=prod,Team=web" that resources match if they have all of its tags, from an
+    index of tag key -> tag value -> resources
+    """
+    matches = set()
+    for tag_set in tag_sets:
+        conditions = [c.split("=") for c in tag_set.split(",")]
+        tag_set_matches = set(
+            index.get(conditions[0][0], {}).get(conditions[0][1], set())
+        )
+        for pair in conditions[1:]:
+            tag_set_matches &= index.get(pair[0], {}).get(pair[1], set())
+        matches |= tag_set_matches
+    return matches
+
+
+class TagIndex(object):
+    """
+    Inverted index of the tags of the resources of an account, from the collected data:
+    tag key -> tag value -> ARNs of the resources with that tag.
+    The resources are those that prepare puts on the map, by their ARN in AWS.
+    """
+
+    index = None
+    # ARN -> tags, as [{"Key": key, "Value": value}]
+    resource_tags = None
+    # ARN -> region name
+    resource_regions = None
+
+    def __init__(self):
+        self.index = {}
+        self.resource_tags = {}
+        self.resource_regions = {}
+
+    def add(self, arn, tags, region_name=None):
+        tags = [
+            {"Key": tag.get("Key", ""), "Value": tag.get("Value", "")}
+            for tag in tags or []
+        ]
+        self.resource_tags[arn] = tags
+        self.resource_regions[arn] = region_name
+        for tag in tags:
+            self.index.setdefault(tag["Key"], {}).setdefault(tag["Value"], set()).add(
+                arn
+            )
+
+    def add_region(self, region):
+        """Adds the tags of the resources collected for the region"""
+        account = region.account
+        region_name = region.name
+
+        instances = query_aws(account, "ec2-describe-instances", region)
+        for instance in pyjq.all(".Reservations[]?.Instances[]?", instances):
+            self.add(
+                "arn:aws:ec2:{}:{}:instance/{}".format(
+                    region_name, account.local_id, instance["InstanceId"]
+                ),
+                instance.get("Tags", None),
+                region_name,
+            )
+
+        # The tags of load balancers and RDS instances are collected for each of them
+        files = get_parameter_files(region, "elb", "describe-tags")
+        for name in files:
+            for description in pyjq.all(
+                ".TagDescriptions[]?", get_loaded_file(files, name)
+            ):
+                self.add(
+                    "arn:aws:elasticloadbalancing:{}:{}:loadbalancer/{}".format(
+                        region_name, account.local_id, description["LoadBalancerName"]
+                    ),
+                    description.get("Tags", None),
+                    region_name,
+                )
+        files = get_parameter_files(region, "elbv2", "describe-tags")
+        for name in files:
+            for description in pyjq.all(
+                ".TagDescriptions[]?", get_loaded_file(files, name)
+            ):
+                self.add(
+                    description["ResourceArn"],
+                    description.get("Tags", None),
+                    region_name,
+                )
+        files = get_parameter_files(region, "rds", "list-tags-for-resource")
+        for arn in files:
+            tags = get_loaded_file(files, arn)
+            if tags is not None:
+                self.add(arn, tags.get("TagList", None), region_name)
+
+        # ECS tasks are collected in a directory for each cluster
+        for file_path in list_account_files(
+            account.name, "{}/ecs-describe-tasks".format(region_name)
+        ):
+            for task in pyjq.all(
+                ".tasks[]?", get_account_file(account.name, file_path)
+            ):
+                self.add(task["taskArn"], task.get("tags", None), region_name)
+
+        functions = query_aws(account, "lambda-list-functions", region)
+        for function in pyjq.all(".Functions[]?", functions):
+            self.add(function["FunctionArn"], function.get("tags", None), region_name)
+
+        clusters = query_aws(account, "redshift-describe-clusters", region)
+        for cluster in pyjq.all(".Clusters[]?", clusters):
+            self.add(
+                "arn:aws:redshift:{}:{}:cluster:{}".format(
+                    region_name, account.local_id, cluster["ClusterIdentifier"]
+                ),
+                cluster.get("Tags", None),
+                region_name,
+            )
+
+        # Resources found from their network interfaces, by --discovery eni, that
+        # prepare has no node type for are tagged by their interface
+        interfaces = query_aws(account, "ec2-describe-network-interfaces", region)
+        for interface in pyjq.all(".NetworkInterfaces[]?", interfaces):
+            self.add(
+                "arn:aws:ec2:{}:{}:network-interface/{}".format(
+                    region_name, account.local_id, interface["NetworkInterfaceId"]
+                ),
+                interface.get("TagSet", None),
+                region_name,
+            )
+
+    def get_tags(self, arn):
+        return self.resource_tags.get(arn, [])
+
+    def get(self, key, value=None):
+        """The resources with the tag key, and the value if given"""
+        values = self.index.get(key, {})
+        if value is not None:
+            return set(values.get(value, set()))
+        return set().union(*values.values())
+
+    def match(self, tag_sets):
+        """Returns the resources matching one of the tag sets, as for match_tag_sets"""
+        return match_tag_sets(self.index, tag_sets)
+
+
+def build_tag_index(account, regions=None):
+    """Builds the TagIndex of the account, from all of its regions unless given some"""
+    tag_index = TagIndex()
+    if regions is None:
+        regions = [Region(account, region) for region in get_regions(account)]
+    for region in regions:
+        tag_index.add_region(region)
+    return tag_index
@@ -1,9 +1,12 @@
 import unittest
 import json
+from mock import patch
 from nose.tools import assert_equal, assert_true, assert_false
 
 from shared.common import parse_arguments
-from shared.audit import audit
+from shared.audit import audit, audit_s3_buckets, Findings
+from shared.nodes import Account, Region
+from shared.query import get_parameter_file
 
 
 class TestAudit(unittest.TestCase):
@@ -52,3 +55,25 @@ class TestAudit(unittest.TestCase):
                 ]
             ),
         )
+
+    def test_audit_s3_buckets_unreadable_file(self):
+        account = Account(None, {"id": "123456789012", "name": "demo"})
+        region = Region(account, {"RegionName": "us-east-1"})
+
+        def get_file(region, service, function, parameter_value):
+            if function == "get-bucket-policy":
+                raise ValueError("Unreadable file")
+            return get_parameter_file(region, service, function, parameter_value)
+
+        # The error is a finding for the bucket, and its ACL is still checked
+        findings = Findings()
+        with patch("shared.query.get_parameter_file", side_effect=get_file):
+            audit_s3_buckets(findings, region)
+        assert_equal(
+            ["Exception checking policy of S3 bucket"],
+            [
+                finding.resource_details["location"]
+                for finding in findings
+                if finding.issue_id == "EXCEPTION"
+            ],
+        )
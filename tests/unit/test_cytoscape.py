@@ -0,0 +1,57 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from nose.tools import assert_equal
+
+from shared.cytoscape import CytoscapeWriter
+
+
+class TestCytoscapeWriter(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "data.json")
+        self.elements = [
+            {"data": {"id": "a", "type": "ec2", "node_data": {"InstanceId": "i-1"}}},
+            {"data": {"source": "a", "target": "b", "type": "edge", "node_data": []}},
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def read(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    def test_write(self):
+        with CytoscapeWriter(self.path) as writer:
+            writer.write_all(iter(self.elements))
+        assert_equal(self.elements, self.read())
+        assert_equal(2, writer.count)
+
+        with CytoscapeWriter(self.path, indent=4) as writer:
+            pass
+        assert_equal([], self.read())
+
+    def test_no_node_data(self):
+        with CytoscapeWriter(self.path, node_data=False) as writer:
+            writer.write_all(self.elements)
+        assert_equal([{}, {}], [e["data"]["node_data"] for e in self.read()])
+        # The elements given are not changed
+        assert_equal({"InstanceId": "i-1"}, self.elements[0]["data"]["node_data"])
+
+    def test_failed_write(self):
+        with CytoscapeWriter(self.path) as writer:
+            writer.write_all(self.elements)
+
+        def elements():
+            yield {"data": {"id": "c", "type": "ec2", "node_data": {}}}
+            raise ValueError("Build failed")
+
+        # The file written before is kept, and the partial file is removed
+        with self.assertRaises(ValueError):
+            with CytoscapeWriter(self.path) as writer:
+                writer.write_all(elements())
+        assert_equal(self.elements, self.read())
+        assert_equal(["data.json"], os.listdir(self.temp_dir))
@@ -0,0 +1,73 @@
+import json
+import shutil
+import tempfile
+import unittest
+from nose.tools import assert_equal, assert_true
+
+from commands.prepare import build_data_structure, get_graph_index
+from shared.nodes import Account
+from shared.graph_index import get_filters
+
+
+class TestGraphIndex(unittest.TestCase):
+    def setUp(self):
+        self.json_blob = {"id": 123456789012, "name": "demo"}
+        self.config = {
+            "accounts": [{"id": 123456789012, "name": "demo"}],
+            "cidrs": {"1.1.1.1/32": {"name": "SF Office"}},
+        }
+        self.outputfilter = {"internal_edges": True, "azs": True, "mute": True}
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def get_graph(self, outputfilter):
+        return get_graph_index(
+            Account(None, self.json_blob),
+            self.config,
+            dict(outputfilter, cache_dir=self.cache_dir),
+        )
+
+    def assert_same_as_build(self, outputfilter):
+        elements = self.get_graph(outputfilter).query(**get_filters(outputfilter))
+        built = build_data_structure(self.json_blob, self.config, outputfilter)
+        assert_equal(
+            sorted(json.dumps(e, sort_keys=True) for e in built),
+            sorted(json.dumps(e, sort_keys=True) for e in elements),
+        )
+
+    def test_filters(self):
+        for filters in [
+            {},
+            {"regions": '"us-east-1"'},
+            {"regions": '"us-west-2"'},
+            {"vpc-ids": '"vpc-12345678"'},
+            {"vpc-names": '"Prod"'},
+            {"tags": ["Name=Bastion"]},
+            {"tags": ["Name=Bastion", "Name=web"]},
+            {"internal_edges": False},
+            {"internal_edges": False, "tags": ["Name=Bastion"]},
+        ]:
+            self.assert_same_as_build(dict(self.outputfilter, **filters))
+
+    def test_sg_edges(self):
+        outputfilter = dict(self.outputfilter, sg_edges=True)
+        self.assert_same_as_build(dict(outputfilter, tags=["Name=Bastion"]))
+        self.assert_same_as_build(dict(outputfilter, internal_edges=False))
+
+    def test_indexes(self):
+        graph = self.get_graph(self.outputfilter)
+        bastion = graph.select(tags=["Name=Bastion"])
+        assert_equal(1, len(bastion))
+        assert_true(bastion <= graph.regions["us-east-1"])
+        assert_true(bastion <= graph.vpcs["vpc-12345678"])
+        assert_true(bastion <= graph.select(node_types=["ec2"]))
+        assert_equal(set(), graph.select(regions=["us-west-2"]))
+
+        # The graph is only built again when its inputs change
+        with open(self.cache_dir + "/demo/graph.pickle", "rb") as f:
+            stored = f.read()
+        self.get_graph(dict(self.outputfilter, regions='"us-east-1"'))
+        with open(self.cache_dir + "/demo/graph.pickle", "rb") as f:
+            assert_equal(stored, f.read())
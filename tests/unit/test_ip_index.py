@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from nose.tools import assert_equal, assert_true
+
+from commands.prepare import get_external_cidrs, build_region
+from commands.whois_ip import build_ip_index, get_ip_index, whois_ip
+from shared.ip_index import IpIndex, load_ip_index
+from shared.nodes import Account
+
+
+def owner(account, resource_type, resource_id, name=None):
+    return {"account": account, "type": resource_type, "id": resource_id, "name": name}
+
+
+class TestIpIndex(unittest.TestCase):
+    def test_lookup(self):
+        ip_index = IpIndex()
+        ip_index.add("10.0.0.0/16", owner("a", "vpc", "vpc-1", "Prod"))
+        ip_index.add("10.0.1.0/24", owner("a", "subnet", "subnet-1"))
+        ip_index.add("10.0.1.5", owner("a", "ec2", "i-1", "web"))
+        ip_index.add("10.0.1.5", owner("a", "ec2", "i-1", "web"))
+        ip_index.add("10.0.2.7", owner("a", "rds", "db"))
+        ip_index.add("54.1.2.3", owner("b", "elb", "lb"))
+        ip_index.add("2600:1f18::1", owner("b", "ec2", "i-2"))
+
+        # The most specific first
+        assert_equal(
+            ["10.0.1.5/32", "10.0.1.0/24", "10.0.0.0/16"],
+            [cidr for cidr, _ in ip_index.lookup("10.0.1.5")],
+        )
+        assert_equal(["10.0.0.0/16"], [c for c, _ in ip_index.lookup("10.0.0.0/20")])
+        assert_equal([], ip_index.lookup("10.1.0.1"))
+        assert_equal(["i-2"], [o["id"] for _, o in ip_index.lookup("2600:1f18:0:0::1")])
+
+        assert_equal(
+            ["i-1", "db"], [o["id"] for _, o in ip_index.within("10.0.0.0/16")]
+        )
+        assert_equal([], ip_index.within("10.0.3.0/24"))
+
+        assert_equal("b lb", ip_index.get_name("54.1.2.3/32"))
+        assert_equal("a Prod", ip_index.get_name("10.0.9.0/24"))
+        assert_equal("b", ip_index.get_name("54.1.0.0/16"))
+        assert_equal(None, ip_index.get_name("1.1.1.1/32"))
+
+    def test_demo(self):
+        accounts = [{"id": "123456789012", "name": "demo"}]
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "ip-index.pickle")
+            ip_index = get_ip_index(accounts, path)
+            assert_equal(ip_index.key, load_ip_index(path).key)
+
+            owners = whois_ip(ip_index, ["1.2.3.4", "172.31.48.168"])
+            assert_equal(
+                ["ec2", "Bastion"],
+                [owners["1.2.3.4"][0]["type"], owners["1.2.3.4"][0]["name"]],
+            )
+            ecs = owners["172.31.48.168"][0]
+            assert_equal("ecs", ecs["type"])
+            assert_equal("eni-00000001", ecs["interface"])
+            assert_equal(["sg-00000008"], ecs["security_groups"])
+
+            # The index is only built again when the collected files change
+            with patch("commands.whois_ip.build_ip_index", side_effect=Exception):
+                get_ip_index(accounts, path)
+            with patch("shared.prepare_cache.get_file_hash", return_value="changed"):
+                assert_true(get_ip_index(accounts, path).key != ip_index.key)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_prepare_cidr_names(self):
+        account = Account(None, {"id": "123456789012", "name": "demo"})
+        region, region_index, _, _ = build_region(
+            account, {"RegionName": "us-east-1"}, {}
+        )
+        account.addChild(region)
+        config = {"cidrs": {}}
+        ip_index = IpIndex()
+        ip_index.add("2.2.2.2", owner("other", "ec2", "i-1", "proxy"))
+
+        names = {
+            cidr.arn: cidr.name
+            for cidr in get_external_cidrs(
+                account, config, {region.arn: region_index}, ip_index
+            )
+        }
+        assert_equal("other", names["2.2.2.2/28"])
+        assert_equal("1.1.1.1/32", names["1.1.1.1/32"])
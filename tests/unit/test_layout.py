@@ -0,0 +1,61 @@
+import json
+import random
+import unittest
+from nose.tools import assert_equal, assert_true, assert_false
+
+from commands.prepare import build_data_structure
+from shared.layout import add_positions, NODE_SIZE
+
+
+def assert_no_overlaps(elements):
+    positions = [e["position"] for e in elements if "position" in e]
+    for i, first in enumerate(positions):
+        for second in positions[i + 1 :]:
+            # Rounding can bring blocks that touch a pixel closer
+            assert_true(
+                abs(first["x"] - second["x"]) >= NODE_SIZE - 1
+                or abs(first["y"] - second["y"]) >= NODE_SIZE - 1
+            )
+
+
+class TestLayout(unittest.TestCase):
+    def test_prepare(self):
+        json_blob = {"id": 111111111111, "name": "demo"}
+        config = {
+            "accounts": [{"id": 123456789012, "name": "demo"}],
+            "cidrs": {"1.1.1.1/32": {"name": "SF Office"}},
+        }
+        outputfilter = {"internal_edges": True, "azs": True, "mute": True}
+        elements = add_positions(build_data_structure(json_blob, config, outputfilter))
+
+        parents = set(e["data"].get("parent") for e in elements)
+        for element in elements:
+            data = element["data"]
+            if data["type"] in ["edge", "security_groups", "node_data"]:
+                assert_false("position" in element)
+            elif data["id"] in parents:
+                # Compound nodes are placed around their children
+                assert_false("position" in element)
+            else:
+                assert_true("position" in element)
+        assert_no_overlaps(elements)
+
+        # The same graph is always laid out the same way
+        again = add_positions(build_data_structure(json_blob, config, outputfilter))
+        assert_equal(json.dumps(elements), json.dumps(again))
+
+    def test_graph(self):
+        random.seed(0)
+        elements = [{"data": {"id": str(i), "type": "account"}} for i in range(100)]
+        for _ in range(150):
+            elements.append(
+                {
+                    "data": {
+                        "source": str(random.randrange(10)),
+                        "target": str(random.randrange(100)),
+                        "type": "edge",
+                    }
+                }
+            )
+        add_positions(elements)
+        assert_no_overlaps(elements)
@@ -0,0 +1,75 @@
+import json
+import unittest
+from nose.tools import assert_equal, assert_true, assert_false
+
+from commands.prepare import build_data_structure
+from shared.level_of_detail import LevelOfDetail, CONTAINER_TYPES
+
+
+class TestLevelOfDetail(unittest.TestCase):
+    def setUp(self):
+        json_blob = {"id": 111111111111, "name": "demo"}
+        config = {
+            "accounts": [{"id": 123456789012, "name": "demo"}],
+            "cidrs": {"1.1.1.1/32": {"name": "SF Office"}},
+        }
+        outputfilter = {"internal_edges": True, "azs": True, "mute": True}
+        self.elements = build_data_structure(json_blob, config, outputfilter)
+        self.original = json.dumps(self.elements)
+
+    def get_graph(self, max_nodes, max_edges):
+        graph = LevelOfDetail(self.elements)
+        graph.reduce(max_nodes, max_edges)
+        return graph, list(graph.elements())
+
+    def test_within_budget(self):
+        graph, elements = self.get_graph(1000, 1000)
+        assert_equal(self.elements, elements)
+
+    def test_reduce(self):
+        # The nodes in subnets and VPCs
+        resources = set()
+        for element in self.elements:
+            data = element["data"]
+            if "parent" in data and data["type"] not in CONTAINER_TYPES:
+                resources.add(data["id"])
+        original_edges = [e for e in self.elements if e["data"]["type"] == "edge"]
+
+        graph, elements = self.get_graph(20, 15)
+        assert_true(graph.fits(20, 15))
+        # The input is not changed
+        assert_equal(self.original, json.dumps(self.elements))
+
+        # Every resource is either still there, or in a summary
+        ids = set()
+        summarized = set()
+        for element in elements:
+            data = element["data"]
+            if data["type"] == "summary":
+                for member in data["node_data"]["members"]:
+                    summarized.add(member["id"])
+            elif data["type"] != "edge":
+                ids.add(data["id"])
+        assert_true(len(summarized) > 0)
+        assert_false(ids & summarized)
+        assert_equal(resources, (ids & resources) | summarized)
+
+        # Every edge is between remaining nodes, and stands for some of the originals
+        edges = [e["data"] for e in elements if e["data"]["type"] == "edge"]
+        ids |= set(e["data"]["id"] for e in elements if e["data"]["type"] == "summary")
+        for edge in edges:
+            assert_true(edge["source"] in ids)
+            assert_true(edge["target"] in ids)
+        assert_true(
+            sum(edge.get("edge_count", 1) for edge in edges) <= len(original_edges)
+        )
+
+    def test_collapse_vpcs(self):
+        graph, elements = self.get_graph(8, 5)
+        types = [e["data"]["type"] for e in elements]
+        assert_false("subnet" in types)
+        assert_true("summary" in types)
+        vpcs = [e["data"]["id"] for e in elements if e["data"]["type"] == "vpc"]
+        for element in elements:
+            if element["data"]["type"] == "summary":
+                assert_true(element["data"]["parent"] in vpcs)
@@ -0,0 +1,76 @@
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from nose.tools import assert_equal
+
+from commands.mapdiff import mapdiff
+from shared.map_diff import CanonicalMap, diff_maps
+from shared.snapshots import SnapshotStore
+
+
+def canonical_map(nodes, edges, public):
+    result = CanonicalMap()
+    result.nodes = nodes
+    result.edges = edges
+    result.public = public
+    return result
+
+
+class TestMapDiff(unittest.TestCase):
+    def test_diff_maps(self):
+        old = canonical_map(
+            {"vpc": "vpc", "web": "ec2", "db": "rds", "0.0.0.0/0": "cloud"},
+            {("web", "db"): "a", ("0.0.0.0/0", "web"): "b"},
+            {"web": "443"},
+        )
+        new = canonical_map(
+            {"vpc": "vpc", "web": "ec2", "lb": "elb", "0.0.0.0/0": "cloud"},
+            {("lb", "web"): "c", ("0.0.0.0/0", "web"): "d", ("0.0.0.0/0", "lb"): "e"},
+            {"web": "22,443", "lb": "80"},
+        )
+
+        diff = diff_maps(old, new)
+        assert_equal([{"id": "lb", "type": "elb"}], diff["nodes"]["added"])
+        assert_equal([{"id": "db", "type": "rds"}], diff["nodes"]["removed"])
+        assert_equal(
+            [
+                {"source": "0.0.0.0/0", "target": "lb"},
+                {"source": "lb", "target": "web"},
+            ],
+            diff["edges"]["added"],
+        )
+        assert_equal([{"source": "web", "target": "db"}], diff["edges"]["removed"])
+        assert_equal(
+            [{"source": "0.0.0.0/0", "target": "web"}], diff["edges"]["changed"]
+        )
+        assert_equal([{"id": "lb", "ports": "80"}], diff["public"]["added"])
+        assert_equal(
+            [{"id": "web", "old_ports": "443", "ports": "22,443"}],
+            diff["public"]["changed"],
+        )
+        assert_equal(2, diff["summary"]["edges added"])
+        assert_equal(0, diff["summary"]["public removed"])
+
+    def test_snapshot(self):
+        accounts = [{"id": "123456789012", "name": "demo"}]
+        config = {"cidrs": {"1.1.1.1/32": {"name": "SF Office"}}}
+        directory = tempfile.mkdtemp()
+        try:
+            store = SnapshotStore(directory + "/snapshots")
+            store.store_account("demo", "2019-05-07")
+            cache_dir = directory + "/cache"
+
+            report = mapdiff(
+                accounts, config, "2019-05-07", "account-data", store, cache_dir
+            )
+            assert_equal({0}, set(report["demo"]["summary"].values()))
+
+            # The maps are read from the cache when the collected data is unchanged
+            with patch("shared.map_diff.build_canonical_map", side_effect=Exception):
+                report = mapdiff(
+                    accounts, config, "latest", "account-data", store, cache_dir
+                )
+            assert_equal({0}, set(report["demo"]["summary"].values()))
+        finally:
+            shutil.rmtree(directory)
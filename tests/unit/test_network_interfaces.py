@@ -0,0 +1,217 @@
+import copy
+import unittest
+from mock import patch
+from nose.tools import assert_equal
+
+from commands.prepare import (
+    build_region,
+    get_resource_nodes,
+    get_eni_resource_nodes,
+    get_lambda_functions,
+    get_rds_instances,
+    query_aws,
+)
+from shared.network_interfaces import get_interface_owner
+from shared.nodes import Account
+
+
+def interface(eni_id, description, subnet_id, group_ids, **fields):
+    return dict(
+        {
+            "NetworkInterfaceId": eni_id,
+            "Description": description,
+            "InterfaceType": "interface",
+            "Status": "in-use",
+            "RequesterManaged": True,
+            "VpcId": "vpc-12345678",
+            "SubnetId": subnet_id,
+            "Groups": [{"GroupId": group_id} for group_id in group_ids],
+            "PrivateIpAddress": "10.0.0.1",
+            "PrivateIpAddresses": [{"PrivateIpAddress": "10.0.0.1"}],
+            "TagSet": [],
+        },
+        **fields
+    )
+
+
+def instance_interface(eni_id, instance_id, subnet_id, group_id):
+    return interface(
+        eni_id,
+        "",
+        subnet_id,
+        [group_id],
+        RequesterManaged=False,
+        Attachment={"InstanceId": instance_id},
+    )
+
+
+# Interfaces for the resources of the demo account
+INTERFACES = [
+    instance_interface(
+        "eni-1", "i-00000000000000000", "subnet-00000001", "sg-00000002"
+    ),
+    instance_interface(
+        "eni-2", "i-00000000000000001", "subnet-00000003", "sg-00000004"
+    ),
+    instance_interface(
+        "eni-3", "i-00000000000000002", "subnet-00000004", "sg-00000004"
+    ),
+    interface("eni-4", "RDSNetworkInterface", "subnet-00000003", ["sg-00000005"]),
+    interface("eni-5", "ELB weblb", "subnet-00000001", ["sg-00000003"]),
+    interface("eni-6", "ELB weblb", "subnet-00000002", ["sg-00000003"]),
+    interface(
+        "eni-7", "ELB app/webalb/0123456789abcdef", "subnet-00000002", ["sg-00000003"]
+    ),
+    interface(
+        "eni-8",
+        "VPC Endpoint Interface vpce-00000000000000002",
+        "subnet-00000003",
+        ["sg-00000006"],
+        InterfaceType="vpc_endpoint",
+    ),
+    interface(
+        "eni-9",
+        "arn:aws:ecs:us-east-1:123456789012:attachment/ed8fed01-82d0-4bf6-86cf-fe3115c23ab8",
+        "subnet-00000001",
+        ["sg-00000008"],
+    ),
+    interface(
+        "eni-10",
+        "AWS Lambda VPC ENI-invpclambda-0f3e6c1a-8d8b-4b3c-9f2a-2d1e5c4b3a21",
+        "subnet-00000003",
+        ["sg-09920178"],
+        InterfaceType="lambda",
+    ),
+    interface("eni-11", "RedshiftNetworkInterface", "subnet-00000001", ["sg-00000002"]),
+    interface("eni-12", "ES myvpcdomain", "subnet-00000003", ["sg-00000007"]),
+    # Resources that prepare has no node type for
+    interface(
+        "eni-13",
+        "Interface for NAT Gateway nat-0123456789abcdef0",
+        "subnet-00000001",
+        [],
+        InterfaceType="nat_gateway",
+    ),
+    interface("eni-14", "unattached", "subnet-00000001", [], Status="available"),
+]
+
+
+class TestNetworkInterfaces(unittest.TestCase):
+    def test_get_interface_owner(self):
+        assert_equal(
+            [
+                ("ec2", "i-00000000000000000"),
+                ("ec2", "i-00000000000000001"),
+                ("ec2", "i-00000000000000002"),
+                ("rds", None),
+                ("elb", "weblb"),
+                ("elb", "weblb"),
+                ("elbv2", "webalb"),
+                ("vpc_endpoint", "vpce-00000000000000002"),
+                ("ecs", "ed8fed01-82d0-4bf6-86cf-fe3115c23ab8"),
+                ("lambda", "invpclambda"),
+                ("redshift", None),
+                ("elasticsearch", "myvpcdomain"),
+                ("network_interface", "eni-13"),
+                None,
+            ],
+            [get_interface_owner(i) for i in INTERFACES],
+        )
+
+    def test_get_eni_resource_nodes(self):
+        account = Account(None, {"id": "123456789012", "name": "demo"})
+        region, _, _, _ = build_region(account, {"RegionName": "us-east-1"}, {})
+        outputfilter = {"collapse_asgs": True, "read_replicas": True}
+        expected = get_resource_nodes(region, outputfilter)
+
+        def query(account, query, region=None):
+            if query == "ec2-describe-network-interfaces":
+                return {"NetworkInterfaces": INTERFACES}
+            return query_aws(account, query, region)
+
+        with patch("commands.prepare.query_aws", side_effect=query):
+            nodes = get_eni_resource_nodes(region, outputfilter)
+
+        # The same resources are found, and the NAT gateway
+        nat = "arn:aws:ec2:us-east-1:123456789012:network-interface/eni-13"
+        assert_equal(sorted(list(expected) + [nat]), sorted(nodes))
+        for arn, node in expected.items():
+            assert_equal(node.node_type, nodes[arn].node_type)
+            assert_equal(node.json, nodes[arn].json)
+        assert_equal("network_interface", nodes[nat].node_type)
+        assert_equal(["subnet-00000001"], nodes[nat].subnets)
+        assert_equal(["10.0.0.1"], nodes[nat].ips)
+
+    def test_get_eni_resource_nodes_demo(self):
+        # The interfaces collected for the demo account find the same resources as
+        # --discovery services
+        account = Account(None, {"id": "123456789012", "name": "demo"})
+        region, _, _, _ = build_region(account, {"RegionName": "us-east-1"}, {})
+        outputfilter = {"collapse_asgs": True, "read_replicas": True}
+        expected = get_resource_nodes(region, outputfilter)
+        nodes = get_eni_resource_nodes(region, outputfilter)
+
+        assert_equal(sorted(expected), sorted(nodes))
+        for arn, node in expected.items():
+            assert_equal(node.node_type, nodes[arn].node_type)
+
+    def test_get_eni_resource_nodes_shared_config(self):
+        # Resources in the same subnets and security groups are told apart by what
+        # their interfaces say, rather than all being found for each interface
+        account = Account(None, {"id": "123456789012", "name": "demo"})
+        region, _, _, _ = build_region(account, {"RegionName": "us-east-1"}, {})
+
+        def lambda_functions(region):
+            functions = get_lambda_functions(region)
+            function = copy.deepcopy(functions[0])
+            function["FunctionName"] = "othervpclambda"
+            function["FunctionArn"] = function["FunctionArn"].replace(
+                "invpclambda", "othervpclambda"
+            )
+            return functions + [function]
+
+        def rds_instances(region):
+            instances = get_rds_instances(region)
+            instance = copy.deepcopy(instances[0])
+            instance["DBInstanceIdentifier"] = "otherdatabase"
+            instance["DBInstanceArn"] = instance["DBInstanceArn"].replace(
+                "database", "otherdatabase"
+            )
+            return instances + [instance]
+
+        with patch(
+            "commands.prepare.get_lambda_functions", side_effect=lambda_functions
+        ), patch("commands.prepare.get_rds_instances", side_effect=rds_instances):
+            nodes = get_eni_resource_nodes(
+                region, {"collapse_asgs": True, "read_replicas": True}
+            )
+
+        assert_equal(
+            ["invpclambda"],
+            [n.name for n in nodes.values() if n.node_type == "lambda"],
+        )
+        assert_equal(1, len([n for n in nodes.values() if n.node_type == "rds"]))
+
+    def test_get_eni_resource_nodes_tags(self):
+        # Resources found from their interfaces are kept by the tags of the interface
+        account = Account(None, {"id": "123456789012", "name": "demo"})
+        interfaces = copy.deepcopy(INTERFACES)
+        interfaces[12]["TagSet"] = [{"Key": "Team", "Value": "net"}]
+
+        def query(account, query, region=None):
+            if query == "ec2-describe-network-interfaces":
+                return {"NetworkInterfaces": interfaces}
+            return query_aws(account, query, region)
+
+        outputfilter = {"discovery": "eni", "tags": ["Team=net"]}
+        with patch("commands.prepare.query_aws", side_effect=query), patch(
+            "shared.tag_index.query_aws", side_effect=query
+        ):
+            region, _, _, _ = build_region(
+                account, {"RegionName": "us-east-1"}, outputfilter
+            )
+
+        assert_equal(
+            ["arn:aws:ec2:us-east-1:123456789012:network-interface/eni-13"],
+            [node.aws_arn for node in region.leaves],
+        )
@@ -23,10 +23,20 @@ USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 ---------------------------------------------------------------------------
 """
 
+import copy
 import unittest
+from mock import patch
 from nose.tools import assert_equal, assert_true, assert_false
 
-from shared.nodes import truncate, get_name, is_public_ip, Account
+from shared.nodes import (
+    truncate,
+    get_name,
+    is_public_ip,
+    Account,
+    Region,
+    Cidr,
+    Elbv2,
+)
 
 
 class TestNodes(unittest.TestCase):
@@ -66,3 +76,51 @@ class TestNodes(unittest.TestCase):
             },
             account.cytoscape_data(),
         )
+
+    def test_leaf_cache(self):
+        account = Account(None, {u"id": 111111111111, u"name": u"prod"})
+        region = Region(
+            account,
+            {"Endpoint": "ec2.us-east-1.amazonaws.com", "RegionName": "us-east-1"},
+        )
+        # Children added before their container is added are counted
+        first = Cidr("1.1.1.1/32")
+        region.addChild(first)
+        account.addChild(region)
+        assert_true(account.has_leaves)
+        assert_equal([first], account.leaves)
+
+        second = copy.copy(first)
+        second._local_id = "2.2.2.2/32"
+        region.addChild(second)
+        assert_equal(2, account.leaf_count)
+        assert_equal([first, second], account.leaves)
+
+        # Adding a child with the same id replaces it
+        third = copy.copy(first)
+        region.addChild(third)
+        assert_equal([third, second], account.leaves)
+
+        region.removeChild(third)
+        region.removeChild(second)
+        assert_false(region.has_leaves)
+        assert_equal([], account.leaves)
+        assert_false(hasattr(first, "__dict__"))
+
+    def test_elbv2_tags(self):
+        account = Account(None, {"id": 111111111111, "name": "prod"})
+        region = Region(account, {"RegionName": "us-east-1"})
+        arn = (
+            "arn:aws:elasticloadbalancing:us-east-1:111111111111:loadbalancer/app/web/1"
+        )
+        elb = Elbv2(region, {"LoadBalancerName": "web", "LoadBalancerArn": arn})
+        tags = [{"Key": "Env", "Value": "prod"}]
+        # The tags are collected in a file for each load balancer, named by its ARN
+        with patch(
+            "shared.nodes.get_parameter_file",
+            return_value={"TagDescriptions": [{"ResourceArn": arn, "Tags": tags}]},
+        ) as mock_get_parameter_file:
+            assert_equal(tags, elb.tags)
+        mock_get_parameter_file.assert_called_once_with(
+            region, "elbv2", "describe-tags", arn
+        )
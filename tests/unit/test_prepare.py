@@ -23,13 +23,37 @@ USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 ---------------------------------------------------------------------------
 """
 
+import json
+import os
+import shutil
+import tempfile
 import unittest
+from concurrent.futures import ProcessPoolExecutor
 from mock import patch
 from nose.tools import assert_equal, assert_true, assert_false
 import pyjq
 
-from commands.prepare import is_external_cidr, get_ec2s, get_vpcs, build_data_structure
-from shared.nodes import Account, Region, Subnet, Vpc
+import random
+from netaddr import IPAddress, IPNetwork
+
+from commands.prepare import (
+    is_external_cidr,
+    get_ec2s,
+    get_vpcs,
+    build_data_structure,
+    build_region,
+    LeafIpIndex,
+    NamedCidrIndex,
+    RegionIndex,
+    get_subnets,
+    get_sgs,
+    build_accounts,
+    iter_accounts_elements,
+    get_peering_edge,
+    get_ingress_sg_node,
+)
+from shared.nodes import Account, Region, Az, Subnet, Vpc
+from shared.query import set_data_archive
 
 
 class TestPrepare(unittest.TestCase):
@@ -39,6 +63,376 @@ class TestPrepare(unittest.TestCase):
         assert_true(is_external_cidr("1.1.1.1/32"))
         assert_false(is_external_cidr("10.0.0.0/32"))
 
+    def test_leaf_ip_index(self):
+        class FakeLeaf(object):
+            def __init__(self, ips):
+                self.ips = ips
+
+        random.seed(0)
+        leaves = []
+        for _ in range(200):
+            ips = ["10.0.{}.{}".format(random.randrange(4), random.randrange(256))]
+            if random.random() < 0.3:
+                ips.append("10.1.0.{}".format(random.randrange(256)))
+            if random.random() < 0.3:
+                ips.append("2600:1f18::{:x}".format(random.randrange(65536)))
+            leaves.append(FakeLeaf(ips))
+        leaves.append(FakeLeaf([]))
+        index = LeafIpIndex(leaves)
+
+        for cidr in [
+            "10.0.0.0/8",
+            "10.0.1.0/24",
+            "10.0.2.128/25",
+            "10.1.0.7/32",
+            "192.168.0.0/16",
+            "2600:1f18::/64",
+            "2600:1f18::8000/113",
+            "0.0.0.0/0",
+        ]:
+            expected = []
+            for leaf in leaves:
+                count = len(
+                    [ip for ip in leaf.ips if IPAddress(ip) in IPNetwork(cidr)]
+                )
+                if count > 0:
+                    expected.append((leaf, count))
+            assert_equal(expected, index.match(cidr))
+
+    def test_named_cidr_index(self):
+        named_cidrs = [
+            "10.0.0.0/8",
+            "10.1.0.0/16",
+            "10.1.2.0/24",
+            "10.1.2.3/32",
+            "10.1.0.0/16",
+            "10.1.0.5/16",
+            "2600:1f18::/32",
+            "2600:1f18:aa::/48",
+        ]
+        index = NamedCidrIndex(named_cidrs)
+
+        for cidr in [
+            "10.1.2.3/32",
+            "10.1.2.4/32",
+            "10.1.3.0/24",
+            "10.2.0.0/16",
+            "10.0.0.0/7",
+            "11.0.0.0/8",
+            "0.0.0.0/0",
+            "2600:1f18:aa:1::/64",
+            "2600:1f18:bb::/48",
+            "2600:1f19::/32",
+        ]:
+            matches = [
+                named_cidr
+                for named_cidr in named_cidrs
+                if IPNetwork(cidr) in IPNetwork(named_cidr)
+            ]
+            expected = None
+            if len(matches) > 0:
+                expected = sorted(matches, key=lambda c: IPNetwork(c).size)[0]
+            assert_equal(expected, index.longest_match(cidr))
+
+    def test_sg_edges(self):
+        def get_edges(cytoscape_json):
+            edges = set()
+            for node in cytoscape_json:
+                data = node["data"]
+                if data["type"] != "edge":
+                    continue
+                if "source_members" in data:
+                    for source in data["source_members"]:
+                        for target in data["target_members"]:
+                            if source != target:
+                                edges.add((source, target))
+                else:
+                    edges.add((data["source"], data["target"]))
+            return edges
+
+        json_blob = {u"id": 111111111111, u"name": u"demo"}
+        config = {
+            "accounts": [{"id": 123456789012, "name": "demo"}],
+            "cidrs": {"1.1.1.1/32": {"name": "SF Office"}},
+        }
+        outputfilter = {
+            "internal_edges": True,
+            "read_replicas": True,
+            "inter_rds_edges": False,
+            "azs": False,
+            "collapse_by_tag": False,
+            "collapse_asgs": False,
+        }
+        cytoscape_json = build_data_structure(json_blob, config, outputfilter)
+        outputfilter["sg_edges"] = True
+        sg_cytoscape_json = build_data_structure(json_blob, config, outputfilter)
+
+        # The aggregate edges stand for the same connections as the resource edges
+        assert_true(
+            len(pyjq.all('.[].data|select(.type == "edge")', sg_cytoscape_json))
+            < len(pyjq.all('.[].data|select(.type == "edge")', cytoscape_json))
+        )
+        assert_equal(get_edges(cytoscape_json), get_edges(sg_cytoscape_json))
+        sg_nodes = pyjq.all(
+            '.[].data|select(.type == "security_group")', sg_cytoscape_json
+        )
+        assert_true(len(sg_nodes) > 0)
+
+    def test_edge_reasons(self):
+        json_blob = {u"id": 111111111111, u"name": u"demo"}
+        config = {"accounts": [{"id": 123456789012, "name": "demo"}], "cidrs": {}}
+        outputfilter = {"internal_edges": True, "azs": False}
+        cytoscape_json = build_data_structure(json_blob, config, outputfilter)
+
+        # Edges refer to security groups by id, and each is included once
+        security_groups = pyjq.first(
+            '.[].data|select(.type == "security_groups")|.node_data', cytoscape_json
+        )
+        reasons = pyjq.all(
+            '.[].data|select(.type == "edge")|.node_data[]|strings', cytoscape_json
+        )
+        assert_true(len(reasons) > 0)
+        assert_equal(set(reasons), set(security_groups))
+        for group_id, sg in security_groups.items():
+            assert_equal(group_id, sg["GroupId"])
+
+    def test_shared_node_data(self):
+        json_blob = {u"id": 111111111111, u"name": u"demo"}
+        config = {"accounts": [{"id": 123456789012, "name": "demo"}], "cidrs": {}}
+        outputfilter = {"internal_edges": True, "azs": False}
+        cytoscape_json = build_data_structure(json_blob, config, outputfilter)
+
+        # Resources in more than one subnet have their node_data written once
+        shared_node_data = {}
+        for node_data in pyjq.all(
+            '.[].data|select(.type == "node_data")|.node_data', cytoscape_json
+        ):
+            shared_node_data.update(node_data)
+        references = pyjq.all(
+            ".[].data|select(.node_data_ref)|.node_data_ref", cytoscape_json
+        )
+        assert_true(len(references) > len(shared_node_data))
+        assert_equal(set(references), set(shared_node_data))
+        rds = shared_node_data["arn:aws:rds:us-east-1:123456789012:db:securitymonkey"]
+        assert_equal("database", rds["DBInstanceIdentifier"])
+
+    def test_parallel_regions(self):
+        json_blob = {u"id": 111111111111, u"name": u"demo"}
+        config = {
+            "accounts": [{"id": 123456789012, "name": "demo"}],
+            "cidrs": {"1.1.1.1/32": {"name": "SF Office"}},
+        }
+        outputfilter = {"internal_edges": True, "azs": True, "mute": True}
+
+        # The demo account, with its region copied as us-west-2, so there are
+        # two regions to build
+        temp_dir = tempfile.mkdtemp()
+        try:
+            account_dir = os.path.join(temp_dir, "account-data", "demo")
+            shutil.copytree("account-data/demo", account_dir)
+            shutil.copytree(
+                os.path.join(account_dir, "us-east-1"),
+                os.path.join(account_dir, "us-west-2"),
+            )
+            regions_path = os.path.join(account_dir, "describe-regions.json")
+            with open(regions_path) as f:
+                regions = json.load(f)
+            regions["Regions"].append(
+                {"Endpoint": "ec2.us-west-2.amazonaws.com", "RegionName": "us-west-2"}
+            )
+            with open(regions_path, "w") as f:
+                json.dump(regions, f)
+            set_data_archive(
+                shutil.make_archive(
+                    os.path.join(temp_dir, "data"),
+                    "zip",
+                    root_dir=temp_dir,
+                    base_dir="account-data/demo",
+                )
+            )
+
+            serial = build_data_structure(json_blob, config, outputfilter)
+            outputfilter["jobs"] = 2
+            with patch(
+                "commands.prepare.ProcessPoolExecutor", wraps=ProcessPoolExecutor
+            ) as executor:
+                parallel = build_data_structure(json_blob, config, outputfilter)
+            assert_true(executor.called)
+        finally:
+            set_data_archive(None)
+            shutil.rmtree(temp_dir)
+
+        ids = [element["data"].get("id") for element in serial]
+        assert_true("arn:aws::us-west-2:111111111111:" in ids)
+        assert_equal(json.dumps(serial), json.dumps(parallel))
+
+    def test_accounts(self):
+        accounts = [
+            {"id": "111111111111", "name": "demo"},
+            {"id": "222222222222", "name": "demo"},
+        ]
+        config = {
+            "accounts": accounts,
+            "cidrs": {"1.1.1.1/32": {"name": "SF Office"}},
+        }
+        outputfilter = {"internal_edges": True, "azs": True, "mute": True}
+        single = build_data_structure(accounts[0], config, outputfilter)
+
+        peering = {
+            "VpcPeeringConnectionId": "pcx-12345678",
+            "RequesterVpcInfo": {"OwnerId": "111111111111", "VpcId": "vpc-12345678"},
+            "AccepterVpcInfo": {
+                "OwnerId": "222222222222",
+                "VpcId": "vpc-12345678",
+                "Region": "us-east-1",
+            },
+        }
+        edge = get_peering_edge(peering, "us-east-1")
+        assert_equal(
+            "arn:aws::us-east-1:111111111111:vpc/vpc-12345678", edge["data"]["source"]
+        )
+        assert_equal(
+            "arn:aws::us-east-1:222222222222:vpc/vpc-12345678", edge["data"]["target"]
+        )
+        assert_equal("vpc", edge["classes"])
+        # The other account is not on the map
+        missing = get_peering_edge(
+            dict(
+                peering,
+                AccepterVpcInfo={"OwnerId": "333333333333", "VpcId": "vpc-12345678"},
+            ),
+            "us-east-1",
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths, peering_edges = build_accounts(
+                accounts, config, outputfilter, directory
+            )
+            assert_equal({}, peering_edges)
+            peering_edges = {"pcx-12345678": edge, "pcx-87654321": missing}
+            elements = list(iter_accounts_elements(paths, peering_edges))
+
+        ids = [e["data"]["id"] for e in elements if e["data"]["type"] != "edge"]
+        assert_equal(len(ids), len(set(ids)))
+        # The CIDRs are shared by the accounts, and the rest is in both
+        cidrs = [
+            e["data"]["id"] for e in single if e["data"]["type"] in ["ip", "cloud"]
+        ]
+        assert_true(len(cidrs) > 0)
+        for cidr in cidrs:
+            assert_true(cidr in ids)
+        single_nodes = [e for e in single if e["data"]["type"] != "edge"]
+        assert_true(len(ids) > 1.5 * len(single_nodes))
+        # The nodes come before the edges
+        types = [e["data"]["type"] == "edge" for e in elements]
+        assert_equal(sorted(types), types)
+
+        edges = [e for e in elements if e["data"]["type"] == "edge"]
+        single_edges = [e for e in single if e["data"]["type"] == "edge"]
+        assert_equal(2 * len(single_edges) + 1, len(edges))
+        assert_true(edge in edges)
+        assert_false(missing in edges)
+
+    def test_incremental(self):
+        json_blob = {u"id": 111111111111, u"name": u"demo"}
+        config = {
+            "accounts": [{"id": 123456789012, "name": "demo"}],
+            "cidrs": {"1.1.1.1/32": {"name": "SF Office"}},
+        }
+        outputfilter = {"internal_edges": True, "azs": True, "mute": True}
+        expected = json.dumps(build_data_structure(json_blob, config, outputfilter))
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            outputfilter["cache_dir"] = cache_dir
+            assert_equal(
+                expected,
+                json.dumps(build_data_structure(json_blob, config, outputfilter)),
+            )
+
+            # Nothing changed, so nothing is built again
+            with patch(
+                "commands.prepare.build_region", side_effect=Exception
+            ), patch(
+                "commands.prepare.iter_connection_elements", side_effect=Exception
+            ), patch(
+                "commands.prepare.log"
+            ) as mock_log:
+                assert_equal(
+                    expected,
+                    json.dumps(build_data_structure(json_blob, config, outputfilter)),
+                )
+                messages = [args[0] for args, _ in mock_log.call_args_list]
+                assert_equal(
+                    [],
+                    [m for m in messages if "nodes built in region" in m],
+                )
+                assert_equal(
+                    1,
+                    len([m for m in messages if "nodes loaded in region" in m]),
+                )
+
+            # Only the connections depend on the config
+            config["cidrs"] = {}
+            with patch("commands.prepare.build_region", side_effect=Exception):
+                build_data_structure(json_blob, config, outputfilter)
+
+            # A changed file rebuilds its region
+            with patch(
+                "shared.prepare_cache.get_file_hash", return_value="changed"
+            ), patch(
+                "commands.prepare.build_region", wraps=build_region
+            ) as mock_build_region, patch(
+                "commands.prepare.log"
+            ) as mock_log:
+                build_data_structure(json_blob, config, outputfilter)
+                assert_equal(1, mock_build_region.call_count)
+                messages = [args[0] for args, _ in mock_log.call_args_list]
+                assert_equal(
+                    1,
+                    len([m for m in messages if "nodes built in region" in m]),
+                )
+                assert_equal(
+                    [],
+                    [m for m in messages if "nodes loaded in region" in m],
+                )
+
+    def test_ingress_sg_node(self):
+        account = Account(None, {"id": "111111111111", "name": "demo"})
+        region, region_index, _, _ = build_region(
+            account, {"RegionName": "us-east-1"}, {}
+        )
+        vpc = region_index.vpc_nodes_by_id["vpc-12345678"]
+
+        # A group of the region is in its own VPC
+        sg = get_ingress_sg_node({"GroupId": "sg-00000002"}, vpc, region_index)
+        assert_equal(vpc.arn, sg.cytoscape_data()["data"]["parent"])
+
+        # A group of another account is in the region, with that account's id
+        sg = get_ingress_sg_node(
+            {"GroupId": "sg-99999999", "UserId": "222222222222"}, vpc, region_index
+        )
+        assert_equal(region.arn, sg.cytoscape_data()["data"]["parent"])
+        assert_equal(
+            "arn:aws::us-east-1:222222222222:security-group/sg-99999999", sg.arn
+        )
+
+    def test_region_index(self):
+        json_blob = {u"id": 111111111111, u"name": u"demo"}
+        account = Account(None, json_blob)
+        region = Region(
+            account,
+            {"Endpoint": "ec2.us-east-1.amazonaws.com", "RegionName": "us-east-1"},
+        )
+        region_index = RegionIndex(region)
+        vpc = Vpc(region, get_vpcs(region, {})[0])
+        assert_equal(get_sgs(vpc), region_index.get_sgs(vpc.local_id))
+        for az_json in region_index.azs:
+            az = Az(vpc, az_json)
+            assert_equal(
+                get_subnets(az), region_index.get_subnets(vpc.local_id, az.local_id)
+            )
+        assert_equal([], region_index.get_sgs("vpc-unknown"))
+
     def test_get_vpcs(self):
         # This actually uses the demo data files provided
         json_blob = {u"id": 111111111111, u"name": u"demo"}
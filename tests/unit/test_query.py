@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from mock import patch
+from nose.tools import assert_equal, assert_true, assert_false
+
+from shared import query
+from shared.query import (
+    build_manifest,
+    get_file_size,
+    get_parameter_file,
+    get_parameter_files,
+    get_loaded_file,
+    list_parameter_files,
+    load_json,
+    query_aws,
+    set_data_archive,
+    set_intern_strings,
+)
+from shared.nodes import Account, Region
+
+
+class TestQuery(unittest.TestCase):
+    def setUp(self):
+        self.account = Account(None, {"id": 111111111111, "name": "demo"})
+        self.region = Region(
+            self.account,
+            {"Endpoint": "ec2.us-east-1.amazonaws.com", "RegionName": "us-east-1"},
+        )
+
+    def tearDown(self):
+        set_data_archive(None)
+        set_intern_strings(False)
+
+    def test_build_manifest(self):
+        manifest = build_manifest("demo")
+        entry = manifest.files["us-east-1/ec2-describe-vpcs.json"]
+        assert_true(entry["size"] > 0)
+        assert_equal(64, len(entry["sha256"]))
+        assert_true("s3-get-bucket-policy" not in manifest.files)
+        assert_true(len(manifest.listdir("us-east-1/s3-get-bucket-policy")) > 0)
+
+    def test_manifest_lookups_match_filesystem(self):
+        query._manifests["demo"] = None
+        vpcs = query_aws(self.account, "ec2-describe-vpcs", self.region)
+        policies = list_parameter_files("demo", "us-east-1", "s3", "get-bucket-policy")
+        policy = get_parameter_file(
+            self.region, "s3", "get-bucket-policy", "cloudmapper_demo"
+        )
+
+        query._manifests["demo"] = build_manifest("demo")
+        with patch("os.path.isfile") as mock_isfile:
+            assert_equal(None, get_file_size("demo", "us-east-1/does-not-exist.json"))
+            assert_equal(
+                None, get_parameter_file(self.region, "lambda", "get-policy", "missing")
+            )
+            assert_equal({}, query_aws(self.account, "does-not-exist", self.region))
+            assert_false(mock_isfile.called)
+
+        assert_equal(vpcs, query_aws(self.account, "ec2-describe-vpcs", self.region))
+        assert_equal(
+            sorted(policies),
+            sorted(
+                list_parameter_files("demo", "us-east-1", "s3", "get-bucket-policy")
+            ),
+        )
+        assert_equal(
+            policy,
+            get_parameter_file(
+                self.region, "s3", "get-bucket-policy", "cloudmapper_demo"
+            ),
+        )
+
+    def test_get_parameter_files(self):
+        files = get_parameter_files(
+            self.region, "s3", "get-bucket-policy", ["cloudmapper_demo", "missing"]
+        )
+        assert_equal(
+            get_parameter_file(
+                self.region, "s3", "get-bucket-policy", "cloudmapper_demo"
+            ),
+            files["cloudmapper_demo"],
+        )
+        assert_equal(None, files["missing"])
+
+        # Without parameters, the whole directory is loaded
+        files = get_parameter_files(self.region, "s3", "get-bucket-policy")
+        assert_equal(["cloudmapper_demo"], list(files))
+
+    def test_get_parameter_files_errors(self):
+        def get_file(region, service, function, parameter_value):
+            if parameter_value == "bad":
+                raise ValueError("Unreadable file")
+            return get_parameter_file(region, service, function, parameter_value)
+
+        # A file that can't be loaded only fails for its own parameter
+        with patch("shared.query.get_parameter_file", side_effect=get_file):
+            files = get_parameter_files(
+                self.region, "s3", "get-bucket-policy", ["bad", "cloudmapper_demo"]
+            )
+        assert_true(get_loaded_file(files, "cloudmapper_demo") is not None)
+        with self.assertRaises(ValueError):
+            get_loaded_file(files, "bad")
+
+    def test_data_archive(self):
+        vpcs = query_aws(self.account, "ec2-describe-vpcs", self.region)
+        policy = get_parameter_file(
+            self.region, "s3", "get-bucket-policy", "cloudmapper_demo"
+        )
+        roles = get_parameter_files(self.region, "iam", "get-role")
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            for archive_format in ["zip", "tar"]:
+                archive = shutil.make_archive(
+                    os.path.join(temp_dir, "snapshot"),
+                    archive_format,
+                    root_dir=".",
+                    base_dir="account-data/demo",
+                )
+                set_data_archive(archive)
+                assert_equal(
+                    vpcs, query_aws(self.account, "ec2-describe-vpcs", self.region)
+                )
+                assert_equal(
+                    policy,
+                    get_parameter_file(
+                        self.region, "s3", "get-bucket-policy", "cloudmapper_demo"
+                    ),
+                )
+                assert_equal(
+                    ["cloudmapper_demo"],
+                    list_parameter_files(
+                        "demo", "us-east-1", "s3", "get-bucket-policy"
+                    ),
+                )
+                assert_equal({}, query_aws(self.account, "does-not-exist", self.region))
+
+                # Zip files are read by many threads, each with its own handle, and
+                # tar files by one
+                with patch(
+                    "shared.query.ThreadPoolExecutor", wraps=ThreadPoolExecutor
+                ) as mock_executor:
+                    assert_equal(
+                        roles, get_parameter_files(self.region, "iam", "get-role")
+                    )
+                _, kwargs = mock_executor.call_args
+                assert_equal(
+                    1 if archive_format == "tar" else len(roles),
+                    kwargs["max_workers"],
+                )
+                set_data_archive(None)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_intern_strings(self):
+        data = '{"GroupId": "sg-1234", "Tags": [{"Key": "Name"}], "Ids": ["sg-1234"]}'
+        set_intern_strings(True)
+        first = load_json(data.encode())
+        second = load_json(data)
+        assert_equal(
+            {"GroupId": "sg-1234", "Tags": [{"Key": "Name"}], "Ids": ["sg-1234"]}, first
+        )
+        assert_true(first["GroupId"] is second["GroupId"])
+        assert_true(first["Ids"][0] is second["GroupId"])
+        assert_true(list(first["Tags"][0])[0] is list(second["Tags"][0])[0])
+
+        vpcs = query_aws(self.account, "ec2-describe-vpcs", self.region)
+        set_intern_strings(False)
+        assert_equal(vpcs, query_aws(self.account, "ec2-describe-vpcs", self.region))
@@ -0,0 +1,112 @@
+import unittest
+from nose.tools import assert_equal, assert_true
+
+from shared.reachability import (
+    Reachability,
+    RuleIndex,
+    normalize_protocol,
+    parse_ports,
+    summarize,
+)
+
+
+class TestReachability(unittest.TestCase):
+    def test_rule_index(self):
+        sgs = [
+            {
+                "GroupId": "sg-1",
+                "IpPermissions": [
+                    {
+                        "IpProtocol": "tcp",
+                        "FromPort": 8000,
+                        "ToPort": 8080,
+                        "IpRanges": [{"CidrIp": "10.0.0.0/8"}],
+                        "UserIdGroupPairs": [{"GroupId": "sg-2"}],
+                    },
+                    {
+                        "IpProtocol": "6",
+                        "FromPort": 22,
+                        "ToPort": 22,
+                        "IpRanges": [{"CidrIp": "1.1.1.1/32"}],
+                    },
+                    {
+                        "IpProtocol": "icmp",
+                        "FromPort": -1,
+                        "ToPort": -1,
+                        "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
+                    },
+                ],
+            },
+            {
+                "GroupId": "sg-4",
+                "IpPermissions": [
+                    # Echo requests, of ICMP type 8 with any code
+                    {
+                        "IpProtocol": "icmp",
+                        "FromPort": 8,
+                        "ToPort": -1,
+                        "IpRanges": [{"CidrIp": "10.0.0.0/8"}],
+                    },
+                ],
+            },
+            {
+                "GroupId": "sg-2",
+                "IpPermissions": [
+                    {"IpProtocol": "-1", "Ipv6Ranges": [{"CidrIpv6": "::/0"}]}
+                ],
+            },
+        ]
+        index = RuleIndex(sgs)
+
+        def sources(group_id, protocol, ports):
+            return sorted(
+                rule.source
+                for rule in index.get_rules(
+                    group_id, normalize_protocol(protocol), parse_ports(ports)
+                )
+            )
+
+        assert_equal(["10.0.0.0/8", "sg-2"], sources("sg-1", "tcp", "8080"))
+        assert_equal(["1.1.1.1/32"], sources("sg-1", "tcp", "22"))
+        assert_equal(
+            ["1.1.1.1/32", "10.0.0.0/8", "sg-2"], sources("sg-1", "tcp", "1-9000")
+        )
+        assert_equal([], sources("sg-1", "tcp", "443"))
+        assert_equal([], sources("sg-1", "udp", "22"))
+        assert_equal(["0.0.0.0/0"], sources("sg-1", "icmp", None))
+        assert_equal(4, len(index.get_rules("sg-1")))
+        # Rules for all protocols match any protocol and port
+        assert_equal(["::/0"], sources("sg-2", "udp", "53"))
+        assert_equal([], sources("sg-3", "tcp", "22"))
+        # ICMP types and codes are not ports, so any port matches
+        assert_equal(["10.0.0.0/8"], sources("sg-4", "icmp", "443"))
+        assert_equal(["10.0.0.0/8"], sources("sg-4", "-1", "22"))
+        assert_equal([], sources("sg-4", "tcp", "8"))
+        assert_equal(
+            [(0, 65535)],
+            [(rule.from_port, rule.to_port) for rule in index.get_rules("sg-4")],
+        )
+
+    def test_demo_account(self):
+        reachability = Reachability({"id": 123456789012, "name": "demo"})
+
+        public = summarize(reachability.reachable_from("0.0.0.0/0"))
+        assert_equal(
+            ["myecs:3", "webalb", "weblb"],
+            sorted(result["target_name"] for result in public),
+        )
+        for result in public:
+            assert_equal("443", result["ports"])
+
+        sources = reachability.can_reach("database", "tcp", parse_ports("5432"))
+        assert_equal(
+            ["Web1", "Web2"],
+            sorted(
+                resource.name
+                for result in sources
+                for _, resource in reachability.find_resources(result["source"])
+            ),
+        )
+        assert_equal([], reachability.can_reach("database", "tcp", parse_ports("22")))
+        targets = reachability.reachable_from("Web1", "tcp", parse_ports("5432"))
+        assert_true("database" in [result["target_name"] for result in targets])
@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from nose.tools import assert_equal, assert_true, assert_false
+
+from commands.prepare import build_data_structure
+from shared.shards import split_shards, write_shards
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        json_blob = {"id": 111111111111, "name": "demo"}
+        config = {
+            "accounts": [{"id": 123456789012, "name": "demo"}],
+            "cidrs": {"1.1.1.1/32": {"name": "SF Office"}},
+        }
+        outputfilter = {"internal_edges": True, "azs": True, "mute": True}
+        self.elements = build_data_structure(json_blob, config, outputfilter)
+
+    def test_split_shards(self):
+        summary, shards = split_shards(self.elements)
+        vpcs = [e["data"] for e in summary if e["data"]["type"] == "vpc"]
+        assert_equal(len(vpcs), len(shards))
+        for vpc in vpcs:
+            assert_true(vpc["id"] in shards)
+            assert_equal(
+                vpc["shard"], "shards/us-east-1-{}.json".format(vpc["local_id"])
+            )
+
+        # Every node is in exactly one file
+        ids = [e["data"]["id"] for e in self.elements if e["data"]["type"] != "edge"]
+        split_ids = [
+            e["data"]["id"]
+            for e in summary + sum(shards.values(), [])
+            if e["data"]["type"] not in ["edge", "node_data"]
+        ]
+        assert_equal(
+            sorted(i for i in ids if not i.endswith("node_data")), sorted(split_ids)
+        )
+        for vpc_id, shard in shards.items():
+            for element in shard:
+                assert_false(element["data"].get("id", None) == vpc_id)
+
+        # Every edge is in the shards of its ends, or the summary
+        edges = [e["data"] for e in self.elements if e["data"]["type"] == "edge"]
+        summary_edges = [e["data"] for e in summary if e["data"]["type"] == "edge"]
+        summary_ids = set(e["data"]["id"] for e in summary if "id" in e["data"])
+        for edge in summary_edges:
+            assert_true(edge["source"] in summary_ids)
+            assert_true(edge["target"] in summary_ids)
+        inside = 0
+        for edge in edges:
+            if edge["source"] in summary_ids and edge["target"] in summary_ids:
+                continue
+            in_shards = [
+                vpc_id
+                for vpc_id, shard in shards.items()
+                if any(
+                    e["data"]["type"] == "edge"
+                    and e["data"]["source"] == edge["source"]
+                    and e["data"]["target"] == edge["target"]
+                    for e in shard
+                )
+            ]
+            assert_equal(len(in_shards), 1)
+            shard_edge = [
+                e["data"]
+                for e in shards[in_shards[0]]
+                if e["data"]["type"] == "edge"
+                and e["data"]["source"] == edge["source"]
+                and e["data"]["target"] == edge["target"]
+            ][0]
+            if shard_edge["source_owner"] == shard_edge["target_owner"]:
+                inside += 1
+        assert_equal(
+            len(edges) - inside,
+            sum(edge.get("edge_count", 1) for edge in summary_edges),
+        )
+
+    def test_write_shards(self):
+        directory = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(directory, "shards"))
+            # Shards of an older map are removed
+            with open(os.path.join(directory, "shards", "old.json"), "w") as f:
+                f.write("[]")
+            manifest = write_shards(self.elements, directory=directory)
+
+            assert_equal(
+                sorted(os.listdir(os.path.join(directory, "shards"))),
+                sorted(
+                    ["manifest.json"]
+                    + [shard["file"].split("/")[1] for shard in manifest["shards"]]
+                ),
+            )
+            with open(os.path.join(directory, "shards", "manifest.json")) as f:
+                assert_equal(manifest, json.load(f))
+            for shard in manifest["shards"]:
+                with open(os.path.join(directory, shard["file"])) as f:
+                    elements = json.load(f)
+                assert_equal(shard["nodes"] + shard["edges"], len(elements))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_split_accounts(self):
+        summary, shards = split_shards(self.elements, shard_type="account")
+        assert_equal(["arn:aws:::111111111111:"], list(shards))
+        account = [e["data"] for e in summary if e["data"]["type"] == "account"][0]
+        assert_equal("shards/111111111111.json", account["shard"])
+
+        # Only the nodes outside of the account, such as CIDRs, are left
+        for element in summary:
+            data = element["data"]
+            if data["type"] != "edge":
+                assert_true(data.get("parent", None) is None)
+        types = set(e["data"]["type"] for e in shards["arn:aws:::111111111111:"])
+        assert_true("vpc" in types)
+        assert_true("node_data" in types)
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+from nose.tools import assert_equal, assert_true, assert_false
+
+from shared.nodes import Account, Region
+from shared.query import query_aws, set_data_source
+from shared.snapshots import Snapshot, SnapshotStore, serialize
+
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = SnapshotStore(os.path.join(self.temp_dir, "store"))
+        self.account = Account(None, {"id": 111111111111, "name": "demo"})
+        self.region = Region(
+            self.account,
+            {"Endpoint": "ec2.us-east-1.amazonaws.com", "RegionName": "us-east-1"},
+        )
+
+    def tearDown(self):
+        set_data_source(None)
+        shutil.rmtree(self.temp_dir)
+
+    def count_blobs(self):
+        return sum(
+            len(files)
+            for _, _, files in os.walk(os.path.join(self.store.path, "blobs"))
+        )
+
+    def test_store_and_read(self):
+        vpcs = query_aws(self.account, "ec2-describe-vpcs", self.region)
+
+        self.store.store_account("demo", "2019-05-07T000000Z")
+        blob_count = self.count_blobs()
+        self.store.store_account("demo", "2019-05-08T000000Z")
+        # Unchanged files are not stored again
+        assert_equal(blob_count, self.count_blobs())
+        assert_equal(
+            ["2019-05-07T000000Z", "2019-05-08T000000Z"],
+            self.store.list_snapshots("demo"),
+        )
+        assert_equal(
+            "2019-05-07T000000Z", self.store.resolve_snapshot("demo", "2019-05-07")
+        )
+        assert_equal(
+            "2019-05-08T000000Z", self.store.resolve_snapshot("demo", "latest")
+        )
+
+        set_data_source(Snapshot(self.store, "2019-05-07"))
+        assert_equal(vpcs, query_aws(self.account, "ec2-describe-vpcs", self.region))
+        assert_equal({}, query_aws(self.account, "does-not-exist", self.region))
+
+    def test_prune_and_compact(self):
+        self.store.store_account("demo", "1")
+        self.store.store_account("demo", "2")
+        self.store.put_blob(b"unused")
+
+        assert_equal(["1"], self.store.prune("demo", keep=1))
+        assert_equal(["2"], self.store.list_snapshots("demo"))
+        removed, _ = self.store.compact()
+        assert_equal(1, removed)
+
+    def test_split_managed_policies(self):
+        managed_policy = {
+            "Arn": "arn:aws:iam::aws:policy/ReadOnlyAccess",
+            "PolicyVersionList": [{"Document": {}, "IsDefaultVersion": True}],
+        }
+        entries = []
+        for account_id in ["111111111111", "222222222222"]:
+            data = serialize(
+                {
+                    "Policies": [
+                        managed_policy,
+                        {"Arn": "arn:aws:iam::{}:policy/Custom".format(account_id)},
+                    ],
+                    "RoleDetailList": [],
+                }
+            )
+            blob, parts = self.store._put_split_file(data)
+            assert_equal(1, len(parts))
+            entries.append((data, {"blob": blob, "parts": parts}))
+
+        # The managed policy is stored once for both accounts
+        assert_equal(entries[0][1]["parts"], entries[1][1]["parts"])
+        assert_equal(3, self.count_blobs())
+        for data, entry in entries:
+            assert_equal(data, self.store.read(entry))
+
+        # Files that would not be rebuilt exactly are not split
+        assert_true(self.store._put_split_file(b'{"Policies": []}') is None)
+        assert_false(
+            self.store._put_split_file(
+                b'{"Policies":[' + serialize(managed_policy) + b"]}"
+            )
+        )
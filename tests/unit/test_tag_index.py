@@ -0,0 +1,48 @@
+import unittest
+from nose.tools import assert_equal
+
+from commands.prepare import build_region
+from shared.nodes import Account, Region
+from shared.tag_index import TagIndex, build_tag_index
+
+
+class TestTagIndex(unittest.TestCase):
+    def test_match(self):
+        tag_index = TagIndex()
+        tag_index.add(
+            "a", [{"Key": "Env", "Value": "prod"}, {"Key": "Team", "Value": "web"}]
+        )
+        tag_index.add(
+            "b", [{"Key": "Env", "Value": "prod"}, {"Key": "Team", "Value": "db"}]
+        )
+        tag_index.add(
+            "c", [{"Key": "Env", "Value": "dev"}, {"Key": "Team", "Value": "web"}]
+        )
+        tag_index.add("d", None)
+
+        assert_equal(set(["a", "b"]), tag_index.match(["Env=prod"]))
+        assert_equal(set(["a"]), tag_index.match(["Env=prod,Team=web"]))
+        assert_equal(set(["a", "c"]), tag_index.match(["Env=prod,Team=web", "Env=dev"]))
+        assert_equal(set(), tag_index.match(["Env=test"]))
+        assert_equal(set(["a", "b", "c"]), tag_index.get("Team"))
+        assert_equal([], tag_index.get_tags("d"))
+
+    def test_demo(self):
+        account = Account(None, {"id": 123456789012, "name": "demo"})
+        region = Region(account, {"RegionName": "us-east-1"})
+        tag_index = build_tag_index(account, [region])
+        assert_equal(set(["Bastion", "Web1", "Web2"]), set(tag_index.index["Name"]))
+        assert_equal(
+            [{"Key": "Name", "Value": "Bastion"}],
+            tag_index.get_tags(
+                "arn:aws:ec2:us-east-1:123456789012:instance/i-00000000000000000"
+            ),
+        )
+
+        # The nodes of prepare find their tags by their ARN in AWS
+        region, _, _, _ = build_region(account, {"RegionName": "us-east-1"}, {})
+        names = {}
+        for node in region.leaves:
+            for tag in tag_index.get_tags(node.aws_arn):
+                names[tag["Value"]] = node.node_type
+        assert_equal({"Bastion": "ec2", "Web1": "ec2", "Web2": "ec2"}, names)
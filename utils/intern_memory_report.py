@@ -0,0 +1,123 @@
+import argparse
+import gc
+import json
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, ".")
+from shared.query import intern_object_pairs
+
+# Usage: python utils/intern_memory_report.py --accounts 20
+# Generates security group data shaped like ec2-describe-security-groups.json for
+# a number of accounts and regions, and reports the memory used to hold all of it
+# after loading with and without string interning.
+
+REGIONS = [
+    "us-east-1",
+    "us-east-2",
+    "us-west-1",
+    "us-west-2",
+    "eu-west-1",
+    "eu-central-1",
+]
+TAG_KEYS = ["Name", "Env", "Team", "Service", "CostCenter"]
+TAG_VALUES = ["prod", "dev", "staging", "platform", "data", "web", "batch"]
+
+
+def generate_security_groups(account_id, region, count):
+    security_groups = []
+    for i in range(count):
+        vpc_id = "vpc-{:08x}".format(random.randrange(8))
+        rules = []
+        for _ in range(random.randrange(1, 6)):
+            port = random.choice([22, 80, 443, 3306, 5432, 6379])
+            rules.append(
+                {
+                    "FromPort": port,
+                    "IpProtocol": "tcp",
+                    "IpRanges": [
+                        {"CidrIp": random.choice(["10.0.0.0/8", "0.0.0.0/0"])}
+                    ],
+                    "Ipv6Ranges": [],
+                    "PrefixListIds": [],
+                    "ToPort": port,
+                    "UserIdGroupPairs": [
+                        {
+                            "GroupId": "sg-{:08x}".format(random.randrange(count)),
+                            "UserId": account_id,
+                        }
+                    ],
+                }
+            )
+        security_groups.append(
+            {
+                "Description": "Security group {} in {}".format(i, region),
+                "GroupId": "sg-{:08x}".format(i),
+                "GroupName": "group-{}".format(i),
+                "IpPermissions": rules,
+                "IpPermissionsEgress": [
+                    {
+                        "IpProtocol": "-1",
+                        "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
+                        "Ipv6Ranges": [],
+                        "PrefixListIds": [],
+                        "UserIdGroupPairs": [],
+                    }
+                ],
+                "OwnerId": account_id,
+                "Tags": [
+                    {"Key": key, "Value": random.choice(TAG_VALUES)} for key in TAG_KEYS
+                ],
+                "VpcId": vpc_id,
+            }
+        )
+    return json.dumps({"SecurityGroups": security_groups}, indent=4, sort_keys=True)
+
+
+def measure(files, object_pairs_hook):
+    """Returns the bytes allocated to hold all of the decoded files"""
+    gc.collect()
+    tracemalloc.start()
+    loaded = [json.loads(f, object_pairs_hook=object_pairs_hook) for f in files]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del loaded
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", help="Number of accounts", default=20, type=int)
+    parser.add_argument(
+        "--security-groups",
+        help="Number of security groups per region",
+        default=200,
+        type=int,
+        dest="security_groups",
+    )
+    args = parser.parse_args()
+
+    random.seed(0)
+    files = []
+    for i in range(args.accounts):
+        account_id = "{:012d}".format(100000000000 + i)
+        for region in REGIONS:
+            files.append(
+                generate_security_groups(account_id, region, args.security_groups)
+            )
+    print(
+        "Generated {} files, {} MB of json".format(
+            len(files), sum(len(f) for f in files) // (1024 * 1024)
+        )
+    )
+
+    plain = measure(files, None)
+    interned = measure(files, intern_object_pairs)
+    print("Without interning: {:.1f} MB".format(plain / (1024 * 1024)))
+    print("With interning:    {:.1f} MB".format(interned / (1024 * 1024)))
+    print("Savings:           {:.0%}".format(1 - interned / plain))
+
+
+if __name__ == "__main__":
+    main()
@@ -35,29 +35,59 @@ $(window).on('load', function(){
     NProgress.set(0.1);
     akkordion(".akkordion", {});
     
+    // With a filter in the query string, ex. ?regions=us-east-1&tags=Env=prod, the
+    // webserver filters the graph kept by prepare --graph-cache. Other parameters,
+    // such as ?v=2 to avoid a cached copy, keep the map of data.json.
+    var filterParameters = ["regions", "vpc-ids", "vpc-names", "tags", "internal_edges"];
+    var hasFilter = window.location.search.substring(1).split("&").some(function (parameter) {
+        var name = decodeURIComponent(parameter.split("=")[0]);
+        return filterParameters.indexOf(name) > -1;
+    });
+    if (hasFilter) {
+        // Copies of web/ served without the webserver's --graph have no graph.json
+        loadMap("./graph.json" + window.location.search, "./data.json");
+    } else {
+        loadMap("./data.json", null);
+    }
+}); // Page loaded
+
+
+function loadMap(dataUrl, fallbackUrl) {
     $.when(
-        $.getJSON("./data.json"),
+        $.getJSON(dataUrl),
         $.getJSON("./style.json")
     ).done(function(datafile, stylefile) {
+        var layout = {
+            name: 'cose-bilkent',
+            nodeDimensionsIncludeLabels: true,
+            tilingPaddingVertical: 10,
+            tilingPaddingHorizontal: 100
+        };
+        // Maps made with --layout already have the positions of their nodes
+        var hasPositions = datafile[0].some(function (element) {
+            return typeof element.position !== 'undefined';
+        });
+        if (hasPositions) {
+            layout = {name: 'preset'};
+        }
         loadCytoscape({
             wheelSensitivity: 0.1,
             container: document.getElementById('cy'),
             elements: datafile[0],
-            layout: {
-                name: 'cose-bilkent',
-                nodeDimensionsIncludeLabels: true,
-                tilingPaddingVertical: 10,
-                tilingPaddingHorizontal: 100
-            },
+            layout: layout,
             style: stylefile[0]
         });
     })
     .fail(function(e) {
         if (e.status == 404) {
+            if (fallbackUrl !== null) {
+                loadMap(fallbackUrl, null);
+                return;
+            }
             alert("Failed to fetch data!\nPlease run cloudmapper.py prepare before using webserver");
         }
     });
-}); // Page loaded
+}
 
 
 function loadCytoscape(options) {
@@ -93,6 +123,126 @@ function loadCytoscape(options) {
         console.log("Setting edge actions");
     }
 
+    function setNodeActions(nodes) {
+        // Do something when a node is clicked on
+        nodes.on('tap', function( e ){
+            // This function is just to get us to directtap
+            var eventIsDirect = e.target.same( this ); // don't use 2.x cyTarget
+            
+            if( eventIsDirect ){
+                this.emit('directtap');
+            }
+        }).on('directtap', function( e ){
+            // A node has been click on
+            ni.describe(this);
+            
+            e.stopPropagation();
+        });
+    }
+
+    // Maps made with --shards only have a summary of each VPC, whose contents are
+    // in the file named by its shard, loaded when the VPC is double tapped
+    function loadShard(vpc) {
+        if (vpc.data('shardLoaded')) {
+            return;
+        }
+        vpc.data('shardLoaded', true);
+        NProgress.start();
+        $.getJSON("./" + vpc.data('shard')).done(function(shard) {
+            var center = vpc.position();
+            var nodes = [];
+            var edges = [];
+            shard.forEach(function (element) {
+                if (element.data.type === 'edge') {
+                    edges.push(element);
+                } else {
+                    nodes.push(element);
+                }
+            });
+
+            // The edges of the VPC stood for those of its contents
+            cy.remove(vpc.connectedEdges());
+            var added = cy.add(nodes);
+
+            // Edges to VPCs that are not loaded yet go to the VPC instead
+            var edgeIds = {};
+            edges.forEach(function (element) {
+                var data = element.data;
+                var source = cy.getElementById(data.source).nonempty() ? data.source : data.source_owner;
+                var target = cy.getElementById(data.target).nonempty() ? data.target : data.target_owner;
+                var id = source + "->" + target;
+                if (source === target || edgeIds[id] || cy.getElementById(id).nonempty()) {
+                    return;
+                }
+                edgeIds[id] = true;
+                added = added.union(cy.add({
+                    group: 'edges',
+                    data: $.extend({}, data, {id: id, source: source, target: target}),
+                    classes: element.classes
+                }));
+            });
+
+            // Without positions from --layout, lay out the contents where the VPC was
+            var hasPositions = nodes.some(function (element) {
+                return typeof element.position !== 'undefined';
+            });
+            if (!hasPositions) {
+                var leaves = added.nodes().filter(':childless');
+                leaves.union(added.edges()).layout({
+                    name: 'cose-bilkent',
+                    nodeDimensionsIncludeLabels: true,
+                    randomize: true,
+                    fit: false,
+                    animate: false
+                }).run();
+                var box = leaves.boundingBox();
+                var dx = center.x - (box.x1 + box.x2) / 2;
+                var dy = center.y - (box.y1 + box.y2) / 2;
+                leaves.positions(function (node) {
+                    return {x: node.position('x') + dx, y: node.position('y') + dy};
+                });
+            }
+
+            setNodeActions(added.nodes());
+            setEdgeActions();
+            NProgress.done();
+        }).fail(function () {
+            vpc.data('shardLoaded', false);
+            NProgress.done();
+            alert("Failed to fetch " + vpc.data('shard'));
+        });
+    }
+
+    // Edges made with --sg-edges stand for a connection from each of their source
+    // members to each of their target members. Double tapping one replaces it with
+    // those connections, for the members that are on the map.
+    function expandGroupEdge(edge) {
+        var sources = edge.data('source_members');
+        var targets = edge.data('target_members');
+        if (!sources || !targets) {
+            return;
+        }
+        var added = cy.collection();
+        sources.forEach(function (source) {
+            targets.forEach(function (target) {
+                var id = source + "->" + target;
+                if (source === target || cy.getElementById(source).empty() ||
+                    cy.getElementById(target).empty() || cy.getElementById(id).nonempty()) {
+                    return;
+                }
+                added = added.union(cy.add({
+                    group: 'edges',
+                    data: {id: id, source: source, target: target, type: 'edge', node_data: edge.data('node_data')},
+                    classes: edge.classes().join(' ')
+                }));
+            });
+        });
+        if (added.nonempty()) {
+            cy.remove(edge);
+            setEdgeActions();
+        }
+    }
+
     // Add ability to expand and collapse nodes
     cy.expandCollapse({
         layoutBy: {
@@ -274,7 +424,23 @@ function loadCytoscape(options) {
             tappedBefore = tappedNow;
         }
     });  
+    var edgeTappedBefore;
+    cy.on('tap', 'edge', function (event) {
+        var edge = this;
+        setTimeout(function () {
+            edgeTappedBefore = null;
+        }, 300);
+        if (edgeTappedBefore && edgeTappedBefore.id() === edge.id()) {
+            edgeTappedBefore = null;
+            expandGroupEdge(edge);
+        } else {
+            edgeTappedBefore = edge;
+        }
+    });
     cy.on('doubleTap', 'node', function (event) {
+        if (this.data('shard')) {
+            loadShard(this);
+        }
         var hiddenEles = cy.$(":selected").neighborhood().filter(':hidden');
         var actions = [];
         var nodesWithHiddenNeighbor = (hiddenEles.neighborhood(":visible").nodes("[thickBorder]"))
@@ -318,21 +484,7 @@ function loadCytoscape(options) {
     // Provide viewing area for when a node is clicked on
     var ni = cy.ni = cy.nodeInfo();
 
-    // Do something when a node is clicked on
-    cy.nodes().on('tap', function( e ){
-        // This function is just to get us to directtap
-        var eventIsDirect = e.target.same( this ); // don't use 2.x cyTarget
-        
-        if( eventIsDirect ){
-            this.emit('directtap');
-        }
-    }).on('directtap', function( e ){
-        // A node has been click on
-        ni.describe(this);
-        
-        e.stopPropagation();
-    });
-
+    setNodeActions(cy.nodes());
     setEdgeActions();
 
     //
@@ -66,9 +66,31 @@ THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
             }
             
             var details = $('#Details');
-            if (typeof n.data().node_data !== 'undefined') {
+            if (typeof n.data().node_data_ref !== 'undefined') {
+                // Resources in more than one subnet refer to their data by ARN,
+                // which is stored once in a node_data element for the region
+                n.cy().nodes('[type = "node_data"]').forEach(function (table) {
+                    var nodeData = table.data().node_data[n.data().node_data_ref];
+                    if (typeof nodeData !== 'undefined') {
+                        details.empty();
+                        details.append('<pre id="nodeDetails" class="frame">'+JSON.stringify(nodeData, null, 4)+'</pre>');
+                    }
+                });
+            } else if (typeof n.data().node_data !== 'undefined') {
+                var nodeData = n.data().node_data;
+                if (n.data().type == "edge" && Array.isArray(nodeData)) {
+                    // Edges refer to the security groups allowing them by id, which are
+                    // stored once in a security_groups element
+                    var securityGroups = {};
+                    n.cy().nodes('[type = "security_groups"]').forEach(function (table) {
+                        $.extend(securityGroups, table.data().node_data);
+                    });
+                    nodeData = nodeData.map(function (reason) {
+                        return securityGroups[reason] || reason;
+                    });
+                }
                 details.empty();
-                details.append('<pre id="nodeDetails" class="frame">'+JSON.stringify(n.data().node_data, null, 4)+'</pre>');
+                details.append('<pre id="nodeDetails" class="frame">'+JSON.stringify(nodeData, null, 4)+'</pre>');
             }
 
 